@@ -0,0 +1,49 @@
+
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+TARGETS = {
+    "cli --help": [sys.executable, "main.py", "--help"],
+    "import web.app": [sys.executable, "-c", "import web.app"],
+}
+
+
+def measure(command, runs: int):
+
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    # One untimed run so bytecode and the OS file cache are warm.
+    subprocess.run(command, cwd=ROOT, env=env, capture_output=True, check=True)
+
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = subprocess.run(command, cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings, result.stdout
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Measure process startup time for the CLI and web app")
+    parser.add_argument("--runs", "-n", type=int, default=10, help="Timed runs per target (default: 10)")
+    args = parser.parse_args()
+
+    print(f"{'target':<16} {'min ms':>8} {'median ms':>10} {'max ms':>8}")
+    for name, command in TARGETS.items():
+        timings, stdout = measure(command, args.runs)
+        print(f"{name:<16} {min(timings):>8.1f} {statistics.median(timings):>10.1f} {max(timings):>8.1f}")
+        # Importing must stay quiet; any output means work at import time.
+        if name.startswith("import") and stdout.strip():
+            print(f"  warning: import printed output: {stdout.strip().splitlines()[0]}")
+
+
+if __name__ == "__main__":
+    main()
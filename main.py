@@ -2,7 +2,6 @@
 
 import sys
 import argparse
-from src.cli.main import main as cli_main
 
 
 def main():
@@ -31,6 +30,9 @@ For more information, see README.md
         import os
         os.environ["VERBOSE"] = "true"
 
+    # Imported only once arguments parse, so --help stays instant.
+    from src.cli.main import main as cli_main
+
     try:
         cli_main()
     except KeyboardInterrupt:
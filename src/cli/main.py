@@ -7,7 +7,7 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../.
 
 from src.cli.display import CLIDisplay, console
 from src.rag.pipeline import RAGPipeline
-from src.rag.llm import llm  
+from src.rag.llm import get_llm, get_stage_llms
 from rich.prompt import Prompt
 
 
@@ -25,7 +25,7 @@ class ClashRoyaleCLI:
         self.display.print_info("Loading language model...")
 
         try:
-            self.pipeline = RAGPipeline(llm, verbose=self.verbose)
+            self.pipeline = RAGPipeline(get_llm(), verbose=self.verbose, stage_llms=get_stage_llms())
 
             if not self.pipeline.test_connection():
                 self.display.print_error("Failed to connect to Neo4j database")
@@ -151,6 +151,15 @@ class ClashRoyaleCLI:
                     self.display.print_info("Cypher Query:")
                     console.print(f"[dim]{content['cypher']}[/dim]")
 
+                usage = content.get("llm_usage")
+                if self.verbose and usage and (usage.get("calls") or usage.get("coalesced")):
+                    cost = f", ${usage['cost_usd']:.4f}" if usage.get("cost_usd") is not None else ""
+                    shared = f" (+{usage['coalesced']} shared)" if usage.get("coalesced") else ""
+                    console.print(
+                        f"[dim]LLM: {usage['calls']} calls{shared}, {usage['prompt_tokens']} prompt + "
+                        f"{usage['completion_tokens']} completion tokens, {usage['wall_ms']:.0f} ms{cost}[/dim]"
+                    )
+
         console.print()
 
     def handle_command(self, command: str):
@@ -157,6 +157,8 @@ class QueryResult:
     cypher_query: str
     execution_time: float
     error: Optional[str] = None
+    parameters: Dict[str, Any] = field(default_factory=dict)
+    fingerprint: Optional[str] = None
 
 
 @dataclass
@@ -168,6 +170,8 @@ class RAGResponse:
     retrieved_data: List[Dict[str, Any]]
     sources: List[str] = field(default_factory=list)
     confidence: Optional[float] = None
+    cached: bool = False
+    llm_usage: Optional[Dict[str, Any]] = None
 
     def to_dict(self) -> Dict[str, Any]:
         
@@ -178,4 +182,16 @@ class RAGResponse:
             "retrieved_data": self.retrieved_data,
             "sources": self.sources,
             "confidence": self.confidence,
+            "cached": self.cached,
+            "llm_usage": self.llm_usage,
         }
+
+
+@dataclass
+class LLMResponse:
+    
+    content: str
+    usage: Dict[str, int] = field(default_factory=dict)
+
+    def __str__(self) -> str:
+        return self.content
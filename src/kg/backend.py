@@ -0,0 +1,88 @@
+
+
+import os
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from typing import Dict, List, Any, Optional
+
+from src.kg.memory_graph import InMemoryGraph
+from src.kg.cypher_engine import CypherEngine
+
+
+@dataclass
+class BackendResult:
+
+    records: List[Dict[str, Any]] = field(default_factory=list)
+    result_available_after: Optional[float] = None
+    result_consumed_after: Optional[float] = None
+
+
+class GraphBackend(ABC):
+
+
+    @abstractmethod
+    def run(self, query: str, parameters: Optional[Dict[str, Any]] = None) -> BackendResult:
+        ...
+
+    def close(self):
+        pass
+
+
+class Neo4jBackend(GraphBackend):
+
+
+    def __init__(self, uri: str, user: str, password: str):
+        from neo4j import GraphDatabase
+
+        self.driver = GraphDatabase.driver(uri, auth=(user, password))
+
+    def run(self, query: str, parameters: Optional[Dict[str, Any]] = None) -> BackendResult:
+
+        with self.driver.session() as session:
+            result = session.run(query, parameters or {})
+            records = [record.data() for record in result]
+            summary = result.consume()
+            return BackendResult(
+                records=records,
+                result_available_after=summary.result_available_after,
+                result_consumed_after=summary.result_consumed_after,
+            )
+
+    def close(self):
+
+        self.driver.close()
+
+
+class InMemoryBackend(GraphBackend):
+
+
+    def __init__(self, graph: InMemoryGraph):
+        self.graph = graph
+        self.engine = CypherEngine(graph)
+
+    def run(self, query: str, parameters: Optional[Dict[str, Any]] = None) -> BackendResult:
+
+        start = time.perf_counter()
+        records = self.engine.execute(query, parameters or {})
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        # There is no separate consume phase; report the whole run as planning
+        # plus execution so latency breakdowns stay comparable with Neo4j.
+        return BackendResult(records=records, result_available_after=elapsed_ms, result_consumed_after=0)
+
+
+def create_backend(uri: str = None, user: str = None, password: str = None) -> GraphBackend:
+
+    kind = os.getenv("GRAPH_BACKEND", "neo4j").lower()
+    if kind == "memory":
+        from src.kg.ingestion import load_memory_graph
+
+        return InMemoryBackend(load_memory_graph(os.getenv("GRAPH_DATA_PATH")))
+    if kind != "neo4j":
+        raise ValueError(f"Unknown GRAPH_BACKEND '{kind}'. Valid options: 'neo4j' or 'memory'")
+
+    return Neo4jBackend(
+        uri or os.getenv("NEO4J_URI", "bolt://localhost:7687"),
+        user or os.getenv("NEO4J_USER", "neo4j"),
+        password or os.getenv("NEO4J_PASSWORD", "12345678"),
+    )
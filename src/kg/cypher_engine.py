@@ -0,0 +1,1391 @@
+
+
+import math
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from functools import cmp_to_key
+from typing import Dict, List, Any, Optional, Iterator, Tuple
+
+from src.kg.cypher_lexer import (
+    Token, tokenize, significant, unquote, parse_number,
+    STRING, NUMBER, IDENT, OP, PARAM, BACKTICK,
+)
+from src.kg.memory_graph import InMemoryGraph, Node, Relationship
+
+
+class CypherEngineError(Exception):
+    pass
+
+
+class CypherUnsupportedError(CypherEngineError):
+
+    # Valid Cypher that only Neo4j can run; callers can tell it apart from a
+    # query that is simply wrong.
+    def __init__(self, construct: str):
+        super().__init__(f"{construct} not supported by the in-memory backend (GRAPH_BACKEND=memory)")
+        self.construct = construct
+
+
+AGGREGATES = {"count", "collect", "sum", "avg", "min", "max"}
+WRITE_CLAUSES = {"CREATE", "MERGE", "DELETE", "DETACH", "SET", "REMOVE", "DROP", "LOAD", "FOREACH"}
+
+
+class Expr:
+
+    def evaluate(self, row: Dict[str, Any], ctx: "_Context", group: List[Dict[str, Any]] = None):
+        raise NotImplementedError
+
+    def children(self) -> List["Expr"]:
+        return []
+
+    def has_aggregate(self) -> bool:
+        return any(child.has_aggregate() for child in self.children())
+
+
+class Literal(Expr):
+
+    def __init__(self, value):
+        self.value = value
+
+    def evaluate(self, row, ctx, group=None):
+        return self.value
+
+
+class Parameter(Expr):
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def evaluate(self, row, ctx, group=None):
+        if self.name not in ctx.parameters:
+            raise CypherEngineError(f"Expected parameter(s): {self.name}")
+        return ctx.parameters[self.name]
+
+
+class Variable(Expr):
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def evaluate(self, row, ctx, group=None):
+        if self.name not in row:
+            raise CypherEngineError(f"Variable `{self.name}` not defined")
+        return row[self.name]
+
+
+class Property(Expr):
+
+    def __init__(self, subject: Expr, key: str):
+        self.subject = subject
+        self.key = key
+
+    def children(self):
+        return [self.subject]
+
+    def evaluate(self, row, ctx, group=None):
+        value = self.subject.evaluate(row, ctx, group)
+        if value is None:
+            return None
+        if isinstance(value, (Node, Relationship)):
+            return value.properties.get(self.key)
+        if isinstance(value, dict):
+            return value.get(self.key)
+        raise CypherEngineError(f"Type mismatch: expected a map, node or relationship but was {type(value).__name__}")
+
+
+class Index(Expr):
+
+    def __init__(self, subject: Expr, index: Expr):
+        self.subject = subject
+        self.index = index
+
+    def children(self):
+        return [self.subject, self.index]
+
+    def evaluate(self, row, ctx, group=None):
+        value = self.subject.evaluate(row, ctx, group)
+        index = self.index.evaluate(row, ctx, group)
+        if value is None or index is None:
+            return None
+        if isinstance(value, list) and isinstance(index, int):
+            return value[index] if -len(value) <= index < len(value) else None
+        if isinstance(value, dict):
+            return value.get(index)
+        if isinstance(value, (Node, Relationship)):
+            return value.properties.get(index)
+        raise CypherEngineError("Type mismatch in subscript expression")
+
+
+class Slice(Expr):
+
+    def __init__(self, subject: Expr, start: Optional[Expr], end: Optional[Expr]):
+        self.subject = subject
+        self.start = start
+        self.end = end
+
+    def children(self):
+        return [e for e in (self.subject, self.start, self.end) if e is not None]
+
+    def evaluate(self, row, ctx, group=None):
+        value = self.subject.evaluate(row, ctx, group)
+        start = self.start.evaluate(row, ctx, group) if self.start is not None else 0
+        end = self.end.evaluate(row, ctx, group) if self.end is not None else None
+        if value is None or start is None or (self.end is not None and end is None):
+            return None
+        if not isinstance(value, list) or not isinstance(start, int) or not isinstance(end, (int, type(None))):
+            raise CypherEngineError("Type mismatch in list slice")
+        return value[start:end]
+
+
+class ListExpr(Expr):
+
+    def __init__(self, items: List[Expr]):
+        self.items = items
+
+    def children(self):
+        return self.items
+
+    def evaluate(self, row, ctx, group=None):
+        return [item.evaluate(row, ctx, group) for item in self.items]
+
+
+class MapExpr(Expr):
+
+    def __init__(self, entries: List[Tuple[str, Expr]]):
+        self.entries = entries
+
+    def children(self):
+        return [expr for _, expr in self.entries]
+
+    def evaluate(self, row, ctx, group=None):
+        return {key: expr.evaluate(row, ctx, group) for key, expr in self.entries}
+
+
+class Unary(Expr):
+
+    def __init__(self, op: str, operand: Expr):
+        self.op = op
+        self.operand = operand
+
+    def children(self):
+        return [self.operand]
+
+    def evaluate(self, row, ctx, group=None):
+        value = self.operand.evaluate(row, ctx, group)
+        if value is None:
+            return None
+        if self.op == "NOT":
+            if not isinstance(value, bool):
+                raise CypherEngineError("Type mismatch: expected Boolean for NOT")
+            return not value
+        if self.op == "-":
+            if not _is_number(value):
+                raise CypherEngineError("Type mismatch: expected a number for unary minus")
+            return -value
+        return value
+
+
+class IsNull(Expr):
+
+    def __init__(self, operand: Expr, negated: bool):
+        self.operand = operand
+        self.negated = negated
+
+    def children(self):
+        return [self.operand]
+
+    def evaluate(self, row, ctx, group=None):
+        is_null = self.operand.evaluate(row, ctx, group) is None
+        return not is_null if self.negated else is_null
+
+
+class Binary(Expr):
+
+    def __init__(self, op: str, left: Expr, right: Expr):
+        self.op = op
+        self.left = left
+        self.right = right
+
+    def children(self):
+        return [self.left, self.right]
+
+    def evaluate(self, row, ctx, group=None):
+        op = self.op
+        if op in ("AND", "OR", "XOR"):
+            return _logical(op, self.left.evaluate(row, ctx, group), lambda: self.right.evaluate(row, ctx, group))
+
+        left = self.left.evaluate(row, ctx, group)
+        right = self.right.evaluate(row, ctx, group)
+
+        if op == "=":
+            return _equals(left, right)
+        if op in ("<>", "!="):
+            result = _equals(left, right)
+            return None if result is None else not result
+        if op in ("<", "<=", ">", ">="):
+            return _compare(op, left, right)
+        if op == "IN":
+            return _in_list(left, right)
+        if left is None or right is None:
+            return None
+        if op in ("CONTAINS", "STARTS WITH", "ENDS WITH"):
+            if not isinstance(left, str) or not isinstance(right, str):
+                return None
+            if op == "CONTAINS":
+                return right in left
+            if op == "STARTS WITH":
+                return left.startswith(right)
+            return left.endswith(right)
+        if op == "=~":
+            if not isinstance(left, str) or not isinstance(right, str):
+                return None
+            return re.fullmatch(right, left) is not None
+        return _arithmetic(op, left, right)
+
+
+class FunctionCall(Expr):
+
+    def __init__(self, name: str, args: List[Expr], distinct: bool = False, star: bool = False):
+        self.name = name.lower()
+        self.args = args
+        self.distinct = distinct
+        self.star = star
+
+    def children(self):
+        return self.args
+
+    def has_aggregate(self):
+        return self.name in AGGREGATES or super().has_aggregate()
+
+    def evaluate(self, row, ctx, group=None):
+        if self.name in AGGREGATES:
+            if group is None:
+                raise CypherEngineError(f"Invalid use of aggregating function {self.name}(...) in this context")
+            return self._aggregate(group, ctx)
+
+        func = _FUNCTIONS.get(self.name)
+        if func is None:
+            raise CypherEngineError(f"Unknown function '{self.name}'")
+        args = [arg.evaluate(row, ctx, group) for arg in self.args]
+        if self.name != "coalesce" and args and args[0] is None:
+            return None
+        try:
+            return func(*args)
+        except CypherEngineError:
+            raise
+        except Exception as e:
+            raise CypherEngineError(f"Error in function {self.name}: {e}")
+
+    def _aggregate(self, group, ctx):
+        if self.star:
+            return len(group)
+        if len(self.args) != 1:
+            raise CypherEngineError(f"{self.name}() expects exactly one argument")
+
+        values = [self.args[0].evaluate(r, ctx) for r in group]
+        values = [v for v in values if v is not None]
+        if self.distinct:
+            seen, unique = set(), []
+            for value in values:
+                key = _hashable(value)
+                if key not in seen:
+                    seen.add(key)
+                    unique.append(value)
+            values = unique
+
+        if self.name == "count":
+            return len(values)
+        if self.name == "collect":
+            return values
+        if not values:
+            return 0 if self.name == "sum" else None
+        if self.name == "sum":
+            return sum(values)
+        if self.name == "avg":
+            return sum(values) / len(values)
+        ordered = sorted(values, key=cmp_to_key(_order_compare))
+        return ordered[0] if self.name == "min" else ordered[-1]
+
+
+class CaseExpr(Expr):
+
+    def __init__(self, subject: Optional[Expr], whens: List[Tuple[Expr, Expr]], default: Optional[Expr]):
+        self.subject = subject
+        self.whens = whens
+        self.default = default
+
+    def children(self):
+        nodes = [e for pair in self.whens for e in pair]
+        if self.subject is not None:
+            nodes.append(self.subject)
+        if self.default is not None:
+            nodes.append(self.default)
+        return nodes
+
+    def evaluate(self, row, ctx, group=None):
+        subject = self.subject.evaluate(row, ctx, group) if self.subject is not None else None
+        for condition, result in self.whens:
+            value = condition.evaluate(row, ctx, group)
+            matched = _equals(subject, value) if self.subject is not None else value
+            if matched is True:
+                return result.evaluate(row, ctx, group)
+        return self.default.evaluate(row, ctx, group) if self.default is not None else None
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _logical(op, left, right_thunk):
+    if left is not None and not isinstance(left, bool):
+        raise CypherEngineError(f"Type mismatch: expected Boolean for {op}")
+    if op == "AND" and left is False:
+        return False
+    if op == "OR" and left is True:
+        return True
+    right = right_thunk()
+    if right is not None and not isinstance(right, bool):
+        raise CypherEngineError(f"Type mismatch: expected Boolean for {op}")
+    if op == "AND":
+        if right is False:
+            return False
+        return None if left is None or right is None else True
+    if op == "OR":
+        if right is True:
+            return True
+        return None if left is None or right is None else False
+    if left is None or right is None:
+        return None
+    return left != right
+
+
+def _equals(left, right):
+    if left is None or right is None:
+        return None
+    if isinstance(left, (Node, Relationship)) or isinstance(right, (Node, Relationship)):
+        return left is right
+    if _is_number(left) and _is_number(right):
+        return left == right
+    if type(left) is not type(right):
+        if isinstance(left, list) and isinstance(right, list):
+            pass
+        else:
+            return False
+    if isinstance(left, list):
+        if len(left) != len(right):
+            return False
+        results = [_equals(a, b) for a, b in zip(left, right)]
+        if False in results:
+            return False
+        return None if None in results else True
+    return left == right
+
+
+def _compare(op, left, right):
+    if left is None or right is None:
+        return None
+    if _is_number(left) and _is_number(right):
+        pass
+    elif isinstance(left, str) and isinstance(right, str):
+        pass
+    elif isinstance(left, bool) and isinstance(right, bool):
+        pass
+    else:
+        return None
+    if op == "<":
+        return left < right
+    if op == "<=":
+        return left <= right
+    if op == ">":
+        return left > right
+    return left >= right
+
+
+def _in_list(value, items):
+    if items is None:
+        return None
+    if not isinstance(items, list):
+        raise CypherEngineError("Type mismatch: expected a list after IN")
+    saw_null = False
+    for item in items:
+        result = _equals(value, item)
+        if result is True:
+            return True
+        if result is None:
+            saw_null = True
+    return None if saw_null else False
+
+
+def _arithmetic(op, left, right):
+    if op == "+":
+        if isinstance(left, list):
+            return left + (right if isinstance(right, list) else [right])
+        if isinstance(right, list):
+            return [left] + right
+        if isinstance(left, str) or isinstance(right, str):
+            return _to_string(left) + _to_string(right)
+    if not _is_number(left) or not _is_number(right):
+        raise CypherEngineError(f"Type mismatch: cannot apply {op} to {type(left).__name__} and {type(right).__name__}")
+    if op == "+":
+        return left + right
+    if op == "-":
+        return left - right
+    if op == "*":
+        return left * right
+    if op == "/":
+        if isinstance(left, int) and isinstance(right, int):
+            if right == 0:
+                raise CypherEngineError("/ by zero")
+            return int(left / right)
+        return left / right if right else (math.copysign(math.inf, left) if left else math.nan)
+    if op == "%":
+        if right == 0:
+            raise CypherEngineError("/ by zero")
+        return math.fmod(left, right) if isinstance(left, float) or isinstance(right, float) else int(math.fmod(left, right))
+    if op == "^":
+        return float(left) ** float(right)
+    raise CypherEngineError(f"Unsupported operator {op}")
+
+
+def _hashable(value):
+    if isinstance(value, (Node, Relationship)):
+        return (type(value).__name__, value.id)
+    if isinstance(value, list):
+        return ("list", tuple(_hashable(v) for v in value))
+    if isinstance(value, dict):
+        return ("map", tuple(sorted((k, _hashable(v)) for k, v in value.items())))
+    if _is_number(value):
+        return ("num", value)
+    return (type(value).__name__, value)
+
+
+_TYPE_ORDER = {dict: 0, Node: 1, Relationship: 2, list: 3, str: 5, bool: 6}
+
+
+def _order_compare(left, right) -> int:
+    # Ascending order puts nulls last, matching Neo4j.
+    if left is None or right is None:
+        if left is None and right is None:
+            return 0
+        return 1 if left is None else -1
+    left_rank = 7 if _is_number(left) else _TYPE_ORDER.get(type(left), 8)
+    right_rank = 7 if _is_number(right) else _TYPE_ORDER.get(type(right), 8)
+    if left_rank != right_rank:
+        return -1 if left_rank < right_rank else 1
+    if isinstance(left, (Node, Relationship)):
+        left, right = left.id, right.id
+    elif isinstance(left, list):
+        for a, b in zip(left, right):
+            result = _order_compare(a, b)
+            if result:
+                return result
+        left, right = len(left), len(right)
+    elif isinstance(left, dict):
+        left, right = len(left), len(right)
+    if left < right:
+        return -1
+    return 1 if left > right else 0
+
+
+def _to_string(value):
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+def _to_integer(value):
+    if isinstance(value, bool):
+        return int(value)
+    if _is_number(value):
+        return int(value)
+    try:
+        return int(float(str(value).strip()))
+    except ValueError:
+        return None
+
+
+def _to_float(value):
+    if _is_number(value):
+        return float(value)
+    try:
+        return float(str(value).strip())
+    except ValueError:
+        return None
+
+
+def _to_boolean(value):
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    return True if text == "true" else False if text == "false" else None
+
+
+def _substring(value, start, length=None):
+    return value[start:] if length is None else value[start:start + length]
+
+
+def _coalesce(*args):
+    for arg in args:
+        if arg is not None:
+            return arg
+    return None
+
+
+def _size(value):
+    if isinstance(value, (str, list)):
+        return len(value)
+    raise CypherEngineError("Type mismatch: size() expects a string or a list")
+
+
+_FUNCTIONS = {
+    "tolower": lambda s: s.lower(),
+    "lower": lambda s: s.lower(),
+    "toupper": lambda s: s.upper(),
+    "upper": lambda s: s.upper(),
+    "tostring": _to_string,
+    "tointeger": _to_integer,
+    "toint": _to_integer,
+    "tofloat": _to_float,
+    "toboolean": _to_boolean,
+    "trim": lambda s: s.strip(),
+    "ltrim": lambda s: s.lstrip(),
+    "rtrim": lambda s: s.rstrip(),
+    "split": lambda s, d: s.split(d),
+    "replace": lambda s, a, b: s.replace(a, b),
+    "substring": _substring,
+    "left": lambda s, n: s[:n],
+    "right": lambda s, n: s[-n:] if n else "",
+    "reverse": lambda v: v[::-1],
+    "size": _size,
+    "length": _size,
+    "coalesce": _coalesce,
+    "head": lambda v: v[0] if v else None,
+    "last": lambda v: v[-1] if v else None,
+    "tail": lambda v: v[1:],
+    "labels": lambda n: sorted(n.labels),
+    "type": lambda r: r.type,
+    "keys": lambda v: list(v.properties if isinstance(v, (Node, Relationship)) else v),
+    "properties": lambda v: dict(v.properties if isinstance(v, (Node, Relationship)) else v),
+    "id": lambda v: v.id,
+    "elementid": lambda v: str(v.id),
+    "abs": abs,
+    "round": lambda v, p=0: round(v, int(p)) if p else float(round(v)),
+    "ceil": lambda v: float(math.ceil(v)),
+    "floor": lambda v: float(math.floor(v)),
+    "sqrt": math.sqrt,
+    "exists": lambda v: v is not None,
+    "range": lambda a, b, step=1: list(range(a, b + (1 if step > 0 else -1), step)),
+}
+
+
+@dataclass
+class NodePattern:
+    variable: Optional[str]
+    labels: List[str]
+    properties: List[Tuple[str, Expr]]
+
+
+@dataclass
+class RelPattern:
+    variable: Optional[str]
+    types: List[str]
+    properties: List[Tuple[str, Expr]]
+    direction: str  # "out", "in" or "both"
+
+    def flipped(self) -> "RelPattern":
+        direction = {"out": "in", "in": "out"}.get(self.direction, self.direction)
+        return RelPattern(self.variable, self.types, self.properties, direction)
+
+
+@dataclass
+class PatternChain:
+    nodes: List[NodePattern]
+    rels: List[RelPattern]
+
+    def variables(self) -> List[str]:
+        names = [n.variable for n in self.nodes] + [r.variable for r in self.rels]
+        return [name for name in names if name]
+
+
+@dataclass
+class MatchClause:
+    optional: bool
+    patterns: List[PatternChain]
+    where: Optional[Expr] = None
+
+
+@dataclass
+class ReturnItem:
+    expr: Expr
+    alias: str
+
+
+@dataclass
+class ProjectionClause:
+    kind: str
+    distinct: bool
+    items: List[ReturnItem]
+    star: bool = False
+    order: List[Tuple[Expr, bool]] = field(default_factory=list)
+    skip: Optional[Expr] = None
+    limit: Optional[Expr] = None
+    where: Optional[Expr] = None
+
+
+@dataclass
+class UnwindClause:
+    expr: Expr
+    alias: str
+
+
+@dataclass
+class CallClause:
+    query: "QueryPlan"
+
+
+@dataclass
+class QueryPlan:
+    parts: List[List[Any]]
+    union_all: List[bool]
+
+
+class _Parser:
+
+    def __init__(self, text: str):
+        self.text = text
+        self.tokens = significant(tokenize(text))
+        self.pos = 0
+
+
+    def peek(self, offset: int = 0) -> Optional[Token]:
+        index = self.pos + offset
+        return self.tokens[index] if index < len(self.tokens) else None
+
+    def advance(self) -> Token:
+        token = self.peek()
+        if token is None:
+            raise CypherEngineError("Unexpected end of input")
+        self.pos += 1
+        return token
+
+    def at_keyword(self, *words: str, offset: int = 0) -> bool:
+        token = self.peek(offset)
+        return token is not None and token.kind == IDENT and token.upper in words
+
+    def at_op(self, *ops: str, offset: int = 0) -> bool:
+        token = self.peek(offset)
+        return token is not None and token.kind == OP and token.text in ops
+
+    def accept_keyword(self, *words: str) -> bool:
+        if self.at_keyword(*words):
+            self.pos += 1
+            return True
+        return False
+
+    def accept_op(self, *ops: str) -> Optional[str]:
+        if self.at_op(*ops):
+            return self.advance().text
+        return None
+
+    def expect_keyword(self, word: str):
+        if not self.accept_keyword(word):
+            self._fail(f"expected {word}")
+
+    def expect_op(self, op: str):
+        if not self.accept_op(op):
+            self._fail(f"expected '{op}'")
+
+    def identifier(self) -> str:
+        token = self.advance()
+        if token.kind == IDENT:
+            return token.text
+        if token.kind == BACKTICK:
+            return token.text[1:-1].replace("``", "`")
+        self.pos -= 1
+        self._fail("expected an identifier")
+
+    def _fail(self, message: str):
+        token = self.peek()
+        where = f"'{token.text}' (offset {token.position})" if token else "end of input"
+        raise CypherEngineError(f"Invalid input {where}: {message}")
+
+
+    def parse(self) -> QueryPlan:
+        plan = self.parse_query()
+        if self.peek() is not None:
+            self._fail("unexpected trailing input")
+        return plan
+
+    def parse_query(self) -> QueryPlan:
+        parts = [self.parse_single_query()]
+        union_all = []
+        while self.accept_keyword("UNION"):
+            union_all.append(self.accept_keyword("ALL"))
+            parts.append(self.parse_single_query())
+        return QueryPlan(parts, union_all)
+
+    def parse_single_query(self) -> List[Any]:
+        clauses = []
+        while self.peek() is not None and not self.at_keyword("UNION") and not self.at_op("}"):
+            if self.at_op(";"):
+                self.advance()
+                continue
+            if self.accept_keyword("OPTIONAL"):
+                self.expect_keyword("MATCH")
+                clauses.append(self.parse_match(optional=True))
+            elif self.accept_keyword("MATCH"):
+                clauses.append(self.parse_match(optional=False))
+            elif self.accept_keyword("WITH"):
+                clauses.append(self.parse_projection("WITH"))
+            elif self.accept_keyword("RETURN"):
+                clauses.append(self.parse_projection("RETURN"))
+            elif self.accept_keyword("UNWIND"):
+                expr = self.parse_expression()
+                self.expect_keyword("AS")
+                clauses.append(UnwindClause(expr, self.identifier()))
+            elif self.accept_keyword("CALL"):
+                if not self.accept_op("{"):
+                    raise CypherUnsupportedError("Procedure calls are")
+                sub = self.parse_query()
+                self.expect_op("}")
+                clauses.append(CallClause(sub))
+            elif self.peek().kind == IDENT and self.peek().upper in WRITE_CLAUSES:
+                raise CypherUnsupportedError(f"{self.peek().upper} (a write clause) is")
+            else:
+                self._fail("expected a clause")
+        if not clauses:
+            self._fail("empty query")
+        return clauses
+
+    def parse_match(self, optional: bool) -> MatchClause:
+        patterns = [self.parse_chain()]
+        while self.accept_op(","):
+            patterns.append(self.parse_chain())
+        where = self.parse_expression() if self.accept_keyword("WHERE") else None
+        return MatchClause(optional, patterns, where)
+
+    def parse_chain(self) -> PatternChain:
+        if self.peek() is not None and self.peek().kind == IDENT and self.at_op("=", offset=1):
+            raise CypherUnsupportedError("Named paths are")
+        nodes = [self.parse_node()]
+        rels = []
+        while self.at_op("-", "<-"):
+            rels.append(self.parse_relationship())
+            nodes.append(self.parse_node())
+        return PatternChain(nodes, rels)
+
+    def parse_node(self) -> NodePattern:
+        self.expect_op("(")
+        variable = None
+        if self.peek() is not None and self.peek().kind in (IDENT, BACKTICK):
+            variable = self.identifier()
+        labels = []
+        while self.accept_op(":"):
+            labels.append(self.identifier())
+        properties = self.parse_map_entries() if self.at_op("{") else []
+        self.expect_op(")")
+        return NodePattern(variable, labels, properties)
+
+    def parse_relationship(self) -> RelPattern:
+        left = self.advance().text == "<-"
+        variable, types, properties = None, [], []
+        if self.accept_op("["):
+            if self.peek() is not None and self.peek().kind in (IDENT, BACKTICK):
+                variable = self.identifier()
+            if self.accept_op(":"):
+                types.append(self.identifier())
+                while self.accept_op("|"):
+                    self.accept_op(":")
+                    types.append(self.identifier())
+            if self.at_op("*"):
+                raise CypherUnsupportedError("Variable-length relationships are")
+            if self.at_op("{"):
+                properties = self.parse_map_entries()
+            self.expect_op("]")
+        end = self.accept_op("-", "->")
+        if end is None:
+            self._fail("expected '-' or '->' to close the relationship")
+        right = end == "->"
+        if left and not right:
+            direction = "in"
+        elif right and not left:
+            direction = "out"
+        else:
+            direction = "both"
+        return RelPattern(variable, types, properties, direction)
+
+    def parse_projection(self, kind: str) -> ProjectionClause:
+        distinct = self.accept_keyword("DISTINCT")
+        star = False
+        items = []
+        if self.accept_op("*"):
+            star = True
+            if self.accept_op(","):
+                items = self.parse_items()
+        else:
+            items = self.parse_items()
+
+        clause = ProjectionClause(kind, distinct, items, star)
+        if self.accept_keyword("ORDER"):
+            self.expect_keyword("BY")
+            while True:
+                expr = self.parse_expression()
+                descending = False
+                if self.accept_keyword("DESC", "DESCENDING"):
+                    descending = True
+                else:
+                    self.accept_keyword("ASC", "ASCENDING")
+                clause.order.append((expr, descending))
+                if not self.accept_op(","):
+                    break
+        if self.accept_keyword("SKIP"):
+            clause.skip = self.parse_expression()
+        if self.accept_keyword("LIMIT"):
+            clause.limit = self.parse_expression()
+        if kind == "WITH" and self.accept_keyword("WHERE"):
+            clause.where = self.parse_expression()
+        return clause
+
+    def parse_items(self) -> List[ReturnItem]:
+        items = []
+        while True:
+            start = self.peek()
+            if start is None:
+                self._fail("expected an expression")
+            expr = self.parse_expression()
+            last = self.tokens[self.pos - 1]
+            if self.accept_keyword("AS"):
+                alias = self.identifier()
+            else:
+                alias = self.text[start.position:last.position + len(last.text)]
+            items.append(ReturnItem(expr, alias))
+            if not self.accept_op(","):
+                return items
+
+
+    def parse_expression(self) -> Expr:
+        return self.parse_or()
+
+    def parse_or(self) -> Expr:
+        expr = self.parse_xor()
+        while self.accept_keyword("OR"):
+            expr = Binary("OR", expr, self.parse_xor())
+        return expr
+
+    def parse_xor(self) -> Expr:
+        expr = self.parse_and()
+        while self.accept_keyword("XOR"):
+            expr = Binary("XOR", expr, self.parse_and())
+        return expr
+
+    def parse_and(self) -> Expr:
+        expr = self.parse_not()
+        while self.accept_keyword("AND"):
+            expr = Binary("AND", expr, self.parse_not())
+        return expr
+
+    def parse_not(self) -> Expr:
+        if self.accept_keyword("NOT"):
+            return Unary("NOT", self.parse_not())
+        return self.parse_comparison()
+
+    def parse_comparison(self) -> Expr:
+        expr = self.parse_additive()
+        while True:
+            op = self.accept_op("=", "<>", "!=", "<", "<=", ">", ">=", "=~")
+            if op:
+                expr = Binary(op, expr, self.parse_additive())
+            elif self.at_op("<-"):
+                # "a<-1" lexes as an arrow; read it as a comparison with a negative number.
+                self.advance()
+                expr = Binary("<", expr, Unary("-", self.parse_additive()))
+            elif self.accept_keyword("IN"):
+                expr = Binary("IN", expr, self.parse_additive())
+            elif self.accept_keyword("CONTAINS"):
+                expr = Binary("CONTAINS", expr, self.parse_additive())
+            elif self.at_keyword("STARTS") and self.at_keyword("WITH", offset=1):
+                self.pos += 2
+                expr = Binary("STARTS WITH", expr, self.parse_additive())
+            elif self.at_keyword("ENDS") and self.at_keyword("WITH", offset=1):
+                self.pos += 2
+                expr = Binary("ENDS WITH", expr, self.parse_additive())
+            elif self.accept_keyword("IS"):
+                negated = self.accept_keyword("NOT")
+                self.expect_keyword("NULL")
+                expr = IsNull(expr, negated)
+            else:
+                return expr
+
+    def parse_additive(self) -> Expr:
+        expr = self.parse_multiplicative()
+        while True:
+            op = self.accept_op("+", "-")
+            if not op:
+                return expr
+            expr = Binary(op, expr, self.parse_multiplicative())
+
+    def parse_multiplicative(self) -> Expr:
+        expr = self.parse_power()
+        while True:
+            op = self.accept_op("*", "/", "%")
+            if not op:
+                return expr
+            expr = Binary(op, expr, self.parse_power())
+
+    def parse_power(self) -> Expr:
+        expr = self.parse_unary()
+        while self.accept_op("^"):
+            expr = Binary("^", expr, self.parse_unary())
+        return expr
+
+    def parse_unary(self) -> Expr:
+        op = self.accept_op("-", "+")
+        if op:
+            return Unary(op, self.parse_unary())
+        return self.parse_postfix()
+
+    def parse_postfix(self) -> Expr:
+        expr = self.parse_atom()
+        while True:
+            if self.accept_op("."):
+                expr = Property(expr, self.identifier())
+            elif self.at_op("["):
+                self.advance()
+                # expr[i], or a slice expr[a..b] with either bound optional.
+                start = None if self.at_op("..") else self.parse_expression()
+                if self.accept_op(".."):
+                    end = None if self.at_op("]") else self.parse_expression()
+                    self.expect_op("]")
+                    expr = Slice(expr, start, end)
+                else:
+                    self.expect_op("]")
+                    expr = Index(expr, start)
+            else:
+                return expr
+
+    def parse_atom(self) -> Expr:
+        token = self.peek()
+        if token is None:
+            self._fail("expected an expression")
+
+        if token.kind == NUMBER:
+            self.advance()
+            return Literal(parse_number(token.text))
+        if token.kind == STRING:
+            self.advance()
+            return Literal(unquote(token.text))
+        if token.kind == PARAM:
+            self.advance()
+            return Parameter(token.text[1:])
+        if token.kind == BACKTICK:
+            return Variable(self.identifier())
+        if token.kind == OP:
+            if token.text == "(":
+                self.advance()
+                expr = self.parse_expression()
+                self.expect_op(")")
+                if self.at_op("-", "<-", "->") and (self.at_op("[", offset=1) or self.at_op("(", offset=1)
+                                                    or self.at_op("-", "->", offset=1)):
+                    raise CypherUnsupportedError("Pattern predicates and comprehensions are")
+                return expr
+            if token.text == "[":
+                self.advance()
+                following = self.peek()
+                if following is not None and following.kind == IDENT and self.at_keyword("IN", offset=1):
+                    raise CypherUnsupportedError("List comprehensions are")
+                items = []
+                if not self.at_op("]"):
+                    items.append(self.parse_expression())
+                    while self.accept_op(","):
+                        items.append(self.parse_expression())
+                self.expect_op("]")
+                return ListExpr(items)
+            if token.text == "{":
+                return MapExpr(self.parse_map_entries())
+            self._fail("expected an expression")
+
+        upper = token.upper
+        if upper == "TRUE":
+            self.advance()
+            return Literal(True)
+        if upper == "FALSE":
+            self.advance()
+            return Literal(False)
+        if upper == "NULL":
+            self.advance()
+            return Literal(None)
+        if upper == "CASE":
+            self.advance()
+            return self.parse_case()
+        if self.at_op("(", offset=1):
+            return self.parse_function()
+        if self.at_op("{", offset=1):
+            if upper in ("EXISTS", "COUNT", "COLLECT"):
+                raise CypherUnsupportedError(f"{upper} subqueries are")
+            raise CypherUnsupportedError("Map projections are")
+        self.advance()
+        return Variable(token.text)
+
+    def parse_function(self) -> Expr:
+        name = self.advance().text
+        self.expect_op("(")
+        lowered = name.lower()
+        if lowered == "reduce":
+            raise CypherUnsupportedError("reduce() is")
+        if lowered in ("any", "all", "none", "single") and self.at_keyword("IN", offset=1):
+            raise CypherUnsupportedError(f"List predicates such as {lowered}(x IN ...) are")
+        if lowered in ("shortestpath", "allshortestpaths"):
+            raise CypherUnsupportedError(f"{name}() is")
+        if self.accept_op("*"):
+            self.expect_op(")")
+            if name.lower() != "count":
+                self._fail("only count(*) may take '*'")
+            return FunctionCall(name, [], star=True)
+        distinct = self.accept_keyword("DISTINCT")
+        args = []
+        if not self.at_op(")"):
+            args.append(self.parse_expression())
+            while self.accept_op(","):
+                args.append(self.parse_expression())
+        self.expect_op(")")
+        if name.lower() not in AGGREGATES and name.lower() not in _FUNCTIONS:
+            raise CypherEngineError(f"Unknown function '{name}'")
+        return FunctionCall(name, args, distinct=distinct)
+
+    def parse_case(self) -> Expr:
+        subject = None if self.at_keyword("WHEN") else self.parse_expression()
+        whens = []
+        while self.accept_keyword("WHEN"):
+            condition = self.parse_expression()
+            self.expect_keyword("THEN")
+            whens.append((condition, self.parse_expression()))
+        default = self.parse_expression() if self.accept_keyword("ELSE") else None
+        self.expect_keyword("END")
+        return CaseExpr(subject, whens, default)
+
+    def parse_map_entries(self) -> List[Tuple[str, Expr]]:
+        self.expect_op("{")
+        entries = []
+        if not self.at_op("}"):
+            while True:
+                key = self.identifier()
+                self.expect_op(":")
+                entries.append((key, self.parse_expression()))
+                if not self.accept_op(","):
+                    break
+        self.expect_op("}")
+        return entries
+
+
+class _Context:
+
+    def __init__(self, graph: InMemoryGraph, parameters: Dict[str, Any]):
+        self.graph = graph
+        self.parameters = parameters
+
+
+class CypherEngine:
+
+
+    PLAN_CACHE_SIZE = 256
+
+    def __init__(self, graph: InMemoryGraph):
+        self.graph = graph
+        self._plans: "OrderedDict[str, QueryPlan]" = OrderedDict()
+        self._plans_lock = threading.Lock()
+
+    def execute(self, query: str, parameters: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+
+        plan = self._plan(query)
+        ctx = _Context(self.graph, parameters or {})
+        rows = self._run_plan(plan, ctx)
+        return [{key: _to_output(value) for key, value in row.items()} for row in rows]
+
+    def _plan(self, query: str) -> QueryPlan:
+
+        with self._plans_lock:
+            plan = self._plans.get(query)
+            if plan is not None:
+                self._plans.move_to_end(query)
+                return plan
+
+        plan = _Parser(query).parse()
+        with self._plans_lock:
+            self._plans[query] = plan
+            if len(self._plans) > self.PLAN_CACHE_SIZE:
+                self._plans.popitem(last=False)
+        return plan
+
+    def _run_plan(self, plan: QueryPlan, ctx: _Context) -> List[Dict[str, Any]]:
+
+        results = self._run_clauses(plan.parts[0], ctx)
+        distinct = False
+        for part, union_all in zip(plan.parts[1:], plan.union_all):
+            rows = self._run_clauses(part, ctx)
+            if results and rows and list(results[0]) != list(rows[0]):
+                raise CypherEngineError("All sub queries in an UNION must have the same return column names")
+            results.extend(rows)
+            distinct = distinct or not union_all
+        if distinct:
+            results = _dedupe(results)
+        return results
+
+    def _run_clauses(self, clauses: List[Any], ctx: _Context) -> List[Dict[str, Any]]:
+
+        if not isinstance(clauses[-1], ProjectionClause) or clauses[-1].kind != "RETURN":
+            raise CypherEngineError("Query cannot conclude with a clause other than RETURN")
+
+        rows: List[Dict[str, Any]] = [{}]
+        for clause in clauses:
+            if isinstance(clause, MatchClause):
+                rows = self._apply_match(clause, rows, ctx)
+            elif isinstance(clause, ProjectionClause):
+                rows = self._apply_projection(clause, rows, ctx)
+            elif isinstance(clause, UnwindClause):
+                rows = self._apply_unwind(clause, rows, ctx)
+            elif isinstance(clause, CallClause):
+                sub_rows = self._run_plan(clause.query, ctx)
+                rows = [{**row, **sub} for row in rows for sub in sub_rows]
+        return rows
+
+
+    def _apply_match(self, clause: MatchClause, rows, ctx):
+
+        variables = []
+        for chain in clause.patterns:
+            variables.extend(chain.variables())
+
+        output = []
+        for row in rows:
+            matched = False
+            for bindings, _ in self._match_chains(clause.patterns, 0, row, frozenset(), ctx):
+                if clause.where is None or _truthy(clause.where.evaluate(bindings, ctx)):
+                    output.append(bindings)
+                    matched = True
+            if clause.optional and not matched:
+                padded = dict(row)
+                for name in variables:
+                    padded.setdefault(name, None)
+                output.append(padded)
+        return output
+
+    def _match_chains(self, chains, index, row, used, ctx):
+
+        if index == len(chains):
+            yield row, used
+            return
+        for bindings, now_used in self._match_chain(chains[index], row, used, ctx):
+            yield from self._match_chains(chains, index + 1, bindings, now_used, ctx)
+
+    def _match_chain(self, chain: PatternChain, row, used, ctx):
+
+        if chain.rels and self._selectivity(chain.nodes[-1], row) > self._selectivity(chain.nodes[0], row):
+            chain = PatternChain(list(reversed(chain.nodes)), [r.flipped() for r in reversed(chain.rels)])
+
+        first = chain.nodes[0]
+        for node in self._node_candidates(first, row, ctx):
+            bindings = row
+            if first.variable and first.variable not in row:
+                bindings = {**row, first.variable: node}
+            yield from self._extend(chain, 0, node, bindings, used, ctx)
+
+    def _extend(self, chain, index, current, bindings, used, ctx):
+
+        if index == len(chain.rels):
+            yield bindings, used
+            return
+
+        rel_pattern = chain.rels[index]
+        node_pattern = chain.nodes[index + 1]
+        bound_rel = bindings.get(rel_pattern.variable) if rel_pattern.variable else None
+        if rel_pattern.variable in bindings and bound_rel is None:
+            return
+
+        for rel, other in self._adjacent(current, rel_pattern):
+            if rel.id in used:
+                continue
+            if bound_rel is not None and bound_rel is not rel:
+                continue
+            if rel_pattern.types and rel.type not in rel_pattern.types:
+                continue
+            if not self._properties_match(rel, rel_pattern.properties, bindings, ctx):
+                continue
+            if not self._node_matches(other, node_pattern, bindings, ctx):
+                continue
+
+            next_bindings = bindings
+            if rel_pattern.variable and rel_pattern.variable not in bindings:
+                next_bindings = {**next_bindings, rel_pattern.variable: rel}
+            if node_pattern.variable and node_pattern.variable not in next_bindings:
+                next_bindings = {**next_bindings, node_pattern.variable: other}
+            yield from self._extend(chain, index + 1, other, next_bindings, used | {rel.id}, ctx)
+
+    def _adjacent(self, node: Node, pattern: RelPattern) -> Iterator[Tuple[Relationship, Node]]:
+
+        if pattern.direction in ("out", "both"):
+            for rel in self.graph.outgoing(node):
+                yield rel, rel.end
+        if pattern.direction in ("in", "both"):
+            for rel in self.graph.incoming(node):
+                if pattern.direction == "both" and rel.start is rel.end:
+                    continue
+                yield rel, rel.start
+
+    def _node_candidates(self, pattern: NodePattern, row, ctx) -> List[Node]:
+
+        if pattern.variable and pattern.variable in row:
+            node = row[pattern.variable]
+            if isinstance(node, Node) and self._node_matches(node, pattern, row, ctx):
+                return [node]
+            if node is not None and not isinstance(node, Node):
+                raise CypherEngineError(f"Variable `{pattern.variable}` is not a node")
+            return []
+
+        candidates = None
+        if pattern.labels:
+            for key, expr in pattern.properties:
+                if key == "name":
+                    candidates = self.graph.nodes_by_name(pattern.labels[0], expr.evaluate(row, ctx))
+                    break
+            if candidates is None:
+                candidates = self.graph.nodes_with_label(pattern.labels[0])
+        else:
+            candidates = self.graph.all_nodes()
+        return [node for node in candidates if self._node_matches(node, pattern, row, ctx)]
+
+    def _node_matches(self, node: Node, pattern: NodePattern, bindings, ctx) -> bool:
+
+        if pattern.variable and pattern.variable in bindings:
+            if bindings[pattern.variable] is not node:
+                return False
+        if any(label not in node.labels for label in pattern.labels):
+            return False
+        return self._properties_match(node, pattern.properties, bindings, ctx)
+
+    @staticmethod
+    def _properties_match(entity, properties, bindings, ctx) -> bool:
+
+        for key, expr in properties:
+            if _equals(entity.properties.get(key), expr.evaluate(bindings, ctx)) is not True:
+                return False
+        return True
+
+    @staticmethod
+    def _selectivity(pattern: NodePattern, row) -> int:
+
+        if pattern.variable and pattern.variable in row:
+            return 3
+        if pattern.labels and any(key == "name" for key, _ in pattern.properties):
+            return 2
+        if pattern.properties:
+            return 1
+        return 0
+
+
+    def _apply_projection(self, clause: ProjectionClause, rows, ctx):
+
+        items = list(clause.items)
+        if clause.star:
+            names = list(rows[0].keys()) if rows else []
+            items = [ReturnItem(Variable(name), name) for name in names] + items
+
+        aggregating = any(item.expr.has_aggregate() for item in items)
+        projected = []
+        if aggregating:
+            keys = [item for item in items if not item.expr.has_aggregate()]
+            groups: "OrderedDict[Any, List[Dict[str, Any]]]" = OrderedDict()
+            for row in rows:
+                group_key = tuple(_hashable(item.expr.evaluate(row, ctx)) for item in keys)
+                groups.setdefault(group_key, []).append(row)
+            if not groups and not keys:
+                groups[()] = []
+            for group in groups.values():
+                representative = group[0] if group else {}
+                out = {item.alias: item.expr.evaluate(representative, ctx, group) for item in items}
+                projected.append((out, representative))
+        else:
+            for row in rows:
+                projected.append(({item.alias: item.expr.evaluate(row, ctx) for item in items}, row))
+
+        if clause.distinct:
+            seen, unique = set(), []
+            for out, source in projected:
+                key = _hashable(list(out.values()))
+                if key not in seen:
+                    seen.add(key)
+                    unique.append((out, source))
+            projected = unique
+
+        if clause.order:
+            def compare(a, b):
+                scope_a = {**a[1], **a[0]}
+                scope_b = {**b[1], **b[0]}
+                for expr, descending in clause.order:
+                    result = _order_compare(expr.evaluate(scope_a, ctx), expr.evaluate(scope_b, ctx))
+                    if result:
+                        return -result if descending else result
+                return 0
+            projected.sort(key=cmp_to_key(compare))
+
+        if clause.skip is not None:
+            projected = projected[self._count(clause.skip, ctx, "SKIP"):]
+        if clause.limit is not None:
+            projected = projected[:self._count(clause.limit, ctx, "LIMIT")]
+
+        output = [out for out, _ in projected]
+        if clause.where is not None:
+            output = [row for row in output if _truthy(clause.where.evaluate(row, ctx))]
+        return output
+
+    @staticmethod
+    def _count(expr: Expr, ctx, keyword: str) -> int:
+
+        value = expr.evaluate({}, ctx)
+        if not isinstance(value, int) or isinstance(value, bool) or value < 0:
+            raise CypherEngineError(f"Invalid input for {keyword}: expected a non-negative integer")
+        return value
+
+
+    @staticmethod
+    def _apply_unwind(clause: UnwindClause, rows, ctx):
+
+        output = []
+        for row in rows:
+            value = clause.expr.evaluate(row, ctx)
+            if value is None:
+                continue
+            for item in (value if isinstance(value, list) else [value]):
+                output.append({**row, clause.alias: item})
+        return output
+
+
+def _truthy(value) -> bool:
+    return value is True
+
+
+def _dedupe(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    seen, unique = set(), []
+    for row in rows:
+        key = _hashable(list(row.values()))
+        if key not in seen:
+            seen.add(key)
+            unique.append(row)
+    return unique
+
+
+def _to_output(value):
+    # Same shapes as neo4j's Record.data(): nodes become property maps and
+    # relationships become (start, type, end) triples.
+    if isinstance(value, Node):
+        return dict(value.properties)
+    if isinstance(value, Relationship):
+        return (dict(value.start.properties), value.type, dict(value.end.properties))
+    if isinstance(value, list):
+        return [_to_output(v) for v in value]
+    if isinstance(value, dict):
+        return {k: _to_output(v) for k, v in value.items()}
+    return value
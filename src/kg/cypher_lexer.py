@@ -0,0 +1,103 @@
+
+
+import re
+from dataclasses import dataclass
+from typing import List
+
+
+WHITESPACE = "ws"
+COMMENT = "comment"
+STRING = "string"
+BACKTICK = "backtick"
+PARAM = "param"
+NUMBER = "number"
+IDENT = "ident"
+OP = "op"
+
+
+_TOKEN_RE = re.compile(
+    r"""
+    (?P<ws>\s+)
+    | (?P<comment>//[^\n]*|/\*.*?\*/)
+    | (?P<string>'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")
+    | (?P<backtick>`(?:[^`]|``)*`)
+    | (?P<param>\$(?:[A-Za-z_][A-Za-z_0-9]*|\d+))
+    | (?P<number>\d+\.\d+(?:[eE][+-]?\d+)?|\d+(?:[eE][+-]?\d+)?)
+    | (?P<ident>[A-Za-z_][A-Za-z_0-9]*)
+    | (?P<op><=|>=|<>|!=|=~|\.\.|->|<-|\+=|\S)
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+
+_ESCAPES = {
+    "\\": "\\",
+    "'": "'",
+    '"': '"',
+    "n": "\n",
+    "t": "\t",
+    "r": "\r",
+    "b": "\b",
+    "f": "\f",
+}
+
+
+@dataclass(frozen=True)
+class Token:
+
+    kind: str
+    text: str
+    position: int
+
+    @property
+    def upper(self) -> str:
+        return self.text.upper()
+
+
+def tokenize(cypher: str) -> List[Token]:
+
+    tokens = []
+    for match in _TOKEN_RE.finditer(cypher):
+        tokens.append(Token(match.lastgroup, match.group(), match.start()))
+    return tokens
+
+
+def significant(tokens: List[Token]) -> List[Token]:
+
+    return [t for t in tokens if t.kind not in (WHITESPACE, COMMENT)]
+
+
+def unquote(literal: str) -> str:
+
+    body = literal[1:-1]
+    out = []
+    i = 0
+    while i < len(body):
+        ch = body[i]
+        if ch == "\\" and i + 1 < len(body):
+            nxt = body[i + 1]
+            if nxt == "u" and i + 5 < len(body):
+                try:
+                    out.append(chr(int(body[i + 2:i + 6], 16)))
+                    i += 6
+                    continue
+                except ValueError:
+                    pass
+            out.append(_ESCAPES.get(nxt, nxt))
+            i += 2
+            continue
+        out.append(ch)
+        i += 1
+    return "".join(out)
+
+
+def quote(value: str) -> str:
+
+    escaped = value.replace("\\", "\\\\").replace("'", "\\'")
+    return f"'{escaped}'"
+
+
+def parse_number(text: str):
+
+    if any(c in text for c in ".eE"):
+        return float(text)
+    return int(text)
@@ -1,36 +1,83 @@
 import json
 import re
 import os
+import time
 from typing import Dict, List, Any, Optional
-from neo4j import GraphDatabase
 from dotenv import load_dotenv
 
 from src.domain.models import Card, CardType, Rarity, TargetType, Transport
+from src.kg.schema import KGSchema
+from src.kg.memory_graph import InMemoryGraph
 from src.kg.relationship_rules import RelationshipExtractor, KNOWN_COUNTERS, KNOWN_SYNERGIES
 
 load_dotenv()
 
+# Resolved from the package, so loading works whatever the working directory.
+DEFAULT_DATA_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+    "data", "raw", "fandom_arenas_cards.json",
+)
+
 
 class KnowledgeGraphIngestion:
 
-    def __init__(self, uri: str = None, user: str = None, password: str = None):
+    def __init__(self, uri: str = None, user: str = None, password: str = None,
+                 graph: InMemoryGraph = None, verbose: bool = True):
         self.uri = uri or os.getenv("NEO4J_URI", "bolt://localhost:7687")
         self.user = user or os.getenv("NEO4J_USER", "neo4j")
         self.password = password or os.getenv("NEO4J_PASSWORD", "12345678")
-        self.driver = GraphDatabase.driver(self.uri, auth=(self.user, self.password))
+        self.graph = graph
+        self.verbose = verbose
+        self.driver = None
+        if graph is None:
+            from neo4j import GraphDatabase
+
+            self.driver = GraphDatabase.driver(self.uri, auth=(self.user, self.password))
+
+    def _log(self, message: str):
+        if self.verbose:
+            print(message)
 
     def close(self):
         
-        self.driver.close()
+        if self.driver is not None:
+            self.driver.close()
 
     def clear_database(self):
         
+        if self.graph is not None:
+            self.graph.clear()
+            self._log("Database cleared")
+            self.bump_epoch()
+            return
+
         with self.driver.session() as session:
             session.run("MATCH (n) DETACH DELETE n")
-            print("Database cleared")
+            self._log("Database cleared")
+        self.bump_epoch()
+
+    def bump_epoch(self):
+        
+        if self.graph is not None:
+            epoch = int(time.time() * 1000)
+            self.graph.merge_node(KGSchema.EPOCH_LABEL, {"name": "current"}, {"epoch": epoch})
+            return epoch
+
+        cypher = f"""
+        MERGE (m:{KGSchema.EPOCH_LABEL} {{name: 'current'}})
+        SET m.epoch = timestamp()
+        RETURN m.epoch AS epoch
+        """
+
+        with self.driver.session() as session:
+            return session.run(cypher).single()["epoch"]
 
     def create_constraints(self):
         
+        if self.graph is not None:
+            # Uniqueness on name is inherent to how the in-memory graph merges nodes.
+            return
+
         constraints = [
             "CREATE CONSTRAINT card_name IF NOT EXISTS FOR (c:Card) REQUIRE c.name IS UNIQUE",
             "CREATE CONSTRAINT rarity_name IF NOT EXISTS FOR (r:Rarity) REQUIRE r.name IS UNIQUE",
@@ -44,9 +91,9 @@ class KnowledgeGraphIngestion:
             for constraint in constraints:
                 try:
                     session.run(constraint)
-                    print(f"Created constraint: {constraint.split('FOR')[1].split('REQUIRE')[0].strip()}")
+                    self._log(f"Created constraint: {constraint.split('FOR')[1].split('REQUIRE')[0].strip()}")
                 except Exception as e:
-                    print(f"Constraint may already exist: {e}")
+                    self._log(f"Constraint may already exist: {e}")
 
     def ingest_card(self, card: Card) -> str:
         
@@ -95,6 +142,9 @@ class KnowledgeGraphIngestion:
             "targets": [t.value if isinstance(t, TargetType) else t for t in card.targets]
         }
 
+        if self.graph is not None:
+            return self._ingest_card_in_memory(params)
+
         with self.driver.session() as session:
             result = session.run(cypher, params)
             return result.single()["inserted"]
@@ -117,12 +167,18 @@ class KnowledgeGraphIngestion:
             "reason": properties.get("reason", "")
         }
 
+        if self.graph is not None:
+            return self._relate_in_memory(
+                from_card, "COUNTERS", to_card,
+                {"effectiveness": params["effectiveness"], "reason": params["reason"]},
+            )
+
         with self.driver.session() as session:
             try:
                 session.run(cypher, params)
                 return True
             except Exception as e:
-                print(f"Error creating counter relationship {from_card} -> {to_card}: {e}")
+                self._log(f"Error creating counter relationship {from_card} -> {to_card}: {e}")
                 return False
 
     def ingest_synergy_relationship(self, card1: str, card2: str, properties: Dict):
@@ -143,12 +199,18 @@ class KnowledgeGraphIngestion:
             "strength": properties.get("strength", "moderate")
         }
 
+        if self.graph is not None:
+            return self._relate_in_memory(
+                card1, "SYNERGIZES_WITH", card2,
+                {"synergy_type": params["synergy_type"], "strength": params["strength"]},
+            )
+
         with self.driver.session() as session:
             try:
                 session.run(cypher, params)
                 return True
             except Exception as e:
-                print(f"Error creating synergy relationship {card1} <-> {card2}: {e}")
+                self._log(f"Error creating synergy relationship {card1} <-> {card2}: {e}")
                 return False
 
     def ingest_archetype_relationship(self, card_name: str, archetype_name: str, role: str):
@@ -167,78 +229,117 @@ class KnowledgeGraphIngestion:
             "role": role
         }
 
+        if self.graph is not None:
+            card = self.graph.find_node("Card", card_name)
+            if card is None:
+                return False
+            archetype = self.graph.merge_node("Archetype", {"name": archetype_name})
+            self.graph.merge_relationship(card, "FITS_ARCHETYPE", archetype, {"role": role})
+            return True
+
         with self.driver.session() as session:
             try:
                 session.run(cypher, params)
                 return True
             except Exception as e:
-                print(f"Error creating archetype relationship {card_name} -> {archetype_name}: {e}")
+                self._log(f"Error creating archetype relationship {card_name} -> {archetype_name}: {e}")
                 return False
 
     def ingest_all_from_json(self, json_path: str):
         
-        print(f"Loading dataset from {json_path}...")
+        self._log(f"Loading dataset from {json_path}...")
         with open(json_path, "r", encoding="utf-8") as f:
             data = json.load(f)
 
         
-        print("\n=== Phase 1: Ingesting Cards ===")
+        self._log("\n=== Phase 1: Ingesting Cards ===")
         all_cards = []
         for arena_key, arena_data in data.items():
             arena_name = arena_data.get("arena_name", arena_key)
-            print(f"\nArena: {arena_name}")
+            self._log(f"\nArena: {arena_name}")
 
             for card_data in arena_data.get("cards", []):
                 try:
                     card = self._convert_json_to_card(card_data, arena_name)
                     all_cards.append(card)
                     inserted = self.ingest_card(card)
-                    print(f"  [OK] {inserted}")
+                    self._log(f"  [OK] {inserted}")
                 except Exception as e:
-                    print(f"  [ERR] Error ingesting {card_data.get('name', 'unknown')}: {e}")
+                    self._log(f"  [ERR] Error ingesting {card_data.get('name', 'unknown')}: {e}")
 
         
-        print("\n=== Phase 2: Creating Relationships ===")
+        self._log("\n=== Phase 2: Creating Relationships ===")
 
         
-        print("\n--- Counter Relationships ---")
+        self._log("\n--- Counter Relationships ---")
         counter_rels = RelationshipExtractor.extract_counter_relationships(all_cards)
         for from_card, to_card, props in counter_rels[:50]:  
             if self.ingest_counter_relationship(from_card, to_card, props):
-                print(f"  [OK] {from_card} COUNTERS {to_card} ({props['effectiveness']})")
+                self._log(f"  [OK] {from_card} COUNTERS {to_card} ({props['effectiveness']})")
 
         
         for counter, target, eff, reason in KNOWN_COUNTERS:
             props = {"effectiveness": eff, "reason": reason}
             if self.ingest_counter_relationship(counter, target, props):
-                print(f"  [OK] {counter} COUNTERS {target} (known)")
+                self._log(f"  [OK] {counter} COUNTERS {target} (known)")
 
         
-        print("\n--- Synergy Relationships ---")
+        self._log("\n--- Synergy Relationships ---")
         synergy_rels = RelationshipExtractor.extract_synergy_relationships(all_cards)
         for card1, card2, props in synergy_rels[:50]:  
             if self.ingest_synergy_relationship(card1, card2, props):
-                print(f"  [OK] {card1} SYNERGIZES_WITH {card2} ({props['synergy_type']})")
+                self._log(f"  [OK] {card1} SYNERGIZES_WITH {card2} ({props['synergy_type']})")
 
         
         for c1, c2, syn_type, strength in KNOWN_SYNERGIES:
             props = {"synergy_type": syn_type, "strength": strength}
             if self.ingest_synergy_relationship(c1, c2, props):
-                print(f"  [OK] {c1} SYNERGIZES_WITH {c2} (known)")
+                self._log(f"  [OK] {c1} SYNERGIZES_WITH {c2} (known)")
             
             if self.ingest_synergy_relationship(c2, c1, props):
-                print(f"  [OK] {c2} SYNERGIZES_WITH {c1} (known)")
+                self._log(f"  [OK] {c2} SYNERGIZES_WITH {c1} (known)")
 
         
-        print("\n--- Archetype Assignments ---")
+        self._log("\n--- Archetype Assignments ---")
         archetype_assignments = RelationshipExtractor.assign_archetypes(all_cards)
         for archetype_name, card_roles in archetype_assignments.items():
             for card_name, role in card_roles[:10]:  
                 if self.ingest_archetype_relationship(card_name, archetype_name, role):
-                    print(f"  [OK] {card_name} FITS_ARCHETYPE {archetype_name} as {role}")
+                    self._log(f"  [OK] {card_name} FITS_ARCHETYPE {archetype_name} as {role}")
+
+        self.bump_epoch()
+
+        self._log("\n=== Ingestion Complete ===")
+        self._log(f"Total cards ingested: {len(all_cards)}")
+
+    def _ingest_card_in_memory(self, params: Dict[str, Any]) -> str:
+        
+        properties = {k: v for k, v in params.items() if k not in ("name", "targets")}
+        card = self.graph.merge_node("Card", {"name": params["name"]}, properties)
+
+        rarity = self.graph.merge_node("Rarity", {"name": params["rarity"]})
+        self.graph.merge_relationship(card, "HAS_RARITY", rarity)
+
+        arena = self.graph.merge_node("Arena", {"name": params["arena"]})
+        self.graph.merge_relationship(card, "UNLOCKS_IN", arena)
 
-        print("\n=== Ingestion Complete ===")
-        print(f"Total cards ingested: {len(all_cards)}")
+        card_type = self.graph.merge_node("Type", {"name": params["type"]})
+        self.graph.merge_relationship(card, "HAS_TYPE", card_type)
+
+        for target_name in params["targets"]:
+            target = self.graph.merge_node("Target", {"name": target_name})
+            self.graph.merge_relationship(card, "CAN_HIT", target)
+
+        return params["name"]
+
+    def _relate_in_memory(self, from_name: str, rel_type: str, to_name: str, properties: Dict[str, Any]) -> bool:
+        
+        start = self.graph.find_node("Card", from_name)
+        end = self.graph.find_node("Card", to_name)
+        if start is None or end is None:
+            return False
+        self.graph.merge_relationship(start, rel_type, end, properties)
+        return True
 
     def _convert_json_to_card(self, card_data: Dict, arena_name: str) -> Card:
         
@@ -349,6 +450,14 @@ class KnowledgeGraphIngestion:
         return targets
 
 
+def load_memory_graph(json_path: str = None, verbose: bool = False) -> InMemoryGraph:
+    
+    graph = InMemoryGraph()
+    ingestion = KnowledgeGraphIngestion(graph=graph, verbose=verbose)
+    ingestion.ingest_all_from_json(json_path or DEFAULT_DATA_PATH)
+    return graph
+
+
 def main():
     
     ingestion = KnowledgeGraphIngestion()
@@ -356,7 +465,7 @@ def main():
     
     ingestion.create_constraints()
 
-    json_path = "data/raw/fandom_arenas_cards.json"
+    json_path = DEFAULT_DATA_PATH
     ingestion.ingest_all_from_json(json_path)
 
     ingestion.close()
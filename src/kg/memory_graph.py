@@ -0,0 +1,137 @@
+
+
+import threading
+from collections import defaultdict
+from typing import Dict, List, Any, Optional, Iterable, Tuple
+
+
+class Node:
+
+    __slots__ = ("id", "labels", "properties")
+
+    def __init__(self, node_id: int, labels: Iterable[str], properties: Dict[str, Any]):
+        self.id = node_id
+        self.labels = set(labels)
+        self.properties = properties
+
+    def __repr__(self):
+        return f"Node({self.id}, {sorted(self.labels)}, {self.properties})"
+
+
+class Relationship:
+
+    __slots__ = ("id", "type", "start", "end", "properties")
+
+    def __init__(self, rel_id: int, rel_type: str, start: Node, end: Node, properties: Dict[str, Any]):
+        self.id = rel_id
+        self.type = rel_type
+        self.start = start
+        self.end = end
+        self.properties = properties
+
+    def __repr__(self):
+        return f"Relationship({self.id}, {self.start.id}-[:{self.type}]->{self.end.id})"
+
+
+class InMemoryGraph:
+
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+
+        with self._lock:
+            self.nodes: Dict[int, Node] = {}
+            self.relationships: Dict[int, Relationship] = {}
+            self._next_id = 0
+            self._by_label: Dict[str, List[Node]] = defaultdict(list)
+            self._by_key: Dict[Tuple, Node] = {}
+            self._by_name: Dict[Tuple[str, Any], List[Node]] = defaultdict(list)
+            self._outgoing: Dict[int, List[Relationship]] = defaultdict(list)
+            self._incoming: Dict[int, List[Relationship]] = defaultdict(list)
+            self._rel_by_key: Dict[Tuple[int, str, int], Relationship] = {}
+
+    def merge_node(self, label: str, key: Dict[str, Any], properties: Dict[str, Any] = None) -> Node:
+
+        index_key = (label, tuple(sorted(key.items())))
+        with self._lock:
+            node = self._by_key.get(index_key)
+            if node is None:
+                node = Node(self._new_id(), [label], dict(key))
+                self.nodes[node.id] = node
+                self._by_key[index_key] = node
+                self._by_label[label].append(node)
+                if "name" in key:
+                    self._by_name[(label, key["name"])].append(node)
+            self._set_properties(node.properties, properties)
+            return node
+
+    def merge_relationship(self, start: Node, rel_type: str, end: Node,
+                           properties: Dict[str, Any] = None) -> Relationship:
+
+        index_key = (start.id, rel_type, end.id)
+        with self._lock:
+            rel = self._rel_by_key.get(index_key)
+            if rel is None:
+                rel = Relationship(self._new_id(), rel_type, start, end, {})
+                self.relationships[rel.id] = rel
+                self._rel_by_key[index_key] = rel
+                self._outgoing[start.id].append(rel)
+                self._incoming[end.id].append(rel)
+            self._set_properties(rel.properties, properties)
+            return rel
+
+    def find_node(self, label: str, name: Any) -> Optional[Node]:
+
+        matches = self._by_name.get((label, name))
+        return matches[0] if matches else None
+
+    def nodes_by_name(self, label: str, name: Any) -> List[Node]:
+
+        return list(self._by_name.get((label, name), ()))
+
+    def nodes_with_label(self, label: str) -> List[Node]:
+
+        return list(self._by_label.get(label, ()))
+
+    def all_nodes(self) -> List[Node]:
+
+        return list(self.nodes.values())
+
+    def outgoing(self, node: Node) -> List[Relationship]:
+
+        return self._outgoing.get(node.id, [])
+
+    def incoming(self, node: Node) -> List[Relationship]:
+
+        return self._incoming.get(node.id, [])
+
+    def count_nodes(self, label: str = None) -> int:
+
+        if label is None:
+            return len(self.nodes)
+        return len(self._by_label.get(label, ()))
+
+    def count_relationships(self, rel_type: str = None) -> int:
+
+        if rel_type is None:
+            return len(self.relationships)
+        return sum(1 for rel in self.relationships.values() if rel.type == rel_type)
+
+    def _new_id(self) -> int:
+
+        node_id = self._next_id
+        self._next_id += 1
+        return node_id
+
+    @staticmethod
+    def _set_properties(target: Dict[str, Any], properties: Optional[Dict[str, Any]]):
+
+        # Mirrors SET semantics: assigning null removes the property.
+        for key, value in (properties or {}).items():
+            if value is None:
+                target.pop(key, None)
+            else:
+                target[key] = value
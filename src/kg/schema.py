@@ -25,6 +25,10 @@ class RelationshipSchema:
 class KGSchema:
     
 
+    # Bookkeeping node bumped by ingestion; deliberately kept out of NODES so
+    # it never appears in the translator prompt.
+    EPOCH_LABEL = "IngestionEpoch"
+
     NODES = {
         "Card": NodeSchema(
             label="Card",
@@ -146,12 +150,15 @@ class KGSchema:
     }
 
     @classmethod
-    def get_schema_description(cls) -> str:
+    def get_schema_description(cls, node_types: List[str] = None,
+                               relationship_types: List[str] = None) -> str:
         
         schema_desc = "# Clash Royale Knowledge Graph Schema\n\n"
 
         schema_desc += "## Node Types\n"
         for node_name, node in cls.NODES.items():
+            if node_types is not None and node_name not in node_types:
+                continue
             schema_desc += f"\n### {node_name}\n"
             schema_desc += f"{node.description}\n"
             schema_desc += "Properties:\n"
@@ -160,6 +167,8 @@ class KGSchema:
 
         schema_desc += "\n## Relationship Types\n"
         for rel_name, rel in cls.RELATIONSHIPS.items():
+            if relationship_types is not None and rel_name not in relationship_types:
+                continue
             schema_desc += f"\n### :{rel_name}\n"
             schema_desc += f"{rel.description}\n"
             schema_desc += f"Pattern: (:{rel.from_label})-[:{rel.type}]->(:{rel.to_label})\n"
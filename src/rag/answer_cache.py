@@ -0,0 +1,81 @@
+
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Any, Optional
+
+from src.rag.translation_cache import TranslationCache
+
+
+class AnswerCache:
+
+
+    def __init__(self, max_entries: int = None):
+        self.max_entries = max_entries or int(os.getenv("ANSWER_CACHE_SIZE", "256"))
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._epoch = None
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "stored": 0, "evicted": 0, "invalidations": 0}
+
+    @staticmethod
+    def make_key(question: str, data: List[Dict[str, Any]], prompt_version: str) -> str:
+
+        normalized = TranslationCache.normalize_question(question)
+        payload = json.dumps(data, sort_keys=True, default=str, ensure_ascii=False)
+        digest = hashlib.sha1()
+        for part in (normalized, payload, prompt_version):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def get(self, key: str, epoch: Any) -> Optional[str]:
+
+        with self._lock:
+            self._check_epoch(epoch)
+            answer = self._entries.get(key)
+            if answer is None:
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return answer
+
+    def put(self, key: str, answer: str, epoch: Any):
+
+        with self._lock:
+            self._check_epoch(epoch)
+            self._entries[key] = answer
+            self._entries.move_to_end(key)
+            self.stats["stored"] += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats["evicted"] += 1
+
+    def clear(self):
+
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+
+        with self._lock:
+            return dict(self.stats, entries=len(self._entries), epoch=self._epoch)
+
+    def _check_epoch(self, epoch: Any):
+
+        # A new ingestion epoch means every cached answer may describe stale data.
+        if epoch != self._epoch:
+            if self._entries:
+                self.stats["invalidations"] += 1
+            self._entries.clear()
+            self._epoch = epoch
+
+
+def create_answer_cache() -> Optional[AnswerCache]:
+
+    if os.getenv("ANSWER_CACHE", "true").lower() != "true":
+        return None
+    return AnswerCache()
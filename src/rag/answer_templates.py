@@ -0,0 +1,292 @@
+
+
+import os
+from typing import Dict, List, Any, Optional, Tuple
+
+from src.domain.models import QueryResult
+from src.kg.cypher_lexer import Token, tokenize, significant, unquote, IDENT, OP, STRING, PARAM
+
+
+class AnswerTemplateRenderer:
+
+
+    NAME_COLUMNS = ("card", "name")
+
+    # Column aliases the translator uses, mapped to how the answer names them.
+    STAT_LABELS = {
+        "elixir": "elixir",
+        "cost": "elixir",
+        "hitpoints": "HP",
+        "hp": "HP",
+        "health": "HP",
+        "damage": "damage",
+        "dps": "DPS",
+    }
+    DESCRIPTIVE_COLUMNS = {"type", "rarity", "arena", "transport", "description"}
+    COUNTER_COLUMNS = {"effectiveness", "reason"}
+    SYNERGY_COLUMNS = {"synergy", "synergy_type", "strength"}
+    COUNT_COLUMNS = {"count", "total", "num_cards", "card_count"}
+    _TAIL_KEYWORDS = {"ORDER", "SKIP", "LIMIT", "UNION"}
+
+    def __init__(self, enabled: bool = None):
+        self.enabled = enabled if enabled is not None else (
+            os.getenv("ANSWER_TEMPLATES", "true").lower() == "true"
+        )
+
+    def render(self, question: str, query_result: QueryResult) -> Optional[str]:
+
+        data = query_result.data
+        if not self.enabled or not data or any(not isinstance(row, dict) for row in data):
+            return None
+
+        columns = set().union(*(row.keys() for row in data))
+        if "_context" in columns:
+            return None
+
+        if len(data) == 1 and len(columns) == 1:
+            (column,) = columns
+            value = data[0][column]
+            if column in self.COUNT_COLUMNS and isinstance(value, int):
+                noun = "matching card" if self._column_label(query_result, column) == "Card" else "result"
+                return f"There {'is' if value == 1 else 'are'} {value} {noun}{'' if value == 1 else 's'}."
+
+        name_column = next((c for c in self.NAME_COLUMNS if c in columns), None)
+        if name_column is None:
+            return None
+        rest = columns - {name_column}
+
+        # The wording below is about cards; other entities (arenas,
+        # archetypes, ...) only get a neutral list, or go to the LLM.
+        if self._column_label(query_result, name_column) != "Card":
+            if rest:
+                return None
+            names = self._names(data, name_column)
+            return f"Results ({len(names)}): {', '.join(names)}."
+
+        if rest and rest <= self.COUNTER_COLUMNS and "effectiveness" in rest:
+            return self._relationship_answer(query_result, name_column, "COUNTERS")
+        if rest and rest <= self.SYNERGY_COLUMNS:
+            return self._relationship_answer(query_result, name_column, "SYNERGIZES_WITH")
+        if not rest:
+            names = self._names(data, name_column)
+            return f"Matching cards ({len(names)}): {', '.join(names)}."
+        if rest <= set(self.STAT_LABELS) | self.DESCRIPTIVE_COLUMNS:
+            return self._stats_answer(data, name_column)
+        return None
+
+    def _stats_answer(self, data: List[Dict[str, Any]], name_column: str) -> Optional[str]:
+
+        sentences = []
+        for row in data:
+            # Champion abilities need the LLM to read level11_stats.
+            if str(row.get("rarity", "")).lower() == "champion":
+                return None
+            name = row.get(name_column)
+            if name is None:
+                return None
+
+            kind = " ".join(str(row[c]) for c in ("rarity", "type") if row.get(c) is not None)
+            if kind:
+                article = "an" if kind[0].lower() in "aeiou" else "a"
+                sentence = f"{name} is {article} {kind} card"
+            else:
+                sentence = str(name)
+
+            stats = [
+                f"{self._number(row[c])} {label}" for c, label in self.STAT_LABELS.items()
+                if row.get(c) is not None
+            ]
+            if stats:
+                sentence += (" with " if kind else ": ") + self._join(stats)
+            extras = [f"{c} {row[c]}" for c in ("arena", "transport") if row.get(c)]
+            if extras and (kind or stats):
+                sentence += f" ({', '.join(extras)})"
+            elif extras:
+                sentence += ": " + ", ".join(extras)
+            sentence += "."
+            if row.get("description"):
+                sentence += f" {str(row['description']).strip()}"
+            sentences.append(sentence)
+        return " ".join(sentences)
+
+    def _relationship_answer(self, query_result: QueryResult, name_column: str, rel_type: str) -> Optional[str]:
+
+        anchor = self._anchor(query_result, rel_type)
+        if anchor is None:
+            return None
+        subject, subject_is_source = anchor
+
+        if rel_type == "COUNTERS":
+            heading = f"{subject} counters" if subject_is_source else f"Cards that counter {subject}"
+        else:
+            heading = f"Cards that work well with {subject}"
+
+        items = []
+        for row in query_result.data:
+            name = row.get(name_column)
+            if name is None:
+                continue
+            details = self._relationship_details(row, rel_type)
+            items.append(f"{name} ({details})" if details else str(name))
+        if not items:
+            return None
+        return f"{heading}: {', '.join(items)}."
+
+    @staticmethod
+    def _relationship_details(row: Dict[str, Any], rel_type: str) -> str:
+
+        if rel_type == "COUNTERS":
+            parts = [row.get("effectiveness"), row.get("reason")]
+            return ", ".join(str(p) for p in parts if p)
+        synergy = row.get("synergy_type") or row.get("synergy")
+        parts = []
+        if synergy:
+            parts.append(f"{synergy} synergy")
+        if row.get("strength"):
+            parts.append(f"{row['strength']} strength")
+        return ", ".join(parts)
+
+    def _anchor(self, query_result: QueryResult, rel_type: str) -> Optional[Tuple[str, bool]]:
+
+        # Find the single relationship of this type and the card named on
+        # either end, so the heading says who counters whom.
+        tokens = significant(tokenize(query_result.cypher_query or ""))
+        for i, token in enumerate(tokens):
+            if not (token.kind == OP and token.text == "[" and i > 0 and tokens[i - 1].text in ("-", "<-")):
+                continue
+            close = self._find(tokens, i, "]")
+            if close is None or not any(t.kind == IDENT and t.text == rel_type for t in tokens[i:close]):
+                continue
+            if close + 1 >= len(tokens):
+                return None
+            outgoing = tokens[close + 1].text == "->"
+            incoming = tokens[i - 1].text == "<-"
+            if outgoing == incoming:
+                return None
+
+            left = self._node_name(tokens, self._left_node(tokens, i - 1), query_result.parameters)
+            right = self._node_name(tokens, self._right_node(tokens, close + 1), query_result.parameters)
+            source, target = (left, right) if outgoing else (right, left)
+            if source and not target:
+                return source, True
+            if target and not source:
+                return target, False
+            return None
+        return None
+
+    def _column_label(self, query_result: QueryResult, column: str) -> Optional[str]:
+
+        # The label of the node variable a RETURN column is computed from:
+        # `c.name AS card` and `count(c) AS total` both read from c's label.
+        tokens = significant(tokenize(query_result.cypher_query or ""))
+        labels = {}
+        for i in range(len(tokens) - 3):
+            opener, var, colon, label = tokens[i:i + 4]
+            if (opener.text == "(" and var.kind == IDENT and colon.text == ":" and label.kind == IDENT):
+                labels.setdefault(var.text, label.text)
+
+        depth, last_return = 0, None
+        for i, token in enumerate(tokens):
+            if token.kind == OP and token.text in ("(", "[", "{"):
+                depth += 1
+            elif token.kind == OP and token.text in (")", "]", "}"):
+                depth -= 1
+            elif depth == 0 and token.kind == IDENT and token.upper == "RETURN":
+                last_return = i
+        if last_return is None:
+            return None
+
+        items, current, depth = [], [], 0
+        for token in tokens[last_return + 1:]:
+            if token.kind == OP and token.text in ("(", "[", "{"):
+                depth += 1
+            elif token.kind == OP and token.text in (")", "]", "}"):
+                depth -= 1
+            elif depth == 0 and token.kind == IDENT and token.upper in self._TAIL_KEYWORDS:
+                break
+            if depth == 0 and token.kind == OP and token.text == ",":
+                items.append(current)
+                current = []
+                continue
+            current.append(token)
+        items.append(current)
+
+        for item in items:
+            if len(item) >= 3 and item[-2].upper == "AS":
+                alias, expression = item[-1].text, item[:-2]
+            else:
+                alias, expression = "".join(t.text for t in item), item
+            if alias != column:
+                continue
+            for token in expression:
+                if token.kind == IDENT and token.text in labels:
+                    return labels[token.text]
+            return None
+        return None
+
+    @staticmethod
+    def _find(tokens: List[Token], start: int, closer: str) -> Optional[int]:
+
+        for j in range(start, len(tokens)):
+            if tokens[j].text == closer:
+                return j
+        return None
+
+    @staticmethod
+    def _left_node(tokens: List[Token], arrow: int) -> Optional[Tuple[int, int]]:
+
+        end = arrow - 1
+        if end < 0 or tokens[end].text != ")":
+            return None
+        for j in range(end, -1, -1):
+            if tokens[j].text == "(":
+                return j, end
+        return None
+
+    def _right_node(self, tokens: List[Token], arrow: int) -> Optional[Tuple[int, int]]:
+
+        start = arrow + 1
+        if start >= len(tokens) or tokens[start].text != "(":
+            return None
+        end = self._find(tokens, start, ")")
+        return (start, end) if end is not None else None
+
+    @staticmethod
+    def _node_name(tokens: List[Token], span: Optional[Tuple[int, int]], parameters: Dict[str, Any]) -> Optional[str]:
+
+        if span is None:
+            return None
+        start, end = span
+        for j in range(start, end - 2):
+            if tokens[j].text == "name" and tokens[j + 1].text == ":":
+                value = tokens[j + 2]
+                if value.kind == STRING:
+                    return unquote(value.text)
+                if value.kind == PARAM:
+                    resolved = (parameters or {}).get(value.text[1:])
+                    return resolved if isinstance(resolved, str) else None
+        return None
+
+    @staticmethod
+    def _names(data: List[Dict[str, Any]], column: str) -> List[str]:
+
+        return [str(row[column]) for row in data if row.get(column) is not None]
+
+    @staticmethod
+    def _number(value: Any) -> str:
+
+        if isinstance(value, float) and value.is_integer():
+            return str(int(value))
+        return str(value)
+
+    @staticmethod
+    def _join(items: List[str]) -> str:
+
+        if len(items) <= 1:
+            return "".join(items)
+        return ", ".join(items[:-1]) + f" and {items[-1]}"
+
+
+def create_renderer() -> AnswerTemplateRenderer:
+
+    return AnswerTemplateRenderer()
@@ -0,0 +1,200 @@
+
+
+from difflib import get_close_matches
+from typing import Dict, List, Optional, Tuple
+
+from src.kg.cypher_lexer import Token, tokenize, significant, IDENT, OP, BACKTICK
+from src.kg.schema import KGSchema
+
+
+class CypherLintError(ValueError):
+
+    def __init__(self, errors: List[str]):
+        super().__init__("; ".join(errors))
+        self.errors = errors
+
+
+class CypherLinter:
+
+
+    WRITE_CLAUSES = {"CREATE", "MERGE", "DELETE", "DETACH", "SET", "REMOVE", "DROP", "FOREACH", "LOAD"}
+    START_CLAUSES = {"MATCH", "OPTIONAL", "WITH", "UNWIND", "CALL", "RETURN"}
+    _PAIRS = {")": "(", "]": "[", "}": "{"}
+
+    def __init__(self, schema: KGSchema = None):
+        self.schema = schema or KGSchema()
+
+    def lint(self, cypher: str) -> List[str]:
+
+        tokens = significant(tokenize(cypher or ""))
+        if not tokens:
+            return ["Query is empty"]
+
+        errors = self._check_structure(tokens)
+        if errors:
+            # Label and property checks assume balanced brackets.
+            return errors
+
+        bindings, pattern_errors = self._check_patterns(tokens)
+        errors.extend(pattern_errors)
+        errors.extend(self._check_property_access(tokens, bindings))
+        return errors
+
+    def check(self, cypher: str):
+
+        errors = self.lint(cypher)
+        if errors:
+            raise CypherLintError(errors)
+
+    def _check_structure(self, tokens: List[Token]) -> List[str]:
+
+        errors = []
+        if tokens[0].upper not in self.START_CLAUSES:
+            errors.append(f"Query must start with a read clause such as MATCH, not '{tokens[0].text}'")
+
+        stack = []
+        for i, token in enumerate(tokens):
+            if token.kind == OP and token.text in ("'", '"'):
+                errors.append(f"Unterminated string literal at position {token.position}")
+                return errors
+            if token.kind == OP and token.text in ("(", "[", "{"):
+                stack.append(token)
+            elif token.kind == OP and token.text in self._PAIRS:
+                if not stack or stack[-1].text != self._PAIRS[token.text]:
+                    errors.append(f"Unbalanced '{token.text}' at position {token.position}")
+                    return errors
+                stack.pop()
+            elif token.kind == IDENT and token.upper in self.WRITE_CLAUSES and not self._is_property(tokens, i):
+                errors.append(f"Write clause '{token.upper}' is not allowed; queries must be read-only")
+            elif token.kind == IDENT and token.upper == "CALL" and i + 1 < len(tokens) and tokens[i + 1].text != "{":
+                errors.append("Procedure calls are not allowed; use CALL { ... } subqueries only")
+
+        if stack:
+            errors.append(f"Unclosed '{stack[-1].text}' at position {stack[-1].position}")
+        if not any(t.kind == IDENT and t.upper == "RETURN" for t in tokens):
+            errors.append("Query has no RETURN clause")
+        return errors
+
+    def _check_patterns(self, tokens: List[Token]) -> Tuple[Dict[str, Tuple[str, str]], List[str]]:
+
+        bindings: Dict[str, Tuple[str, str]] = {}
+        errors = []
+        for i, token in enumerate(tokens):
+            if token.kind == OP and token.text in ("(", "["):
+                kind = "node" if token.text == "(" else "relationship"
+                j = i + 1
+                variable = None
+                if j < len(tokens) and tokens[j].kind in (IDENT, BACKTICK) and self._is_colon(tokens, j + 1):
+                    variable = tokens[j].text
+                    j += 1
+                if self._is_colon(tokens, j):
+                    names, j = self._read_names(tokens, j, kind)
+                    for name in names:
+                        error = self._check_name(kind, name)
+                        if error:
+                            errors.append(error)
+                    known = [n for n in names if self._schema_for(kind, n) is not None]
+                    single = len(names) == 1 and len(known) == 1
+                    if variable and single:
+                        bindings.setdefault(variable, (kind, known[0]))
+                    if j < len(tokens) and tokens[j].text == "{" and single:
+                        errors.extend(self._check_map_keys(tokens, j, kind, known[0]))
+        return bindings, errors
+
+    def _check_property_access(self, tokens: List[Token], bindings: Dict[str, Tuple[str, str]]) -> List[str]:
+
+        errors = []
+        for i in range(len(tokens) - 2):
+            variable, dot, prop = tokens[i:i + 3]
+            if (variable.kind == IDENT and variable.text in bindings and dot.kind == OP
+                    and dot.text == "." and prop.kind == IDENT):
+                if i > 0 and tokens[i - 1].kind == OP and tokens[i - 1].text == ".":
+                    continue
+                kind, name = bindings[variable.text]
+                error = self._check_property(kind, name, prop.text)
+                if error:
+                    errors.append(error)
+        return errors
+
+    def _check_map_keys(self, tokens: List[Token], start: int, kind: str, name: str) -> List[str]:
+
+        errors = []
+        depth = 0
+        for j in range(start, len(tokens)):
+            token = tokens[j]
+            if token.kind == OP and token.text in ("(", "[", "{"):
+                depth += 1
+            elif token.kind == OP and token.text in (")", "]", "}"):
+                depth -= 1
+                if depth == 0:
+                    break
+            elif depth == 1 and token.kind == IDENT and self._is_colon(tokens, j + 1) \
+                    and tokens[j - 1].text in ("{", ","):
+                error = self._check_property(kind, name, token.text)
+                if error:
+                    errors.append(error)
+        return errors
+
+    def _read_names(self, tokens: List[Token], j: int, kind: str) -> Tuple[List[str], int]:
+
+        # Node labels chain with ':' and relationship types alternate with '|'.
+        names = []
+        while self._is_colon(tokens, j) or (kind == "relationship" and names and tokens[j].text == "|"):
+            j += 1
+            if j < len(tokens) and tokens[j].text == ":":
+                j += 1
+            if j >= len(tokens) or tokens[j].kind not in (IDENT, BACKTICK):
+                break
+            name = tokens[j].text
+            names.append(name[1:-1].replace("``", "`") if tokens[j].kind == BACKTICK else name)
+            j += 1
+            if j >= len(tokens):
+                break
+        return names, j
+
+    def _check_name(self, kind: str, name: str) -> Optional[str]:
+
+        if self._schema_for(kind, name) is not None:
+            return None
+        valid = list(self.schema.NODES if kind == "node" else self.schema.RELATIONSHIPS)
+        noun = "label" if kind == "node" else "relationship type"
+        return f"Unknown {noun} '{name}'{self._suggest(name, valid)}. Valid: {', '.join(valid)}"
+
+    def _check_property(self, kind: str, name: str, prop: str) -> Optional[str]:
+
+        schema = self._schema_for(kind, name)
+        if schema is None or prop in schema.properties:
+            return None
+        valid = list(schema.properties)
+        target = name if kind == "node" else f":{name}"
+        return (f"Unknown property '{prop}' on {target}{self._suggest(prop, valid)}. "
+                f"Valid: {', '.join(valid) or 'none'}")
+
+    def _schema_for(self, kind: str, name: str):
+
+        return (self.schema.NODES if kind == "node" else self.schema.RELATIONSHIPS).get(name)
+
+    @staticmethod
+    def _suggest(name: str, valid: List[str]) -> str:
+
+        lookup = {v.lower(): v for v in valid}
+        match = get_close_matches(name.lower(), list(lookup), n=1, cutoff=0.6)
+        return f" (did you mean '{lookup[match[0]]}'?)" if match else ""
+
+    @staticmethod
+    def _is_colon(tokens: List[Token], j: int) -> bool:
+
+        return j < len(tokens) and tokens[j].kind == OP and tokens[j].text == ":"
+
+    @staticmethod
+    def _is_property(tokens: List[Token], i: int) -> bool:
+
+        # "c.set" or "{set: 1}" use the keyword as a name, not a clause.
+        before = tokens[i - 1] if i > 0 else None
+        after = tokens[i + 1] if i + 1 < len(tokens) else None
+        return (before is not None and before.text == ".") or (after is not None and after.text == ":")
+
+
+def create_linter() -> CypherLinter:
+
+    return CypherLinter()
@@ -0,0 +1,205 @@
+
+
+import hashlib
+from dataclasses import dataclass, field
+from typing import Dict, Any, List, Optional, Set
+
+from src.kg.cypher_lexer import (
+    Token, tokenize, significant, unquote, parse_number,
+    WHITESPACE, COMMENT, STRING, NUMBER, IDENT, OP, PARAM, BACKTICK,
+)
+
+
+KEYWORDS = {
+    "MATCH", "OPTIONAL", "WHERE", "RETURN", "WITH", "AS", "ORDER", "BY", "LIMIT",
+    "SKIP", "ASC", "ASCENDING", "DESC", "DESCENDING", "DISTINCT", "AND", "OR",
+    "XOR", "NOT", "IN", "CONTAINS", "STARTS", "ENDS", "IS", "NULL", "TRUE",
+    "FALSE", "UNWIND", "CALL", "UNION", "ALL", "CASE", "WHEN", "THEN", "ELSE",
+    "END", "EXISTS", "CREATE", "MERGE", "DELETE", "DETACH", "SET", "REMOVE",
+}
+
+_LITERALS = {"TRUE", "FALSE", "NULL"}
+
+# Cypher function names are case-insensitive; spell them one way so the
+# fingerprint does not depend on how the LLM capitalised them.
+FUNCTIONS = {
+    name.lower(): name for name in (
+        "count", "collect", "sum", "avg", "min", "max", "size", "toLower",
+        "toUpper", "toString", "toInteger", "toFloat", "coalesce", "trim",
+        "split", "replace", "substring", "head", "last", "labels", "type",
+        "keys", "properties", "exists", "round", "abs", "id", "elementId",
+    )
+}
+
+_NO_SPACE_AFTER = {"(", "[", "{", "."}
+_NO_SPACE_BEFORE = {")", "]", "}", ",", ".", ":"}
+_OPENERS = {"(", "[", "{"}
+_CLOSERS = {")", "]", "}"}
+
+
+@dataclass
+class NormalizedQuery:
+
+    cypher: str
+    parameters: Dict[str, Any] = field(default_factory=dict)
+    fingerprint: str = ""
+
+
+class CypherNormalizer:
+
+
+    def __init__(self, lift_literals: bool = True):
+        self.lift_literals = lift_literals
+
+    def normalize(self, cypher: str, parameters: Optional[Dict[str, Any]] = None) -> NormalizedQuery:
+
+        tokens = [t for t in tokenize(cypher) if t.kind != COMMENT]
+        variables = self._variables(significant(tokens))
+        params = dict(parameters or {})
+        taken = set(params)
+        counter = 0
+
+        out: List[str] = []
+        brackets: List[str] = []
+        prev: Optional[Token] = None
+
+        for index, token in enumerate(tokens):
+            if token.kind == WHITESPACE:
+                continue
+
+            text = token.text
+            next_token = self._next_significant(tokens, index)
+
+            if token.kind == IDENT:
+                text = self._canonical_word(token, prev, next_token, variables)
+            elif self.lift_literals and self._is_liftable(token, prev, next_token):
+                while f"p{counter}" in taken:
+                    counter += 1
+                name = f"p{counter}"
+                taken.add(name)
+                counter += 1
+                params[name] = unquote(token.text) if token.kind == STRING else parse_number(token.text)
+                text = f"${name}"
+
+            if prev is not None and self._needs_space(prev, token, brackets):
+                out.append(" ")
+            out.append(text)
+
+            if token.kind == OP and token.text in _OPENERS:
+                brackets.append(token.text)
+            elif token.kind == OP and token.text in _CLOSERS and brackets:
+                brackets.pop()
+            prev = token
+
+        normalized = "".join(out)
+        return NormalizedQuery(
+            cypher=normalized,
+            parameters=params,
+            fingerprint=self.fingerprint_of(normalized),
+        )
+
+    def fingerprint(self, cypher: str) -> str:
+
+        return self.normalize(cypher).fingerprint
+
+    @staticmethod
+    def fingerprint_of(normalized_cypher: str) -> str:
+
+        return hashlib.sha1(normalized_cypher.encode("utf-8")).hexdigest()[:16]
+
+    @staticmethod
+    def _next_significant(tokens: List[Token], index: int) -> Optional[Token]:
+
+        for token in tokens[index + 1:]:
+            if token.kind not in (WHITESPACE, COMMENT):
+                return token
+        return None
+
+    @staticmethod
+    def _variables(tokens: List[Token]) -> Set[str]:
+
+        # Names bound in a pattern, "(end:Card)" or "[all]", or by AS. They
+        # are identifiers even when they spell a keyword.
+        names = set()
+        for index, token in enumerate(tokens):
+            if token.kind != IDENT or token.upper in _LITERALS:
+                continue
+            prev = tokens[index - 1] if index else None
+            after = tokens[index + 1] if index + 1 < len(tokens) else None
+            if prev is not None and prev.kind == IDENT and prev.upper == "AS":
+                names.add(token.text)
+            elif (prev is not None and prev.kind == OP and prev.text in ("(", "[")
+                  and after is not None and after.kind == OP and after.text in (":", ")", "]", "{")):
+                names.add(token.text)
+        return names
+
+    @staticmethod
+    def _canonical_word(token: Token, prev: Optional[Token], next_token: Optional[Token],
+                        variables: Set[str] = frozenset()) -> str:
+
+        # Labels, relationship types, property keys and map keys keep their case.
+        if prev is not None and prev.kind == OP and prev.text in (".", ":"):
+            return token.text
+        if next_token is not None and next_token.kind == OP and next_token.text in (":", "."):
+            return token.text
+        if token.text in variables:
+            return token.text
+
+        if next_token is not None and next_token.kind == OP and next_token.text == "(":
+            canonical = FUNCTIONS.get(token.text.lower())
+            if canonical:
+                return canonical
+
+        if token.upper in KEYWORDS:
+            return token.upper
+        return token.text
+
+    @staticmethod
+    def _is_liftable(token: Token, prev: Optional[Token], next_token: Optional[Token]) -> bool:
+
+        if token.kind == STRING:
+            return True
+        if token.kind != NUMBER:
+            return False
+        # Variable-length bounds such as *1..3 cannot be parameterised.
+        if prev is not None and prev.kind == OP and prev.text in ("*", ".."):
+            return False
+        if next_token is not None and next_token.kind == OP and next_token.text == "..":
+            return False
+        return True
+
+    @staticmethod
+    def _needs_space(prev: Token, token: Token, brackets: List[str]) -> bool:
+
+        word_kinds = (IDENT, NUMBER, STRING, PARAM, BACKTICK)
+        if prev.kind in word_kinds and token.kind in word_kinds:
+            return True
+        if prev.kind == OP and prev.text in _NO_SPACE_AFTER:
+            return False
+        if token.kind == OP and token.text in _NO_SPACE_BEFORE:
+            return False
+        if prev.kind == OP and prev.text == ":":
+            # Map entries read "{name: $p0}", labels stay glued: "(c:Card)".
+            return bool(brackets) and brackets[-1] == "{"
+        if token.kind == OP and token.text == "(" and prev.kind == IDENT:
+            return prev.upper in KEYWORDS
+        if _is_pattern_edge(prev, token):
+            return False
+        return True
+
+
+def _is_pattern_edge(prev: Token, token: Token) -> bool:
+
+    arrows = ("-", "->", "<-", "<", ">")
+    if token.kind == OP and token.text in arrows and prev.kind == OP and prev.text in (")", "]"):
+        return True
+    if prev.kind == OP and prev.text in arrows and token.kind == OP and token.text in ("(", "[", "-", "->"):
+        return True
+    if prev.kind == OP and prev.text in ("-", "<-") and token.kind == OP and token.text == "[":
+        return True
+    return False
+
+
+def create_normalizer() -> CypherNormalizer:
+
+    return CypherNormalizer()
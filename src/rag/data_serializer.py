@@ -0,0 +1,144 @@
+
+
+import json
+import os
+from typing import Dict, List, Any, Tuple
+
+from src.rag.prompt_builder import estimate_tokens
+
+
+class TableSerializer:
+
+
+    # Nested values under these keys are parsed and spread into columns.
+    FLATTEN_KEYS = {"level11_stats", "stats"}
+    CONTEXT_KEY = "_context"
+    DELIMITER = " | "
+
+    def __init__(self, token_budget: int = None):
+        self.token_budget = token_budget if token_budget is not None else int(
+            os.getenv("PROMPT_DATA_TOKEN_BUDGET", "1500")
+        )
+
+    def serialize(self, data: List[Dict[str, Any]]) -> str:
+
+        if not data:
+            return "No data retrieved."
+
+        rows, context = self._rows(data)
+        columns = self._columns(rows)
+
+        lines = [self.DELIMITER.join(columns)]
+        used = estimate_tokens(lines[0])
+        context_lines = self._context_lines(context)
+        used += sum(estimate_tokens(line) for line in context_lines)
+
+        shown = 0
+        for row in rows:
+            line = self.DELIMITER.join(self._cell(row.get(column)) for column in columns)
+            cost = estimate_tokens(line) + 1
+            # Always show at least one row, even over budget.
+            if shown and used + cost > self.token_budget:
+                break
+            lines.append(line)
+            used += cost
+            shown += 1
+
+        remaining = len(rows) - shown
+        if remaining:
+            lines.append(f"... {remaining} more rows not shown ({len(rows)} total)")
+        return "\n".join(lines + context_lines)
+
+    def measure(self, data: List[Dict[str, Any]]) -> int:
+
+        # Estimated tokens of the whole table, ignoring the budget.
+        if not data:
+            return 0
+        rows, context = self._rows(data)
+        columns = self._columns(rows)
+        lines = [self.DELIMITER.join(columns)] + self._context_lines(context)
+        lines.extend(self.DELIMITER.join(self._cell(row.get(c)) for c in columns) for row in rows)
+        return sum(estimate_tokens(line) + 1 for line in lines)
+
+    def _rows(self, data: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[Tuple[Dict[str, Any], Dict[str, Any]]]]:
+
+        rows, context = [], []
+        for record in data:
+            row = {}
+            for key, value in record.items():
+                if key == self.CONTEXT_KEY and isinstance(value, dict):
+                    context.append((row, value))
+                    continue
+                self._flatten(key, value, row)
+            rows.append(row)
+        return rows, context
+
+    @staticmethod
+    def _columns(rows: List[Dict[str, Any]]) -> List[str]:
+
+        columns: List[str] = []
+        for row in rows:
+            for key in row:
+                if key not in columns:
+                    columns.append(key)
+        return columns
+
+    def _flatten(self, key: str, value: Any, row: Dict[str, Any]):
+
+        if key in self.FLATTEN_KEYS and isinstance(value, str):
+            try:
+                value = json.loads(value)
+            except ValueError:
+                pass
+        if isinstance(value, dict):
+            for sub_key, sub_value in value.items():
+                self._flatten(f"{key}.{sub_key}", sub_value, row)
+            return
+        row[key] = value
+
+    def _context_lines(self, context: List[Tuple[Dict[str, Any], Dict[str, Any]]]) -> List[str]:
+
+        lines = []
+        for row, values in context:
+            subject = row.get("card") or row.get("name") or "record"
+            for key, items in values.items():
+                cell = self._cell(items)
+                if cell:
+                    lines.append(f"{subject} {key}: {cell}")
+        if lines:
+            lines.insert(0, "")
+        return lines
+
+    def _cell(self, value: Any) -> str:
+
+        if value is None:
+            return ""
+        if isinstance(value, bool):
+            return "true" if value else "false"
+        if isinstance(value, float) and value.is_integer():
+            return str(int(value))
+        if isinstance(value, (list, tuple)):
+            separator = "; " if any(isinstance(v, dict) for v in value) else ", "
+            return separator.join(filter(None, (self._item(v) for v in value)))
+        if isinstance(value, dict):
+            return self._item(value)
+        return str(value).replace("\n", " ").replace("|", "/")
+
+    def _item(self, value: Any) -> str:
+
+        if not isinstance(value, dict):
+            return self._cell(value)
+        # Maps collected by OPTIONAL MATCH come back with null members.
+        present = {k: v for k, v in value.items() if v is not None}
+        if not present:
+            return ""
+        name = present.pop("card", None) or present.pop("name", None)
+        details = ", ".join(f"{k}={self._cell(v)}" for k, v in present.items())
+        if name is None:
+            return details
+        return f"{name} ({details})" if details else str(name)
+
+
+def create_serializer() -> TableSerializer:
+
+    return TableSerializer()
@@ -1,18 +1,45 @@
 
 
-import json
-from typing import List, Dict, Any
+import hashlib
+from typing import Any, Callable, Dict, List, Optional
 from langchain_core.prompts import PromptTemplate
 
 from src.domain.models import RAGResponse, QueryResult
+from src.rag.data_serializer import TableSerializer
+from src.rag.answer_templates import AnswerTemplateRenderer
+from src.rag.answer_cache import AnswerCache, create_answer_cache
+from src.rag.map_reduce import create_map_reduce
+from src.rag.llm_resilience import LLMError
 
 
 class AnswerGenerator:
     
 
-    def __init__(self, llm):
+    PREFIXES_TO_REMOVE = [
+        "Answer:",
+        "Based on the data,",
+        "According to the graph data,",
+    ]
+
+    def __init__(self, llm, epoch_source: Optional[Callable[[], Any]] = None, summarizer_llm=None):
         self.llm = llm
+        self.summarizer_llm = summarizer_llm or llm
+        self.serializer = TableSerializer()
+        self.templates = AnswerTemplateRenderer()
         self.prompt_template = self._build_prompt_template()
+        self.map_reduce = create_map_reduce(self.serializer)
+        self.prompt_version = self._prompt_version()
+        self.answer_cache = create_answer_cache()
+        self.epoch_source = epoch_source
+
+    def _prompt_version(self) -> str:
+        
+        model = getattr(self.llm, "model", type(self.llm).__name__)
+        summarizer_model = getattr(self.summarizer_llm, "model", type(self.summarizer_llm).__name__)
+        signature = "\n".join([
+            str(model), str(summarizer_model), str(self.serializer.token_budget), self.map_reduce.signature(), self.prompt_template.template,
+        ])
+        return hashlib.sha1(signature.encode("utf-8")).hexdigest()[:16]
 
     def _build_prompt_template(self) -> PromptTemplate:
         
@@ -56,6 +83,131 @@ Provide a clear, concise answer based strictly on the graph data above. List ALL
 
     def generate(self, question: str, query_result: QueryResult) -> RAGResponse:
         
+        response, cache_slot = self._prepare(question, query_result)
+        if response is not None:
+            return response
+
+        try:
+            answer_text = self._complete(self._final_prompt(question, query_result))
+        except LLMError as e:
+            return self._failed_response(question, query_result, e)
+        self._remember(cache_slot, answer_text)
+
+        return self._build_response(question, query_result, answer_text)
+
+    def generate_stream(self, question: str, query_result: QueryResult):
+        
+        response, cache_slot = self._prepare(question, query_result)
+        if response is not None:
+            yield ("delta", response.answer)
+            yield ("response", response)
+            return
+
+        prompt = self._final_prompt(question, query_result)
+        stream = getattr(self.llm, "stream", None)
+        if stream is None:
+            answer_text = self._complete(prompt)
+            self._remember(cache_slot, answer_text)
+            yield ("delta", answer_text)
+            yield ("response", self._build_response(question, query_result, answer_text))
+            return
+
+        # Hold back the opening characters until it is clear whether the answer
+        # starts with one of the prefixes _clean_answer strips.
+        pending = ""
+        flushed = False
+        parts = []
+
+        for chunk in stream(prompt):
+            if not chunk:
+                continue
+            parts.append(chunk)
+            if flushed:
+                yield ("delta", chunk)
+                continue
+
+            pending += chunk
+            if any(p.startswith(pending.lstrip()) for p in self.PREFIXES_TO_REMOVE):
+                continue
+            pending = self._strip_prefix(pending)
+            flushed = True
+            if pending:
+                yield ("delta", pending)
+
+        if not flushed:
+            pending = self._clean_answer(pending)
+            if pending:
+                yield ("delta", pending)
+
+        answer_text = self._clean_answer("".join(parts))
+        self._remember(cache_slot, answer_text)
+        yield ("response", self._build_response(question, query_result, answer_text))
+
+    def _prepare(self, question: str, query_result: QueryResult):
+        
+        early = self._early_response(question, query_result)
+        if early is not None:
+            return early, None
+
+        templated = self.templates.render(question, query_result)
+        if templated is not None:
+            return self._build_response(question, query_result, templated), None
+
+        if self.answer_cache is None:
+            return None, None
+        try:
+            epoch = self.epoch_source() if self.epoch_source else None
+        except Exception:
+            # Without a known epoch a cached answer could be stale.
+            return None, None
+
+        key = AnswerCache.make_key(question, query_result.data, self.prompt_version)
+        cached = self.answer_cache.get(key, epoch)
+        if cached is not None:
+            response = self._build_response(question, query_result, cached)
+            response.cached = True
+            return response, None
+        return None, (key, epoch)
+
+    def _remember(self, cache_slot, answer_text: str):
+        
+        if cache_slot is None or not answer_text:
+            return
+        key, epoch = cache_slot
+        self.answer_cache.put(key, answer_text, epoch)
+
+    def _final_prompt(self, question: str, query_result: QueryResult) -> str:
+        
+        if not self.map_reduce.should_split(query_result.data):
+            return self._build_prompt(question, query_result)
+
+        # Large results: condense chunks concurrently, then merge the notes in
+        # one short call so no single prompt or answer outgrows the limits.
+        chunks = self.map_reduce.chunk(query_result.data)
+        if len(chunks) == 1:
+            # Everything fits one prompt after all; map notes are not an answer.
+            return self._build_prompt(question, query_result)
+        notes = self.map_reduce.map(question, chunks, self._summarize)
+        return self.map_reduce.reduce_prompt(question, notes)
+
+    def _summarize(self, prompt: str) -> str:
+        
+        return self._complete(prompt, self.summarizer_llm)
+
+    def _complete(self, prompt: str, llm=None) -> str:
+        
+        result = (llm or self.llm).invoke(prompt)
+
+        
+        if hasattr(result, 'content'):
+            answer_text = result.content
+        else:
+            answer_text = str(result)
+
+        
+        return self._clean_answer(answer_text)
+
+    def _early_response(self, question: str, query_result: QueryResult):
         
         if query_result.error:
             return RAGResponse(
@@ -78,26 +230,35 @@ Provide a clear, concise answer based strictly on the graph data above. List ALL
                 confidence=0.0
             )
 
-        
-        formatted_data = self._format_data_for_prompt(query_result.data)
+        return None
 
+    def _failed_response(self, question: str, query_result: QueryResult, error: LLMError) -> RAGResponse:
         
-        prompt = self.prompt_template.format(
+        # The data was retrieved, so callers still get it with the failure.
+        return RAGResponse(
             question=question,
-            data=formatted_data
+            answer=f"I found {len(query_result.data)} results but could not generate an answer: {error}",
+            cypher_query=query_result.cypher_query,
+            retrieved_data=query_result.data,
+            sources=self._extract_sources(query_result.data),
+            confidence=0.0
         )
 
-        result = self.llm.invoke(prompt)
+    def static_prefix(self) -> str:
 
-        
-        if hasattr(result, 'content'):
-            answer_text = result.content
-        else:
-            answer_text = str(result)
+        # Everything up to the question is identical across answer prompts.
+        return self.prompt_template.format(question="\0", data="").split("\0", 1)[0]
 
+    def _build_prompt(self, question: str, query_result: QueryResult) -> str:
         
-        answer_text = self._clean_answer(answer_text)
+        formatted_data = self._format_data_for_prompt(query_result.data)
+
+        return self.prompt_template.format(
+            question=question,
+            data=formatted_data
+        )
 
+    def _build_response(self, question: str, query_result: QueryResult, answer_text: str) -> RAGResponse:
         
         sources = self._extract_sources(query_result.data)
 
@@ -115,23 +276,23 @@ Provide a clear, concise answer based strictly on the graph data above. List ALL
 
     def _format_data_for_prompt(self, data: List[Dict[str, Any]]) -> str:
         
-        if not data:
-            return "No data retrieved."
+        return self.serializer.serialize(data)
 
-        formatted = json.dumps(data, indent=2, ensure_ascii=False)
-        return formatted
+    def _strip_prefix(self, text: str) -> str:
+        
+        # Like _clean_answer, but keeps trailing whitespace so the next
+        # streamed chunk joins correctly.
+        text = text.lstrip()
+        for prefix in self.PREFIXES_TO_REMOVE:
+            if text.startswith(prefix):
+                text = text[len(prefix):].lstrip()
+        return text
 
     def _clean_answer(self, raw_answer: str) -> str:
         
         answer = raw_answer.strip()
 
-        prefixes_to_remove = [
-            "Answer:",
-            "Based on the data,",
-            "According to the graph data,",
-        ]
-
-        for prefix in prefixes_to_remove:
+        for prefix in self.PREFIXES_TO_REMOVE:
             if answer.startswith(prefix):
                 answer = answer[len(prefix):].strip()
 
@@ -0,0 +1,234 @@
+
+
+import json
+import re
+from typing import Dict, List, Any, Optional
+
+from src.kg.cypher_lexer import quote
+from src.kg.schema import KGSchema
+
+
+class IntentCompilationError(ValueError):
+    pass
+
+
+class IntentCompiler:
+
+
+    INTENTS = {
+        "card_stats": "stats of one or more named cards",
+        "counters_of": "cards that counter the named card",
+        "countered_by": "cards the named card counters",
+        "synergies": "cards that synergize with the named card",
+        "list_cards": "cards matching filters (rarity, type, target, arena, archetype, elixir range)",
+        "count_cards": "how many cards match filters",
+    }
+
+    # Filters anchor on a uniquely-constrained node so Neo4j starts from an
+    # index lookup instead of scanning every Card.
+    ANCHORED_FILTERS = {
+        "rarity": ("HAS_RARITY", "Rarity"),
+        "type": ("HAS_TYPE", "Type"),
+        "target": ("CAN_HIT", "Target"),
+        "arena": ("UNLOCKS_IN", "Arena"),
+        "archetype": ("FITS_ARCHETYPE", "Archetype"),
+    }
+    LOWERCASE_FILTERS = {"rarity", "type", "target"}
+
+    STAT_FIELDS = {
+        "elixir": "cost",
+        "type": "type",
+        "rarity": "rarity",
+        "hitpoints": "hp",
+        "damage": "damage",
+        "dps": "dps",
+        "transport": "transport",
+        "arena": "arena",
+        "description": "description",
+        "level11_stats": "stats",
+    }
+    DEFAULT_FIELDS = ["elixir", "type", "rarity", "hitpoints", "damage", "dps"]
+    SORT_FIELDS = {"elixir", "hitpoints", "damage", "dps", "name"}
+    MAX_LIMIT = 50
+
+    def __init__(self, schema: KGSchema = None):
+        self.schema = schema or KGSchema()
+
+    def build_prompt(self, question: str) -> str:
+
+        intents = "\n".join(f'- "{name}": {description}' for name, description in self.INTENTS.items())
+        return f"""Classify a Clash Royale question into a JSON object. Do not write Cypher.
+
+Intents:
+{intents}
+- "unknown": anything else
+
+Fields:
+- "intent": one of the intents above
+- "cards": exact card names mentioned (e.g. "P.E.K.K.A.", "Mini P.E.K.K.A.")
+- "fields": for card_stats, any of {sorted(self.STAT_FIELDS)}; include "level11_stats" for champions or abilities
+- "filters": optional rarity (common/rare/epic/legendary/champion), type (troop/spell/building), target (air/ground/buildings), arena, archetype, min_elixir, max_elixir
+- "sort": optional {{"field": one of {sorted(self.SORT_FIELDS)}, "order": "asc" or "desc"}}
+- "limit": optional integer for "top"/"cheapest"/"best" questions
+
+Examples:
+Question: Which cards counter P.E.K.K.A.?
+{{"intent": "counters_of", "cards": ["P.E.K.K.A."]}}
+Question: What are the cheapest spell cards?
+{{"intent": "list_cards", "filters": {{"type": "spell"}}, "sort": {{"field": "elixir", "order": "asc"}}, "limit": 5}}
+Question: Compare Musketeer and Wizard
+{{"intent": "card_stats", "cards": ["Musketeer", "Wizard"]}}
+
+Output ONLY the JSON object.
+
+Question: {question}
+"""
+
+    @staticmethod
+    def parse(raw_output) -> Dict[str, Any]:
+
+        text = raw_output.content if hasattr(raw_output, "content") else str(raw_output)
+        match = re.search(r"\{.*\}", text, re.DOTALL)
+        if not match:
+            raise IntentCompilationError("No JSON object in intent output")
+        try:
+            intent = json.loads(match.group(0))
+        except json.JSONDecodeError as e:
+            raise IntentCompilationError(f"Invalid intent JSON: {e}")
+        if not isinstance(intent, dict):
+            raise IntentCompilationError("Intent output is not an object")
+        return intent
+
+    def compile(self, intent: Dict[str, Any]) -> str:
+
+        name = intent.get("intent")
+        if name not in self.INTENTS:
+            raise IntentCompilationError(f"Unsupported intent '{name}'")
+
+        cards = self._cards(intent)
+        if name == "card_stats":
+            return self._card_stats(cards, intent.get("fields"))
+        if name == "counters_of":
+            return self._relationship(
+                "(c:Card)-[r:COUNTERS]->(target:Card)", "target", cards,
+                "c.name AS card, r.effectiveness AS effectiveness, r.reason AS reason",
+            )
+        if name == "countered_by":
+            return self._relationship(
+                "(source:Card)-[r:COUNTERS]->(c:Card)", "source", cards,
+                "c.name AS card, r.effectiveness AS effectiveness, r.reason AS reason",
+            )
+        if name == "synergies":
+            return self._relationship(
+                "(source:Card)-[s:SYNERGIZES_WITH]->(c:Card)", "source", cards,
+                "c.name AS card, s.synergy_type AS synergy, s.strength AS strength",
+            )
+        return self._filtered(intent, count=name == "count_cards")
+
+    def _card_stats(self, cards: List[str], fields: Optional[List[str]]) -> str:
+
+        if not cards:
+            raise IntentCompilationError("card_stats needs at least one card")
+        fields = [f for f in (fields or []) if f in self.STAT_FIELDS] or list(self.DEFAULT_FIELDS)
+        if "level11_stats" in fields and "rarity" not in fields:
+            fields.append("rarity")
+
+        returns = ", ".join(["c.name AS card"] + [f"c.{f} AS {self.STAT_FIELDS[f]}" for f in fields])
+        return f"MATCH {self._card_anchor('c', cards)} RETURN {returns}"
+
+    def _relationship(self, pattern: str, anchor: str, cards: List[str], returns: str) -> str:
+
+        if not cards:
+            raise IntentCompilationError("Relationship intents need a card")
+        if len(cards) == 1:
+            pattern = pattern.replace(f"({anchor}:Card)", f"({anchor}:Card {{name: {quote(cards[0])}}})")
+            return f"MATCH {pattern} RETURN {returns}"
+        return f"MATCH {pattern} WHERE {anchor}.name IN {self._list(cards)} RETURN {anchor}.name AS for_card, {returns}"
+
+    def _filtered(self, intent: Dict[str, Any], count: bool) -> str:
+
+        filters = intent.get("filters") or {}
+        if not isinstance(filters, dict):
+            raise IntentCompilationError("filters must be an object")
+
+        patterns, conditions = [], []
+        role = None
+        for key, (rel_type, label) in self.ANCHORED_FILTERS.items():
+            value = filters.get(key)
+            if value in (None, ""):
+                continue
+            if not isinstance(value, str):
+                raise IntentCompilationError(f"Filter '{key}' must be a string")
+            if key in self.LOWERCASE_FILTERS:
+                value = value.lower()
+            variable = "f" if key == "archetype" else ""
+            if variable:
+                role = "f.role AS role"
+            patterns.append(f"(c)-[{variable}:{rel_type}]->(:{label} {{name: {quote(value)}}})")
+
+        for key, op in (("min_elixir", ">="), ("max_elixir", "<=")):
+            value = filters.get(key)
+            if value is None:
+                continue
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                raise IntentCompilationError(f"Filter '{key}' must be a number")
+            conditions.append(f"c.elixir {op} {value}")
+
+        if not patterns and not conditions and not count:
+            raise IntentCompilationError("list_cards needs at least one filter")
+
+        match = "MATCH (c:Card)" + "".join(f", {p}" for p in patterns)
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        if count:
+            return f"{match}{where} RETURN count(DISTINCT c) AS count"
+
+        returns = "c.name AS card, c.elixir AS cost, c.rarity AS rarity, c.type AS type"
+        if role:
+            returns += f", {role}"
+        return f"{match}{where} RETURN {returns}{self._order(intent)}{self._limit(intent)}"
+
+    def _order(self, intent: Dict[str, Any]) -> str:
+
+        sort = intent.get("sort") or {}
+        if not isinstance(sort, dict):
+            raise IntentCompilationError("sort must be an object")
+        field = sort.get("field", "name")
+        if field not in self.SORT_FIELDS:
+            raise IntentCompilationError(f"Cannot sort by '{field}'")
+        order = " DESC" if str(sort.get("order", "asc")).lower() == "desc" else ""
+        return f" ORDER BY c.{field}{order}"
+
+    def _limit(self, intent: Dict[str, Any]) -> str:
+
+        limit = intent.get("limit")
+        if limit is None:
+            return ""
+        if isinstance(limit, bool) or not isinstance(limit, int) or limit < 1:
+            raise IntentCompilationError("limit must be a positive integer")
+        return f" LIMIT {min(limit, self.MAX_LIMIT)}"
+
+    @staticmethod
+    def _cards(intent: Dict[str, Any]) -> List[str]:
+
+        cards = intent.get("cards") or []
+        if isinstance(cards, str):
+            cards = [cards]
+        if not isinstance(cards, list) or not all(isinstance(c, str) and c for c in cards):
+            raise IntentCompilationError("cards must be a list of names")
+        return list(dict.fromkeys(cards))
+
+    def _card_anchor(self, variable: str, cards: List[str]) -> str:
+
+        if len(cards) == 1:
+            return f"({variable}:Card {{name: {quote(cards[0])}}})"
+        return f"({variable}:Card) WHERE {variable}.name IN {self._list(cards)}"
+
+    @staticmethod
+    def _list(values: List[str]) -> str:
+
+        return "[" + ", ".join(quote(v) for v in values) + "]"
+
+
+def create_intent_compiler() -> IntentCompiler:
+
+    return IntentCompiler()
@@ -1,163 +1,380 @@
-﻿import os
+﻿import json
+import threading
+from dataclasses import replace
+from typing import Dict, Tuple
+
 import requests
-from dotenv import load_dotenv
-
-# Load environment variables from .env file
-load_dotenv()
-
-LLM_PROVIDER = os.getenv("LLM_PROVIDER", "gemini")  # Options: "gemini" or "openrouter"
-MODEL_NAME = os.getenv("LLM_MODEL", "gemini-1.5-flash")
-LLM_MAX_TOKENS = int(os.getenv("LLM_MAX_TOKENS", "512"))
-LLM_TEMPERATURE = float(os.getenv("LLM_TEMPERATURE", "0.1"))
-OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-
-# Debug: Print what was loaded
-print(f"[DEBUG] LLM_PROVIDER loaded: '{LLM_PROVIDER}'")
-print(f"[DEBUG] MODEL_NAME loaded: '{MODEL_NAME}'")
-print(f"[DEBUG] GEMINI_API_KEY exists: {bool(GEMINI_API_KEY)}")
-print(f"[DEBUG] OPENROUTER_API_KEY exists: {bool(OPENROUTER_API_KEY)}")
-
-if not OPENROUTER_API_KEY and not GEMINI_API_KEY:
-    print("Warning: No API key set. Set either OPENROUTER_API_KEY or GEMINI_API_KEY")
-    print("OpenRouter: $env:OPENROUTER_API_KEY='your_key' (https://openrouter.ai/)")
-    print("Gemini: $env:GEMINI_API_KEY='your_key' (https://aistudio.google.com/app/apikey)")
-
-class OpenRouterLLM:
-    def __init__(self, api_key: str = None, model: str = None):
-        self.api_key = api_key or OPENROUTER_API_KEY
-        self.model = model or MODEL_NAME
-        self.base_url = "https://openrouter.ai/api/v1"
-
-    def invoke(self, prompt: str):
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from src.domain.models import LLMResponse
+from src.utils.config import LLM_STAGES, LLMConfig, get_config
+from src.rag.llm_base import BaseLLM, StageLLM
+from src.rag.llm_resilience import (
+    LLMError, LLMConfigurationError, LLMResponseError, LLMTimeoutError, LLMServerError, LLMRateLimitError,
+)
+
+
+def create_http_session(pool_size: int = 10, retries: int = 2) -> requests.Session:
+
+    # Only connection failures are retried here: the request never reached
+    # the server. Status codes are left to the resilience layer, which backs
+    # off with jitter and feeds the circuit breaker.
+    retry = Retry(
+        total=retries,
+        connect=retries,
+        read=0,
+        status=0,
+        allowed_methods=frozenset({"POST"}),
+        backoff_factor=0.5,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=False, max_retries=retry)
+
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class OpenRouterLLM(BaseLLM):
+    provider = "openrouter"
+
+    def __init__(self, api_key: str = None, model: str = None, base_url: str = None, config: LLMConfig = None):
+        config = config or get_config().llm
+        self.api_key = api_key or config.openrouter_api_key
+        self.model = model or config.model_name
+        self.base_url = base_url or config.openrouter_base_url
+        self.max_tokens = config.max_tokens
+        self.temperature = config.temperature
+        self.stop = tuple(config.stop)
+        self.timeout = (config.connect_timeout, config.read_timeout)
+        # One keep-alive pool per client, so consecutive calls reuse the
+        # TCP/TLS connection instead of handshaking every time.
+        self.session = create_http_session(config.pool_size, config.http_retries)
+        self.session.headers.update({
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+        })
+
+    def _invoke(self, prompt: str, max_tokens: int = None, temperature: float = None,
+                stop: Tuple[str, ...] = None) -> LLMResponse:
+        if not self.api_key:
+            raise LLMConfigurationError("No API key set. Please set OPENROUTER_API_KEY environment variable")
+
+        data = self._payload(prompt, max_tokens, temperature, stop)
+        resp = self._post(data)
+        try:
+            result = resp.json()
+        except ValueError as e:
+            raise LLMResponseError(f"Invalid API response: {e}")
+        # Upstream provider failures can arrive as HTTP 200 with an error body.
+        if isinstance(result, dict) and isinstance(result.get("error"), dict):
+            raise self._classify(result["error"].get("code"), f"API Error Details: {result['error']}")
+        try:
+            text = result["choices"][0]["message"]["content"]
+        except (KeyError, IndexError, TypeError) as e:
+            raise LLMResponseError(f"Invalid API response structure: {e}")
+
+        return LLMResponse(content=text or "", usage=result.get("usage") or {})
+
+    def _stream(self, prompt: str, max_tokens: int = None, temperature: float = None,
+                stop: Tuple[str, ...] = None):
         if not self.api_key:
-            class R:
-                def __init__(self, text):
-                    self.content = text
-            return R("[No API key set. Please set OPENROUTER_API_KEY environment variable]")
+            raise LLMConfigurationError("No API key set. Please set OPENROUTER_API_KEY environment variable")
+
+        data = self._payload(prompt, max_tokens, temperature, stop)
+        data["stream"] = True
+        with self._post(data, stream=True) as resp:
+            # Without a declared charset iter_lines would yield bytes.
+            resp.encoding = resp.encoding or "utf-8"
+            try:
+                # Server-sent events: "data: {json}" lines, ": comment" keep-alives, "data: [DONE]".
+                for line in resp.iter_lines(decode_unicode=True):
+                    if not line or not line.startswith("data:"):
+                        continue
+                    payload = line[len("data:"):].strip()
+                    if payload == "[DONE]":
+                        break
+                    chunk = json.loads(payload)
+                    if isinstance(chunk.get("error"), dict):
+                        raise self._classify(chunk["error"].get("code"), f"API Error Details: {chunk['error']}")
+                    choices = chunk.get("choices") or [{}]
+                    text = (choices[0].get("delta") or {}).get("content")
+                    if text:
+                        yield text
+            except requests.RequestException as e:
+                raise LLMServerError(f"Stream interrupted: {e}")
+            except json.JSONDecodeError as e:
+                raise LLMResponseError(f"Invalid stream chunk: {e}")
 
+    def _payload(self, prompt: str, max_tokens: int = None, temperature: float = None,
+                 stop: Tuple[str, ...] = None) -> dict:
+        data = {
+            "model": self.model,
+            "messages": [{"role": "user", "content": prompt}],
+            "max_tokens": self.max_tokens if max_tokens is None else max_tokens,
+            "temperature": self.temperature if temperature is None else temperature,
+        }
+        stop = self.stop if stop is None else stop
+        if stop:
+            data["stop"] = list(stop)
+        return data
+
+    def _post(self, data: dict, stream: bool = False) -> requests.Response:
         try:
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json",
-            }
-
-            data = {
-                "model": self.model,
-                "messages": [{"role": "user", "content": prompt}],
-                "max_tokens": LLM_MAX_TOKENS,
-                "temperature": LLM_TEMPERATURE,
-            }
-
-            resp = requests.post(
+            resp = self.session.post(
                 f"{self.base_url}/chat/completions",
-                headers=headers,
                 json=data,
-                timeout=30
+                timeout=self.timeout,
+                stream=stream
             )
+        except requests.Timeout as e:
+            raise LLMTimeoutError(f"OpenRouter request timed out: {e}")
+        except requests.RequestException as e:
+            raise LLMServerError(f"OpenRouter request failed: {e}")
 
-            if not resp.ok:
-                error_detail = ""
-                try:
-                    error_json = resp.json()
-                    error_detail = f"\nAPI Error Details: {error_json}"
-                except:
-                    error_detail = f"\nResponse Text: {resp.text[:500]}"
+        if not resp.ok:
+            try:
+                error_detail = f"API Error Details: {resp.json()}"
+            except ValueError:
+                error_detail = f"Response Text: {resp.text[:500]}"
+            resp.close()
+            raise self._classify(resp.status_code, f"{resp.status_code} {resp.reason}\n{error_detail}",
+                                 resp.headers.get("Retry-After"))
+        return resp
 
-                print(f"OpenRouter API HTTP {resp.status_code} error{error_detail}")
-                raise requests.HTTPError(f"{resp.status_code} {resp.reason}{error_detail}")
+    @staticmethod
+    def _classify(status, message: str, retry_after: str = None) -> LLMError:
+        try:
+            status = int(status)
+        except (TypeError, ValueError):
+            status = None
+        if status == 429:
+            try:
+                delay = float(retry_after) if retry_after else None
+            except ValueError:
+                delay = None
+            return LLMRateLimitError(message, retry_after=delay)
+        if status in (401, 403):
+            return LLMConfigurationError(message)
+        if status is not None and status >= 500:
+            return LLMServerError(message, status=status)
+        return LLMResponseError(message)
 
-            result = resp.json()
 
-            try:
-                text = result["choices"][0]["message"]["content"]
-            except (KeyError, IndexError, TypeError) as e:
-                print(f"OpenRouter response structure error: {e}")
-                print(f"Response: {result}")
-                raise ValueError(f"Invalid API response structure: {e}")
+class GeminiLLM(BaseLLM):
+    provider = "gemini"
 
-            class R:
-                def __init__(self, content):
-                    self.content = content
+    # genai.configure sets process-wide state, so setup is serialized and
+    # only repeated when a client with a different key needs it.
+    _setup_lock = threading.Lock()
+    _configured_key = None
 
-            return R(text)
+    def __init__(self, api_key: str = None, model: str = None, config: LLMConfig = None):
+        config = config or get_config().llm
+        self.api_key = api_key or config.gemini_api_key
+        self.model = model or config.model_name
+        self.max_tokens = config.max_tokens
+        self.temperature = config.temperature
+        self.stop = tuple(config.stop)
+        self.read_timeout = config.read_timeout
+        self._genai = None
+        self._client = None
+        self._configs = {}
 
-        except Exception as e:
-            print(f"OpenRouter API error: {e}")
-            class R:
-                def __init__(self, content):
-                    self.content = content
-            return R(f"Error: {str(e)}")
+    def _ensure_client(self):
+        if self._client is not None:
+            return self._client
 
+        with GeminiLLM._setup_lock:
+            if self._client is None:
+                try:
+                    import google.generativeai as genai
+                except ImportError:
+                    raise LLMConfigurationError(
+                        "google-generativeai package not installed. Install it with: pip install google-generativeai"
+                    )
+
+                if GeminiLLM._configured_key != self.api_key:
+                    genai.configure(api_key=self.api_key)
+                    GeminiLLM._configured_key = self.api_key
+                self._genai = genai
+                self._client = genai.GenerativeModel(self.model)
+        return self._client
 
-class GeminiLLM:
-    def __init__(self, api_key: str = None, model: str = None):
-        self.api_key = api_key or GEMINI_API_KEY
-        self.model = model or MODEL_NAME
+    def generation_config(self, max_tokens: int = None, temperature: float = None, stop: Tuple[str, ...] = None):
+        key = (
+            self.max_tokens if max_tokens is None else max_tokens,
+            self.temperature if temperature is None else temperature,
+            tuple(self.stop if stop is None else stop),
+        )
+        config = self._configs.get(key)
+        if config is None:
+            self._ensure_client()
+            config = self._configs.setdefault(key, self._genai.types.GenerationConfig(
+                max_output_tokens=key[0],
+                temperature=key[1],
+                stop_sequences=list(key[2]) or None,
+            ))
+        return config
 
-    def invoke(self, prompt: str):
+    def _invoke(self, prompt: str, max_tokens: int = None, temperature: float = None,
+                stop: Tuple[str, ...] = None) -> LLMResponse:
         if not self.api_key:
-            class R:
-                def __init__(self, text):
-                    self.content = text
-            return R("[No API key set. Please set GEMINI_API_KEY environment variable]")
+            raise LLMConfigurationError("No API key set. Please set GEMINI_API_KEY environment variable")
 
+        model = self._ensure_client()
         try:
-            import google.generativeai as genai
+            response = model.generate_content(
+                prompt,
+                generation_config=self.generation_config(max_tokens, temperature, stop),
+                request_options={"timeout": self.read_timeout}
+            )
+            text = response.text
+        except Exception as e:
+            raise self._classify(e)
+
+        return LLMResponse(content=text, usage=self._usage(response))
 
-            genai.configure(api_key=self.api_key)
-            model = genai.GenerativeModel(self.model)
+    def _stream(self, prompt: str, max_tokens: int = None, temperature: float = None,
+                stop: Tuple[str, ...] = None):
+        if not self.api_key:
+            raise LLMConfigurationError("No API key set. Please set GEMINI_API_KEY environment variable")
 
+        model = self._ensure_client()
+        try:
             response = model.generate_content(
                 prompt,
-                generation_config=genai.types.GenerationConfig(
-                    max_output_tokens=LLM_MAX_TOKENS,
-                    temperature=LLM_TEMPERATURE,
-                )
+                generation_config=self.generation_config(max_tokens, temperature, stop),
+                request_options={"timeout": self.read_timeout},
+                stream=True
             )
 
-            class R:
-                def __init__(self, content):
-                    self.content = content
+            for chunk in response:
+                # Chunks blocked by safety filters carry no text parts.
+                if chunk.parts:
+                    yield chunk.text
+        except LLMError:
+            raise
+        except Exception as e:
+            raise self._classify(e)
 
-            return R(response.text)
+    @staticmethod
+    def _usage(response) -> dict:
+        metadata = getattr(response, "usage_metadata", None)
+        if metadata is None:
+            return {}
+        return {
+            "prompt_tokens": getattr(metadata, "prompt_token_count", 0),
+            "completion_tokens": getattr(metadata, "candidates_token_count", 0),
+            "total_tokens": getattr(metadata, "total_token_count", 0),
+        }
 
-        except ImportError:
-            print("Error: google-generativeai package not installed.")
-            print("Install it with: pip install google-generativeai")
-            class R:
-                def __init__(self, content):
-                    self.content = content
-            return R("Error: google-generativeai package not installed")
-        except Exception as e:
-            print(f"Gemini API error: {e}")
-            class R:
-                def __init__(self, content):
-                    self.content = content
-            return R(f"Error: {str(e)}")
-
-
-# Select LLM based on LLM_PROVIDER environment variable
-if LLM_PROVIDER.lower() == "gemini":
-    if GEMINI_API_KEY:
-        llm = GeminiLLM(api_key=GEMINI_API_KEY, model=MODEL_NAME)
-        print(f"Using Gemini model: {MODEL_NAME}")
-    else:
-        print("Warning: LLM_PROVIDER is set to 'gemini' but GEMINI_API_KEY is not set!")
-        print("Falling back to OpenRouter...")
-        llm = OpenRouterLLM(api_key=OPENROUTER_API_KEY, model=MODEL_NAME)
-        print(f"Using OpenRouter model: {MODEL_NAME}")
-elif LLM_PROVIDER.lower() == "openrouter":
-    if OPENROUTER_API_KEY:
-        llm = OpenRouterLLM(api_key=OPENROUTER_API_KEY, model=MODEL_NAME)
-        print(f"Using OpenRouter model: {MODEL_NAME}")
-    else:
+    @staticmethod
+    def _classify(error: Exception) -> LLMError:
+        # google.api_core exceptions carry the HTTP status as .code; matching
+        # on it avoids importing api_core just for the exception classes.
+        status = getattr(error, "code", None)
+        message = f"Gemini API error: {error}"
+        if type(error).__name__ == "DeadlineExceeded" or isinstance(error, TimeoutError):
+            return LLMTimeoutError(message)
+        if status == 429:
+            return LLMRateLimitError(message)
+        if status in (401, 403):
+            return LLMConfigurationError(message)
+        if isinstance(status, int) and status >= 500:
+            return LLMServerError(message, status=status)
+        if isinstance(error, (ConnectionError, OSError)):
+            return LLMServerError(message)
+        # Blocked prompts and empty candidates surface as ValueError.
+        return LLMResponseError(message)
+
+
+def create_llm(config: LLMConfig = None) -> BaseLLM:
+    config = config or get_config().llm
+    provider = config.provider
+
+    if not config.openrouter_api_key and not config.gemini_api_key and provider not in ("stub", "local"):
+        print("Warning: No API key set. Set either OPENROUTER_API_KEY or GEMINI_API_KEY")
+        print("OpenRouter: $env:OPENROUTER_API_KEY='your_key' (https://openrouter.ai/)")
+        print("Gemini: $env:GEMINI_API_KEY='your_key' (https://aistudio.google.com/app/apikey)")
+
+    if provider == "stub":
+        from src.rag.stub_llm import StubLLM
+
+        print("Using offline stub LLM")
+        return StubLLM(config=config)
+    if provider == "local":
+        from src.rag.local_llm import LocalTransformersLLM
+
+        print(f"Using local transformers model: {config.model_name}")
+        return LocalTransformersLLM(config=config)
+    if provider == "openrouter" and not config.openrouter_api_key:
         print("Warning: LLM_PROVIDER is set to 'openrouter' but OPENROUTER_API_KEY is not set!")
         print("Falling back to Gemini...")
-        llm = GeminiLLM(api_key=GEMINI_API_KEY, model=MODEL_NAME)
-        print(f"Using Gemini model: {MODEL_NAME}")
-else:
-    print(f"Warning: Unknown LLM_PROVIDER '{LLM_PROVIDER}'. Valid options: 'gemini' or 'openrouter'")
-    print("Defaulting to Gemini...")
-    llm = GeminiLLM(api_key=GEMINI_API_KEY, model=MODEL_NAME)
-    print(f"Using Gemini model: {MODEL_NAME}")
+        provider = "gemini"
+    elif provider == "gemini" and not config.gemini_api_key:
+        print("Warning: LLM_PROVIDER is set to 'gemini' but GEMINI_API_KEY is not set!")
+        print("Falling back to OpenRouter...")
+        provider = "openrouter"
+    elif provider not in ("gemini", "openrouter"):
+        print(f"Warning: Unknown LLM_PROVIDER '{provider}'. Valid options: 'gemini', 'openrouter', 'local' or 'stub'")
+        print("Defaulting to Gemini...")
+        provider = "gemini"
+
+    if provider == "openrouter":
+        print(f"Using OpenRouter model: {config.model_name}")
+        return OpenRouterLLM(config=config)
+    print(f"Using Gemini model: {config.model_name}")
+    return GeminiLLM(config=config)
+
+
+_llm = None
+_clients = {}
+_stage_llms = {}
+_llm_lock = threading.Lock()
+
+
+def get_llm(stage: str = None) -> BaseLLM:
+    # Constructed on first use and shared afterwards; importing this module
+    # does no I/O.
+    global _llm
+    if _llm is None:
+        with _llm_lock:
+            if _llm is None:
+                config = get_config().llm
+                _llm = _clients[(config.provider, config.model_name)] = create_llm(config)
+    if stage is None:
+        return _llm
+
+    client = _stage_llms.get(stage)
+    if client is None:
+        with _llm_lock:
+            client = _stage_llms.get(stage)
+            if client is None:
+                client = _stage_llms[stage] = _create_stage_llm(stage)
+    return client
+
+
+def _create_stage_llm(stage: str) -> StageLLM:
+    base = get_config().llm
+    config = base.for_stage(stage)
+    # Stages share one client (and its connection pool or loaded model) per
+    # provider and model; budgets, temperature and stop apply per call.
+    key = (config.provider, config.model_name)
+    client = _clients.get(key)
+    if client is None:
+        client = _clients[key] = create_llm(replace(base, provider=config.provider, model_name=config.model_name))
+    return StageLLM(client, max_tokens=config.max_tokens, temperature=config.temperature, stop=config.stop)
+
+
+def get_stage_llms() -> Dict[str, StageLLM]:
+    return {stage: get_llm(stage) for stage in LLM_STAGES}
+
+
+def __getattr__(name):
+    # `from src.rag.llm import llm` keeps working, now lazily.
+    if name == "llm":
+        return get_llm()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,288 @@
+
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Optional, Tuple
+
+from src.rag.llm_concurrency import was_coalesced
+from src.rag.prompt_builder import estimate_tokens
+from src.rag.query_metrics import LatencyHistogram
+
+
+def _load_prices() -> Dict[str, Dict[str, float]]:
+
+    # LLM_PRICES maps model -> {"input": usd, "output": usd} per million tokens.
+    raw = os.getenv("LLM_PRICES")
+    if not raw:
+        return {}
+    try:
+        prices = json.loads(raw)
+    except ValueError:
+        raise ValueError("LLM_PRICES must be a JSON object of model -> {\"input\": ..., \"output\": ...}")
+    return {model: {k: float(v) for k, v in price.items()} for model, price in prices.items()}
+
+
+class _Totals:
+
+    __slots__ = ("calls", "coalesced", "errors", "estimated", "prompt_tokens", "completion_tokens", "cost_usd", "wall_ms")
+
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.estimated = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost_usd = None
+        self.wall_ms = 0.0
+
+    def add(self, record: Dict[str, Any]):
+        if record["coalesced"]:
+            # Shared another caller's request; that caller paid for it.
+            self.coalesced += 1
+            return
+        self.calls += 1
+        if record["error"]:
+            self.errors += 1
+        if record["estimated"]:
+            self.estimated += 1
+        self.prompt_tokens += record["prompt_tokens"]
+        self.completion_tokens += record["completion_tokens"]
+        self.wall_ms += record["wall_ms"]
+        if record["cost_usd"] is not None:
+            self.cost_usd = (self.cost_usd or 0.0) + record["cost_usd"]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "errors": self.errors,
+            "estimated_calls": self.estimated,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "total_tokens": self.prompt_tokens + self.completion_tokens,
+            "cost_usd": round(self.cost_usd, 6) if self.cost_usd is not None else None,
+            "wall_ms": round(self.wall_ms, 3),
+        }
+
+
+class RequestUsage:
+
+
+    def __init__(self):
+        self.stages: Dict[str, _Totals] = {}
+        self.total = _Totals()
+        self.ttft_ms: Dict[str, float] = {}
+        # Map-reduce records from worker threads into the same request.
+        self._lock = threading.Lock()
+
+    def record(self, record: Dict[str, Any]):
+
+        with self._lock:
+            self.stages.setdefault(record["stage"], _Totals()).add(record)
+            self.total.add(record)
+            if record["ttft_ms"] is not None:
+                self.ttft_ms.setdefault(record["stage"], round(record["ttft_ms"], 3))
+
+    def to_dict(self) -> Dict[str, Any]:
+
+        with self._lock:
+            stages = {}
+            for stage, totals in self.stages.items():
+                stages[stage] = totals.to_dict()
+                stages[stage]["ttft_ms"] = self.ttft_ms.get(stage)
+            return dict(self.total.to_dict(), stages=stages)
+
+
+class UsageLedger:
+
+
+    def __init__(self, prices: Dict[str, Dict[str, float]] = None):
+        self.prices = prices if prices is not None else _load_prices()
+        self.stages: Dict[str, _Totals] = {}
+        self.models: Dict[str, _Totals] = {}
+        self.total = _Totals()
+        self.latency: Dict[str, LatencyHistogram] = {}
+        self.ttft: Dict[str, LatencyHistogram] = {}
+        self._lock = threading.Lock()
+
+    def cost(self, model: str, prompt_tokens: int, completion_tokens: int) -> Optional[float]:
+
+        price = self.prices.get(model)
+        if price is None:
+            return None
+        return (prompt_tokens * price.get("input", 0.0) + completion_tokens * price.get("output", 0.0)) / 1_000_000
+
+    def record(self, record: Dict[str, Any]):
+
+        with self._lock:
+            self.stages.setdefault(record["stage"], _Totals()).add(record)
+            self.models.setdefault(f"{record['provider']}/{record['model']}", _Totals()).add(record)
+            self.total.add(record)
+            if record["coalesced"]:
+                return
+            self.latency.setdefault(record["stage"], LatencyHistogram()).observe(record["wall_ms"])
+            if record["ttft_ms"] is not None:
+                self.ttft.setdefault(record["stage"], LatencyHistogram()).observe(record["ttft_ms"])
+
+    def get_stats(self) -> Dict[str, Any]:
+
+        with self._lock:
+            stages = {}
+            for stage, totals in self.stages.items():
+                stages[stage] = totals.to_dict()
+                stages[stage]["latency"] = self.latency[stage].to_dict() if stage in self.latency else None
+                if stage in self.ttft:
+                    stages[stage]["ttft"] = self.ttft[stage].to_dict()
+            return dict(
+                self.total.to_dict(),
+                stages=stages,
+                models={model: totals.to_dict() for model, totals in self.models.items()},
+            )
+
+
+_current_request: ContextVar[Optional[RequestUsage]] = ContextVar("llm_request_usage", default=None)
+
+_ledger = None
+_ledger_lock = threading.Lock()
+
+
+def get_usage_ledger() -> UsageLedger:
+
+    global _ledger
+    if _ledger is None:
+        with _ledger_lock:
+            if _ledger is None:
+                _ledger = UsageLedger()
+    return _ledger
+
+
+def current_request() -> Optional[RequestUsage]:
+
+    return _current_request.get()
+
+
+def use_request(usage: RequestUsage):
+
+    # For callers driving a generator step by step inside one Context
+    # (ctx.run), where a with-block cannot span the steps.
+    _current_request.set(usage)
+
+
+@contextmanager
+def track_request():
+
+    usage = RequestUsage()
+    token = _current_request.set(usage)
+    try:
+        yield usage
+    finally:
+        _current_request.reset(token)
+
+
+class AccountedLLM:
+
+
+    def __init__(self, llm, stage: str):
+        self.llm = llm
+        self.stage = stage
+
+    def __getattr__(self, name):
+
+        # provider, model, max_tokens, precompute, ... come from the client.
+        if name == "llm":
+            raise AttributeError(name)
+        return getattr(self.llm, name)
+
+    def invoke(self, prompt: str, max_tokens: int = None, temperature: float = None,
+               stop: Tuple[str, ...] = None):
+
+        start = time.perf_counter()
+        try:
+            response = self.llm.invoke(prompt, max_tokens=max_tokens, temperature=temperature, stop=stop)
+        except Exception:
+            self._record(prompt, "", None, start, None, error=True, coalesced=was_coalesced())
+            raise
+        # The whole answer arrives at once, so the first token is the last.
+        self._record(prompt, str(response), getattr(response, "usage", None), start, time.perf_counter(),
+                     coalesced=was_coalesced())
+        return response
+
+    async def ainvoke(self, prompt: str, max_tokens: int = None, temperature: float = None,
+                      stop: Tuple[str, ...] = None):
+
+        start = time.perf_counter()
+        try:
+            response = await self.llm.ainvoke(prompt, max_tokens=max_tokens, temperature=temperature, stop=stop)
+        except Exception:
+            self._record(prompt, "", None, start, None, error=True, coalesced=was_coalesced())
+            raise
+        self._record(prompt, str(response), getattr(response, "usage", None), start, time.perf_counter(),
+                     coalesced=was_coalesced())
+        return response
+
+    def stream(self, prompt: str, max_tokens: int = None, temperature: float = None,
+               stop: Tuple[str, ...] = None):
+
+        start = time.perf_counter()
+        first = None
+        chunks = []
+        error = False
+        try:
+            for chunk in self.llm.stream(prompt, max_tokens=max_tokens, temperature=temperature, stop=stop):
+                if first is None:
+                    first = time.perf_counter()
+                chunks.append(chunk)
+                yield chunk
+        except Exception:
+            error = True
+            raise
+        finally:
+            # Also reached when the consumer stops early: those tokens were spent.
+            self._record(prompt, "".join(chunks), None, start, first, error=error)
+
+    def _record(self, prompt: str, text: str, usage: Optional[Dict[str, Any]], start: float,
+                first_token: Optional[float], error: bool = False, coalesced: bool = False):
+
+        wall_ms = (time.perf_counter() - start) * 1000
+        estimated = not usage or "prompt_tokens" not in usage
+        if coalesced:
+            # The leader's record already carries these tokens and their cost.
+            estimated, prompt_tokens, completion_tokens = False, 0, 0
+        elif error and not text:
+            # Nothing came back; providers don't bill failed requests.
+            estimated, prompt_tokens, completion_tokens = False, 0, 0
+        elif estimated:
+            prompt_tokens, completion_tokens = estimate_tokens(prompt), estimate_tokens(text)
+        else:
+            prompt_tokens = int(usage.get("prompt_tokens") or 0)
+            completion_tokens = int(usage.get("completion_tokens") or 0)
+
+        ledger = get_usage_ledger()
+        model = getattr(self.llm, "model", None) or type(self.llm).__name__
+        record = {
+            "stage": self.stage,
+            "provider": getattr(self.llm, "provider", None),
+            "model": model,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "estimated": estimated,
+            "cost_usd": ledger.cost(model, prompt_tokens, completion_tokens),
+            "wall_ms": wall_ms,
+            "ttft_ms": (first_token - start) * 1000 if first_token is not None else None,
+            "error": error,
+            "coalesced": coalesced,
+        }
+        ledger.record(record)
+        request = current_request()
+        if request is not None:
+            request.record(record)
+
+
+def get_accounting_stats() -> Dict[str, Any]:
+
+    return get_usage_ledger().get_stats()
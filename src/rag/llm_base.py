@@ -0,0 +1,128 @@
+
+
+from typing import Tuple
+
+from src.domain.models import LLMResponse
+from src.rag.llm_concurrency import get_llm_gate
+from src.rag.llm_resilience import LLMRateLimitError, resilience_for
+from src.rag.prompt_builder import estimate_tokens
+from src.rag.rate_limiter import rate_limiter_for
+
+
+class BaseLLM:
+    provider = None
+    model = None
+    max_tokens = None
+    stop = ()
+
+    # How long a 429 without Retry-After holds the shared request bucket.
+    RATE_LIMIT_PAUSE_SECONDS = 1.0
+
+    def invoke(self, prompt: str, max_tokens: int = None, temperature: float = None,
+               stop: Tuple[str, ...] = None) -> LLMResponse:
+        stop = self.stop if stop is None else tuple(stop)
+        return get_llm_gate().call(
+            (type(self).__name__, self.model, stop, prompt, max_tokens, temperature),
+            lambda: self._call(prompt, max_tokens, temperature, stop),
+        )
+
+    async def ainvoke(self, prompt: str, max_tokens: int = None, temperature: float = None,
+                      stop: Tuple[str, ...] = None) -> LLMResponse:
+        stop = self.stop if stop is None else tuple(stop)
+        return await get_llm_gate().acall(
+            (type(self).__name__, self.model, stop, prompt, max_tokens, temperature),
+            lambda: self._call(prompt, max_tokens, temperature, stop),
+        )
+
+    def stream(self, prompt: str, max_tokens: int = None, temperature: float = None,
+               stop: Tuple[str, ...] = None):
+        stop = self.stop if stop is None else tuple(stop)
+        resilience = resilience_for(self.provider)
+        limiter = rate_limiter_for(self.provider)
+        with get_llm_gate().slot():
+            reserved = limiter.acquire(self._token_estimate(prompt, max_tokens))
+            chunks = []
+            for chunk in resilience.call_stream(lambda: self._throttled_stream(prompt, max_tokens, temperature, stop)):
+                chunks.append(chunk)
+                yield chunk
+            # Streams carry no usage, so the reservation is settled on an estimate.
+            limiter.settle(reserved, estimate_tokens(prompt) + estimate_tokens("".join(chunks)))
+
+    def _call(self, prompt: str, max_tokens: int = None, temperature: float = None,
+              stop: Tuple[str, ...] = None) -> LLMResponse:
+        # Queues for the provider quota once per call; retries are paced by
+        # their backoff and by the throttle a 429 puts on the shared bucket.
+        limiter = rate_limiter_for(self.provider)
+        reserved = limiter.acquire(self._token_estimate(prompt, max_tokens))
+        response = resilience_for(self.provider).call(lambda: self._throttled(prompt, max_tokens, temperature, stop))
+        usage = getattr(response, "usage", None) or {}
+        limiter.settle(reserved, usage.get("total_tokens"))
+        return response
+
+    def _throttled(self, prompt: str, max_tokens: int = None, temperature: float = None,
+                   stop: Tuple[str, ...] = None) -> LLMResponse:
+        try:
+            return self._invoke(prompt, max_tokens, temperature, stop)
+        except LLMRateLimitError as e:
+            rate_limiter_for(self.provider).throttle(e.retry_after or self.RATE_LIMIT_PAUSE_SECONDS)
+            raise
+
+    def _throttled_stream(self, prompt: str, max_tokens: int = None, temperature: float = None,
+                          stop: Tuple[str, ...] = None):
+        try:
+            yield from self._stream(prompt, max_tokens, temperature, stop)
+        except LLMRateLimitError as e:
+            rate_limiter_for(self.provider).throttle(e.retry_after or self.RATE_LIMIT_PAUSE_SECONDS)
+            raise
+
+    def _token_estimate(self, prompt: str, max_tokens: int = None) -> int:
+        # Providers meter the requested completion budget up front.
+        budget = self.max_tokens if max_tokens is None else max_tokens
+        return estimate_tokens(prompt) + (budget or 0)
+
+    def _invoke(self, prompt: str, max_tokens: int = None, temperature: float = None,
+                stop: Tuple[str, ...] = None) -> LLMResponse:
+        raise NotImplementedError
+
+    def _stream(self, prompt: str, max_tokens: int = None, temperature: float = None,
+                stop: Tuple[str, ...] = None):
+        raise NotImplementedError
+
+
+class StageLLM:
+
+
+    # One shared client per provider and model; each pipeline stage applies
+    # its own budget, temperature and stop sequences per call.
+    def __init__(self, llm: BaseLLM, max_tokens: int = None, temperature: float = None,
+                 stop: Tuple[str, ...] = None):
+        self.llm = llm
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.stop = None if stop is None else tuple(stop)
+
+    def __getattr__(self, name):
+
+        # provider, model, precompute, get_stats, ... come from the client.
+        if name == "llm":
+            raise AttributeError(name)
+        return getattr(self.llm, name)
+
+    def invoke(self, prompt: str, max_tokens: int = None, temperature: float = None,
+               stop: Tuple[str, ...] = None) -> LLMResponse:
+        return self.llm.invoke(prompt, *self._settings(max_tokens, temperature, stop))
+
+    async def ainvoke(self, prompt: str, max_tokens: int = None, temperature: float = None,
+                      stop: Tuple[str, ...] = None) -> LLMResponse:
+        return await self.llm.ainvoke(prompt, *self._settings(max_tokens, temperature, stop))
+
+    def stream(self, prompt: str, max_tokens: int = None, temperature: float = None,
+               stop: Tuple[str, ...] = None):
+        return self.llm.stream(prompt, *self._settings(max_tokens, temperature, stop))
+
+    def _settings(self, max_tokens: int = None, temperature: float = None, stop: Tuple[str, ...] = None):
+        return (
+            self.max_tokens if max_tokens is None else max_tokens,
+            self.temperature if temperature is None else temperature,
+            self.stop if stop is None else stop,
+        )
@@ -0,0 +1,178 @@
+
+
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+
+# Set for the caller whose last call() / acall() shared another caller's
+# request, so usage accounting can charge that request only once.
+_coalesced: ContextVar[bool] = ContextVar("llm_call_coalesced", default=False)
+
+
+def was_coalesced() -> bool:
+
+    return _coalesced.get()
+
+
+class _Flight:
+
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class LLMGate:
+
+
+    def __init__(self, max_concurrency: int = None, coalesce: bool = None):
+        self.max_concurrency = max_concurrency or int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+        self.coalesce = coalesce if coalesce is not None else (
+            os.getenv("LLM_COALESCE", "true").lower() == "true"
+        )
+        # One budget for every provider call in the process, sync or async.
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        # Async callers run on their own pool, sized to the cap, instead of
+        # the loop's default executor whose size depends on the CPU count.
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="llm")
+        self._lock = threading.Lock()
+        self._flights: Dict[Hashable, _Flight] = {}
+        self._tasks: Dict[Hashable, "asyncio.Task"] = {}
+        self.stats = {"calls": 0, "coalesced": 0, "queued": 0, "in_flight": 0, "peak_in_flight": 0}
+
+    @contextmanager
+    def slot(self):
+
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def acquire(self, blocking: bool = True) -> bool:
+
+        # The non-blocking form lets optional work (hedged requests) run only
+        # when the cap has room, holding a slot until release().
+        if not self._slots.acquire(blocking=False):
+            if not blocking:
+                return False
+            with self._lock:
+                self.stats["queued"] += 1
+            self._slots.acquire()
+        with self._lock:
+            self.stats["calls"] += 1
+            self.stats["in_flight"] += 1
+            self.stats["peak_in_flight"] = max(self.stats["peak_in_flight"], self.stats["in_flight"])
+        return True
+
+    def release(self):
+
+        with self._lock:
+            self.stats["in_flight"] -= 1
+        self._slots.release()
+
+    def call(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+
+        _coalesced.set(False)
+        if not self.coalesce:
+            with self.slot():
+                return fn()
+        coalesced, result, error = self._call(key, fn)
+        _coalesced.set(coalesced)
+        if error is not None:
+            raise error
+        return result
+
+    def _call(self, key: Hashable, fn: Callable[[], Any]) -> Tuple[bool, Any, Optional[BaseException]]:
+
+        # Returns (coalesced, result, error) rather than setting the flag, so
+        # a caller running this on a worker thread can set it in its own
+        # context. The leader's own failure propagates as usual.
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                self.stats["coalesced"] += 1
+
+        if not leader:
+            flight.event.wait()
+            return True, flight.result, flight.error
+
+        try:
+            with self.slot():
+                flight.result = fn()
+            return False, flight.result, None
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            # Later callers start a fresh request; only concurrent ones share.
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.event.set()
+
+    async def acall(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+
+        # Waiters await the leader's task rather than parking a worker thread
+        # each; the leader joins the sync path so it also coalesces with
+        # threads issuing the same prompt.
+        loop = asyncio.get_running_loop()
+        _coalesced.set(False)
+        # run_in_executor does not carry context variables over; copy them
+        # like asyncio.to_thread does.
+        if not self.coalesce:
+            return await loop.run_in_executor(self._executor, copy_context().run, self.call, key, fn)
+
+        loop_key = (id(loop), key)
+        task = self._tasks.get(loop_key)
+        joined = task is not None
+        if not joined:
+            task = asyncio.ensure_future(loop.run_in_executor(self._executor, copy_context().run, self._call, key, fn))
+            self._tasks[loop_key] = task
+            task.add_done_callback(lambda _: self._tasks.pop(loop_key, None))
+        else:
+            _coalesced.set(True)
+            with self._lock:
+                self.stats["coalesced"] += 1
+        coalesced, result, error = await asyncio.shield(task)
+        # The task may itself have joined a sync caller's flight; that is
+        # only known here, after the worker thread returns.
+        _coalesced.set(joined or coalesced)
+        if error is not None:
+            raise error
+        return result
+
+    def get_stats(self) -> Dict[str, Any]:
+
+        with self._lock:
+            return dict(self.stats, max_concurrency=self.max_concurrency, coalesce=self.coalesce)
+
+
+def create_llm_gate() -> LLMGate:
+
+    return LLMGate()
+
+
+_gate = None
+_gate_lock = threading.Lock()
+
+
+def get_llm_gate() -> LLMGate:
+
+    # Shared by every client so the cap covers all in-flight provider calls.
+    # Built on first use so it sees settings loaded from .env.
+    global _gate
+    if _gate is None:
+        with _gate_lock:
+            if _gate is None:
+                _gate = create_llm_gate()
+    return _gate
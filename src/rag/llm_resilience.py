@@ -0,0 +1,330 @@
+
+
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from src.rag.llm_concurrency import get_llm_gate
+from src.rag.query_metrics import LatencyHistogram
+
+
+class LLMError(Exception):
+
+    retryable = False
+
+
+class LLMConfigurationError(LLMError):
+    pass
+
+
+class LLMResponseError(LLMError):
+    pass
+
+
+class LLMUnavailableError(LLMError):
+    pass
+
+
+class LLMTimeoutError(LLMError):
+
+    retryable = True
+
+
+class LLMServerError(LLMError):
+
+    retryable = True
+
+    def __init__(self, message: str, status: int = None):
+        super().__init__(message)
+        self.status = status
+
+
+class LLMRateLimitError(LLMServerError):
+
+    def __init__(self, message: str, retry_after: float = None):
+        super().__init__(message, status=429)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+
+
+    def __init__(self, failure_threshold: int = None, reset_timeout: float = None):
+        self.failure_threshold = failure_threshold or int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+        self.reset_timeout = reset_timeout or float(os.getenv("LLM_BREAKER_RESET_SECONDS", "30"))
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+        self.stats = {"opened": 0, "rejected": 0}
+
+    def before_call(self):
+
+        with self._lock:
+            if self.state == "closed":
+                return
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = "half_open"
+            # While half-open a single probe goes through; everyone else
+            # keeps failing fast until it reports back.
+            if self.state == "half_open" and not self._probing:
+                self._probing = True
+                return
+            self.stats["rejected"] += 1
+            remaining = max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+        raise LLMUnavailableError(f"LLM provider circuit is open; retrying in {remaining:.0f}s")
+
+    def record_success(self):
+
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self):
+
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.stats["opened"] += 1
+                self.state = "open"
+                self.opened_at = time.monotonic()
+            self._probing = False
+
+    def release_probe(self):
+
+        with self._lock:
+            self._probing = False
+
+    def get_stats(self) -> Dict[str, Any]:
+
+        with self._lock:
+            return dict(self.stats, state=self.state, consecutive_failures=self.failures)
+
+
+class ResilientCaller:
+
+
+    # Below this many observed calls the p95 is too noisy to hedge on.
+    MIN_HEDGE_SAMPLES = 20
+
+    def __init__(self, retries: int = None, backoff_base: float = None, backoff_max: float = None,
+                 hedge: bool = None, hedge_delay_ms: float = None, breaker: CircuitBreaker = None):
+        self.retries = int(os.getenv("LLM_RETRIES", "2")) if retries is None else retries
+        self.backoff_base = backoff_base or float(os.getenv("LLM_BACKOFF_BASE_SECONDS", "0.5"))
+        self.backoff_max = backoff_max or float(os.getenv("LLM_BACKOFF_MAX_SECONDS", "8"))
+        self.hedge = hedge if hedge is not None else (
+            os.getenv("LLM_HEDGE", "false").lower() == "true"
+        )
+        configured_delay = os.getenv("LLM_HEDGE_DELAY_MS")
+        self.hedge_delay_ms = hedge_delay_ms if hedge_delay_ms is not None else (
+            float(configured_delay) if configured_delay else None
+        )
+        self.breaker = breaker or CircuitBreaker()
+        self.latency = LatencyHistogram()
+        self._executor = ThreadPoolExecutor(thread_name_prefix="llm-hedge") if self.hedge else None
+        self._lock = threading.Lock()
+        self.stats = {"calls": 0, "retries": 0, "failures": 0, "hedges": 0, "hedge_wins": 0, "hedges_skipped": 0}
+
+    def call(self, fn: Callable[[], Any]) -> Any:
+
+        self._count("calls")
+        for attempt in range(self.retries + 1):
+            self.breaker.before_call()
+            try:
+                result = self._attempt(fn)
+            except LLMError as e:
+                if not self._should_retry(e, attempt):
+                    raise
+                self._backoff(e, attempt)
+                continue
+            except Exception:
+                self._unexpected_failure()
+                raise
+            except BaseException:
+                # Interrupted rather than failed; let the next caller probe.
+                self.breaker.release_probe()
+                raise
+            self.breaker.record_success()
+            return result
+
+    def call_stream(self, fn: Callable[[], Iterator[str]]) -> Iterator[str]:
+
+        # Retries only before the first chunk; after that the caller has
+        # already shown partial text.
+        self._count("calls")
+        for attempt in range(self.retries + 1):
+            self.breaker.before_call()
+            started = False
+            try:
+                for chunk in fn():
+                    started = True
+                    yield chunk
+            except GeneratorExit:
+                # The consumer stopped reading; the provider was answering.
+                self.breaker.record_success()
+                raise
+            except LLMError as e:
+                if started:
+                    if e.retryable:
+                        self.breaker.record_failure()
+                    else:
+                        self.breaker.release_probe()
+                    self._count("failures")
+                    raise
+                if not self._should_retry(e, attempt):
+                    raise
+                self._backoff(e, attempt)
+                continue
+            except Exception:
+                self._unexpected_failure()
+                raise
+            except BaseException:
+                self.breaker.release_probe()
+                raise
+            self.breaker.record_success()
+            return
+
+    def _should_retry(self, error: LLMError, attempt: int) -> bool:
+
+        if error.retryable:
+            self.breaker.record_failure()
+        elif isinstance(error, LLMResponseError):
+            # The provider answered, so it is up even if the request was bad.
+            self.breaker.record_success()
+        else:
+            self.breaker.release_probe()
+
+        if error.retryable and attempt < self.retries:
+            return True
+        self._count("failures")
+        return False
+
+    def _unexpected_failure(self):
+
+        # Anything a client didn't classify (a bug, a transport error it let
+        # through) still counts against the provider, and frees a half-open
+        # probe so the breaker doesn't stay stuck waiting for it.
+        self.breaker.record_failure()
+        self._count("failures")
+
+    def _backoff(self, error: LLMError, attempt: int):
+
+        # Full jitter keeps many clients from retrying in lockstep.
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        retry_after = getattr(error, "retry_after", None)
+        if retry_after:
+            delay = max(delay, min(retry_after, self.backoff_max))
+        self._count("retries")
+        time.sleep(delay)
+
+    def _attempt(self, fn: Callable[[], Any]) -> Any:
+
+        delay_ms = self._hedge_delay_ms()
+        if delay_ms is None:
+            return self._timed(fn)
+
+        primary = self._executor.submit(self._timed, fn)
+        done, _ = wait([primary], timeout=delay_ms / 1000)
+        if done:
+            return primary.result()
+
+        # The first request is slower than usual; race a second copy and
+        # take whichever succeeds first. The copy needs its own slot under
+        # LLM_MAX_CONCURRENCY, and is skipped when the cap is already reached.
+        gate = get_llm_gate()
+        if not gate.acquire(blocking=False):
+            self._count("hedges_skipped")
+            return primary.result()
+        self._count("hedges")
+        hedged = self._executor.submit(self._timed, fn)
+        # The caller's slot ends when it returns with the winner, but the
+        # loser keeps running; the extra slot is held until both are done.
+        self._release_when_done(gate, primary, hedged)
+        pending = {primary, hedged}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    result = future.result()
+                except LLMError as e:
+                    error = error or e
+                    continue
+                if future is hedged:
+                    self._count("hedge_wins")
+                return result
+        raise error
+
+    @staticmethod
+    def _release_when_done(gate, *futures: Future):
+
+        remaining = [len(futures)]
+        lock = threading.Lock()
+
+        def done(_):
+            with lock:
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+            gate.release()
+
+        for future in futures:
+            future.add_done_callback(done)
+
+    def _hedge_delay_ms(self) -> Optional[float]:
+
+        if not self.hedge:
+            return None
+        if self.hedge_delay_ms is not None:
+            return self.hedge_delay_ms
+        with self._lock:
+            if self.latency.count < self.MIN_HEDGE_SAMPLES:
+                return None
+            return self.latency.quantile(0.95)
+
+    def _timed(self, fn: Callable[[], Any]) -> Any:
+
+        start = time.perf_counter()
+        result = fn()
+        with self._lock:
+            self.latency.observe((time.perf_counter() - start) * 1000)
+        return result
+
+    def _count(self, key: str):
+
+        with self._lock:
+            self.stats[key] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+
+        with self._lock:
+            stats = dict(self.stats, hedge=self.hedge, latency=self.latency.to_dict())
+        stats["breaker"] = self.breaker.get_stats()
+        return stats
+
+
+_callers: Dict[str, ResilientCaller] = {}
+_callers_lock = threading.Lock()
+
+
+def resilience_for(provider: str) -> ResilientCaller:
+
+    # One breaker per provider: every client talking to it shares its health.
+    with _callers_lock:
+        caller = _callers.get(provider)
+        if caller is None:
+            caller = _callers[provider] = ResilientCaller()
+        return caller
+
+
+def get_resilience_stats() -> Dict[str, Any]:
+
+    with _callers_lock:
+        callers = dict(_callers)
+    return {provider: caller.get_stats() for provider, caller in callers.items()}
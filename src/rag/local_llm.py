@@ -0,0 +1,439 @@
+
+
+import copy
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from src.domain.models import LLMResponse
+from src.rag.llm_base import BaseLLM
+from src.rag.llm_resilience import LLMConfigurationError, LLMResponseError
+from src.utils.config import LLMConfig, get_config
+
+
+class PrefixKVCache:
+
+
+    def __init__(self, block_size: int = None, max_entries: int = None):
+        self.block_size = block_size or int(os.getenv("LLM_LOCAL_PREFIX_BLOCK", "32"))
+        self.max_entries = max_entries or int(os.getenv("LLM_LOCAL_PREFIX_CACHE_SIZE", "4"))
+        # Each entry keeps one KV cache; every block boundary it covers is
+        # indexed, so prompts sharing only part of it still hit.
+        self._entries: "OrderedDict[int, Tuple[Any, List[int]]]" = OrderedDict()
+        self._index: Dict[Tuple[int, ...], int] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "reused_tokens": 0, "stored": 0, "evicted": 0, "unsupported": 0}
+
+    def lookup(self, token_ids: List[int]) -> Tuple[Optional[Any], int]:
+
+        # Leave at least one token uncached: generation needs fresh logits.
+        limit = (len(token_ids) - 1) // self.block_size * self.block_size
+        with self._lock:
+            for length in range(limit, 0, -self.block_size):
+                entry_id = self._index.get(tuple(token_ids[:length]))
+                if entry_id is None:
+                    continue
+                self._entries.move_to_end(entry_id)
+                cache = self._entries[entry_id][0]
+                self.stats["hits"] += 1
+                self.stats["reused_tokens"] += length
+                break
+            else:
+                self.stats["misses"] += 1
+                return None, 0
+        # Generation appends to the cache, so callers get their own copy.
+        reused = copy.deepcopy(cache)
+        reused.crop(length)
+        return reused, length
+
+    def store(self, token_ids: List[int], cache: Any):
+
+        length = len(token_ids) // self.block_size * self.block_size
+        if length == 0:
+            return
+        cache = self._croppable(cache)
+        with self._lock:
+            if cache is None:
+                self.stats["unsupported"] += 1
+                return
+            if tuple(token_ids[:length]) in self._index:
+                return
+            cache.crop(length)
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (cache, token_ids[:length])
+            for boundary in range(self.block_size, length + 1, self.block_size):
+                self._index[tuple(token_ids[:boundary])] = entry_id
+            self.stats["stored"] += 1
+            while len(self._entries) > self.max_entries:
+                self._evict()
+
+    @staticmethod
+    def _croppable(cache: Any) -> Optional[Any]:
+
+        # Models still on the legacy format return past_key_values as nested
+        # tuples, which can't be cropped to a block boundary.
+        if hasattr(cache, "crop"):
+            return cache
+        if isinstance(cache, (tuple, list)):
+            try:
+                from transformers import DynamicCache
+
+                return DynamicCache.from_legacy_cache(cache)
+            except (ImportError, AttributeError, TypeError, ValueError):
+                return None
+        return None
+
+    def _evict(self):
+
+        entry_id, (_, token_ids) = self._entries.popitem(last=False)
+        for boundary in range(self.block_size, len(token_ids) + 1, self.block_size):
+            key = tuple(token_ids[:boundary])
+            if self._index.get(key) == entry_id:
+                del self._index[key]
+        self.stats["evicted"] += 1
+
+    def covers(self, token_ids: List[int]) -> bool:
+
+        length = len(token_ids) // self.block_size * self.block_size
+        with self._lock:
+            return length == 0 or tuple(token_ids[:length]) in self._index
+
+    def get_stats(self) -> Dict[str, Any]:
+
+        with self._lock:
+            return dict(self.stats, entries=len(self._entries), block_size=self.block_size)
+
+
+def _until_stop(chunks: Iterator[str], stop: Tuple[str, ...]) -> Iterator[str]:
+
+    # Streams the text before the first stop string. Text that could still
+    # turn into one is held back until the next chunk settles it.
+    if not stop:
+        yield from chunks
+        return
+    pending = ""
+    for chunk in chunks:
+        pending += chunk
+        cut = min((pending.find(marker) for marker in stop if marker in pending), default=-1)
+        if cut >= 0:
+            if pending[:cut]:
+                yield pending[:cut]
+            return
+        held = max(
+            (n for marker in stop for n in range(1, len(marker)) if pending.endswith(marker[:n])), default=0,
+        )
+        if len(pending) > held:
+            yield pending[:len(pending) - held]
+            pending = pending[len(pending) - held:]
+    if pending:
+        yield pending
+
+
+class _Request:
+
+    __slots__ = ("prompt", "max_tokens", "temperature", "stop", "streamer", "done", "result", "error")
+
+    def __init__(self, prompt: str, max_tokens: int, temperature: float, stop: Tuple[str, ...], streamer=None):
+        self.prompt = prompt
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.stop = stop
+        self.streamer = streamer
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class LocalTransformersLLM(BaseLLM):
+
+
+    provider = "local"
+
+    def __init__(self, model: str = None, config: LLMConfig = None, max_batch: int = None,
+                 batch_window_ms: float = None, threads: int = None):
+        config = config or get_config().llm
+        self.model = model or config.model_name
+        self.device = "cpu" if config.device in ("auto", "", None) else config.device
+        self.max_tokens = config.max_tokens
+        self.temperature = config.temperature
+        self.stop = tuple(config.stop)
+        self.max_batch = max_batch or int(os.getenv("LLM_LOCAL_MAX_BATCH", "4"))
+        self.batch_window_ms = batch_window_ms if batch_window_ms is not None else float(
+            os.getenv("LLM_LOCAL_BATCH_WINDOW_MS", "10")
+        )
+        self.threads = threads or int(os.getenv("LLM_LOCAL_THREADS", "0"))
+        self.prefix_cache = PrefixKVCache()
+
+        self._torch = None
+        self._tokenizer = None
+        self._model = None
+        self._load_lock = threading.Lock()
+        self._queue: "queue.Queue[_Request]" = queue.Queue()
+        self._worker = None
+        self._stats_lock = threading.Lock()
+        self.stats = {"requests": 0, "batches": 0, "batched_requests": 0, "prompt_tokens": 0, "prefill_tokens": 0}
+
+    def _ensure_model(self):
+
+        if self._model is not None:
+            return
+        with self._load_lock:
+            if self._model is not None:
+                return
+            try:
+                import torch
+                from transformers import AutoModelForCausalLM, AutoTokenizer
+            except ImportError:
+                raise LLMConfigurationError(
+                    "transformers and torch are required for LLM_PROVIDER=local. Install them with: pip install transformers torch"
+                )
+
+            if self.threads:
+                torch.set_num_threads(self.threads)
+            try:
+                tokenizer = AutoTokenizer.from_pretrained(self.model)
+                model = AutoModelForCausalLM.from_pretrained(self.model, torch_dtype=torch.float32)
+            except (OSError, ValueError) as e:
+                raise LLMConfigurationError(f"Could not load local model '{self.model}': {e}")
+            # Batches are left-padded so every row ends where generation starts.
+            tokenizer.padding_side = "left"
+            if tokenizer.pad_token is None:
+                tokenizer.pad_token = tokenizer.eos_token
+
+            self._torch = torch
+            self._tokenizer = tokenizer
+            self._model = model.to(self.device).eval()
+            self._worker = threading.Thread(target=self._run, name="local-llm", daemon=True)
+            self._worker.start()
+
+    def precompute(self, text: str):
+
+        # Prefill the KV cache for a static prompt prefix ahead of the first
+        # request that starts with it.
+        self._ensure_model()
+        token_ids = self._encode(text, prefix_only=True)
+        if self.prefix_cache.covers(token_ids):
+            return
+        with self._torch.inference_mode():
+            inputs = self._torch.tensor([token_ids], device=self.device)
+            outputs = self._model(input_ids=inputs, use_cache=True)
+        self.prefix_cache.store(token_ids, outputs.past_key_values)
+
+    def _invoke(self, prompt: str, max_tokens: int = None, temperature: float = None,
+                stop: Tuple[str, ...] = None) -> LLMResponse:
+
+        request = self._submit(prompt, max_tokens, temperature, stop)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _stream(self, prompt: str, max_tokens: int = None, temperature: float = None,
+                stop: Tuple[str, ...] = None):
+
+        self._ensure_model()
+        from transformers import TextIteratorStreamer
+
+        streamer = TextIteratorStreamer(self._tokenizer, skip_prompt=True, skip_special_tokens=True)
+        request = self._submit(prompt, max_tokens, temperature, stop, streamer)
+        # Generation halts on a stop string but the streamer still emits it.
+        for text in _until_stop((text for text in streamer if text), request.stop):
+            yield text
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+
+    def _submit(self, prompt: str, max_tokens: int = None, temperature: float = None,
+                stop: Tuple[str, ...] = None, streamer=None) -> _Request:
+
+        self._ensure_model()
+        request = _Request(
+            prompt,
+            self.max_tokens if max_tokens is None else max_tokens,
+            self.temperature if temperature is None else temperature,
+            tuple(self.stop if stop is None else stop),
+            streamer,
+        )
+        self._queue.put(request)
+        return request
+
+    def _run(self):
+
+        while True:
+            batch = [self._queue.get()]
+            # Gather whatever else arrives within the window into one batch.
+            deadline = time.monotonic() + self.batch_window_ms / 1000
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                self._process(batch)
+            except Exception as e:
+                # Never leave a caller waiting on a request the worker dropped.
+                for request in batch:
+                    if not request.done.is_set():
+                        self._finish(request, error=LLMResponseError(f"Local generation failed: {e}"))
+
+    def _process(self, batch: List[_Request]):
+
+        encoded = []
+        for request in batch:
+            try:
+                encoded.append((request, self._encode(request.prompt)))
+            except Exception as e:
+                self._finish(request, error=LLMResponseError(f"Could not tokenize prompt: {e}"))
+
+        # Prefix hits and streams run one at a time so they can resume from
+        # their cached KV state; the remaining misses share a padded batch
+        # with others that sample the same way and have the same budget.
+        singles, misses = [], {}
+        for request, token_ids in encoded:
+            cache, cached_length = self.prefix_cache.lookup(token_ids)
+            if cache is not None or request.streamer is not None or len(encoded) == 1:
+                singles.append((request, token_ids, cache, cached_length))
+            else:
+                misses.setdefault((request.temperature, request.stop, request.max_tokens), []).append(
+                    (request, token_ids)
+                )
+        batches = []
+        for group in misses.values():
+            if len(group) == 1:
+                request, token_ids = group[0]
+                singles.append((request, token_ids, None, 0))
+            else:
+                batches.append(group)
+
+        for request, token_ids, cache, cached_length in singles:
+            self._generate_single(request, token_ids, cache, cached_length)
+        for group in batches:
+            self._generate_batch(group)
+
+    def _generate_single(self, request: _Request, token_ids: List[int], cache: Any, cached_length: int):
+
+        torch = self._torch
+        try:
+            inputs = torch.tensor([token_ids], device=self.device)
+            with torch.inference_mode():
+                output = self._model.generate(
+                    input_ids=inputs,
+                    attention_mask=torch.ones_like(inputs),
+                    past_key_values=cache,
+                    return_dict_in_generate=True,
+                    streamer=request.streamer,
+                    **self._sampling(request),
+                )
+            self.prefix_cache.store(token_ids, output.past_key_values)
+            generated = output.sequences[0][len(token_ids):]
+        except Exception as e:
+            self._finish(request, error=LLMResponseError(f"Local generation failed: {e}"))
+            return
+
+        self._count(1, len(token_ids), len(token_ids) - cached_length)
+        self._finish(request, result=self._response(request, token_ids, generated))
+
+    def _generate_batch(self, items: List[Tuple[_Request, List[int]]]):
+
+        torch = self._torch
+        try:
+            width = max(len(token_ids) for _, token_ids in items)
+            pad = self._tokenizer.pad_token_id
+            input_ids = torch.tensor([[pad] * (width - len(t)) + t for _, t in items], device=self.device)
+            attention_mask = torch.tensor([[0] * (width - len(t)) + [1] * len(t) for _, t in items], device=self.device)
+            # Requests in a batch share temperature, stop strings and max_tokens.
+            with torch.inference_mode():
+                sequences = self._model.generate(
+                    input_ids=input_ids, attention_mask=attention_mask, **self._sampling(items[0][0]),
+                )
+        except Exception as e:
+            for request, _ in items:
+                self._finish(request, error=LLMResponseError(f"Local generation failed: {e}"))
+            return
+
+        self._count(len(items), sum(len(t) for _, t in items), sum(len(t) for _, t in items))
+        for row, (request, token_ids) in enumerate(items):
+            generated = sequences[row][width:]
+            self._finish(request, result=self._response(request, token_ids, generated))
+
+    def _sampling(self, request: _Request) -> Dict[str, Any]:
+
+        params = {"max_new_tokens": request.max_tokens, "pad_token_id": self._tokenizer.pad_token_id}
+        if request.stop:
+            params.update(stop_strings=list(request.stop), tokenizer=self._tokenizer)
+        if request.temperature and request.temperature > 0:
+            params.update(do_sample=True, temperature=request.temperature)
+        else:
+            params.update(do_sample=False)
+        return params
+
+    def _encode(self, prompt: str, prefix_only: bool = False) -> List[int]:
+
+        tokenizer = self._tokenizer
+        if getattr(tokenizer, "chat_template", None):
+            marker = "\x00"
+            text = tokenizer.apply_chat_template(
+                [{"role": "user", "content": prompt + (marker if prefix_only else "")}],
+                tokenize=False,
+                add_generation_prompt=not prefix_only,
+            )
+            if prefix_only:
+                text = text.split(marker, 1)[0]
+        else:
+            text = prompt
+        return tokenizer(text, add_special_tokens=False)["input_ids"]
+
+    def _response(self, request: _Request, token_ids: List[int], generated) -> LLMResponse:
+
+        text = self._tokenizer.decode(generated, skip_special_tokens=True)
+        # Generation halts on a stop string but still emits it; API providers don't.
+        for stop in request.stop:
+            text = text.split(stop, 1)[0]
+        text = text.strip()
+        pad = self._tokenizer.pad_token_id
+        completion_tokens = sum(1 for token in generated.tolist() if token != pad)
+        return LLMResponse(content=text, usage={
+            "prompt_tokens": len(token_ids),
+            "completion_tokens": completion_tokens,
+            "total_tokens": len(token_ids) + completion_tokens,
+        })
+
+    @staticmethod
+    def _finish(request: _Request, result: LLMResponse = None, error: Exception = None):
+
+        request.result = result
+        request.error = error
+        if error is not None and request.streamer is not None:
+            # Unblocks the consumer iterating the streamer.
+            request.streamer.end()
+        request.done.set()
+
+    def _count(self, requests: int, prompt_tokens: int, prefill_tokens: int):
+
+        with self._stats_lock:
+            self.stats["requests"] += requests
+            self.stats["batches"] += 1
+            if requests > 1:
+                self.stats["batched_requests"] += requests
+            self.stats["prompt_tokens"] += prompt_tokens
+            self.stats["prefill_tokens"] += prefill_tokens
+
+    def get_stats(self) -> Dict[str, Any]:
+
+        with self._stats_lock:
+            stats = dict(self.stats, model=self.model, device=self.device, max_batch=self.max_batch)
+        stats["prefix_cache"] = self.prefix_cache.get_stats()
+        return stats
+
+
+def create_local_llm(config: LLMConfig = None) -> LocalTransformersLLM:
+
+    return LocalTransformersLLM(config=config)
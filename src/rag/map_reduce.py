@@ -0,0 +1,131 @@
+
+
+import os
+import threading
+import time
+from contextvars import copy_context
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Any
+
+from src.rag.data_serializer import TableSerializer
+from src.rag.query_metrics import LatencyHistogram
+
+
+class MapReduceAnswerer:
+
+
+    MAP_TEMPLATE = """You are helping answer a Clash Royale question from knowledge graph data.
+The data is too large for one pass, so this is part {part} of {parts}.
+
+## User Question:
+{question}
+
+## Graph Data (part {part} of {parts}):
+{data}
+
+## Notes:
+Write compact plain-text notes for THIS part only: one line per card with the facts from the data above that matter for the question. Include EVERY card in this part. No introduction, no conclusion, no markdown."""
+
+    REDUCE_TEMPLATE = """You are a helpful Clash Royale assistant. The graph data for the question below was read in {parts} parts and each part was condensed into notes.
+
+## User Question:
+{question}
+
+## Notes:
+{notes}
+
+## Your Answer:
+Merge the notes into one clear, concise plain-text answer (no markdown). Keep EVERY card mentioned in the notes and do not add facts that are not in them. Do not mention parts or notes."""
+
+    def __init__(self, serializer: TableSerializer, enabled: bool = None, row_threshold: int = None,
+                 token_threshold: int = None, chunk_rows: int = None, max_workers: int = None):
+        self.serializer = serializer
+        self.enabled = enabled if enabled is not None else (
+            os.getenv("MAP_REDUCE", "true").lower() == "true"
+        )
+        self.row_threshold = row_threshold or int(os.getenv("MAP_REDUCE_ROW_THRESHOLD", "40"))
+        # By default split exactly when the single prompt would drop rows.
+        self.token_threshold = token_threshold or int(
+            os.getenv("MAP_REDUCE_TOKEN_THRESHOLD", str(serializer.token_budget))
+        )
+        self.chunk_rows = chunk_rows or int(os.getenv("MAP_REDUCE_CHUNK_ROWS", "25"))
+        self.max_workers = max_workers or int(os.getenv("MAP_REDUCE_WORKERS", "4"))
+        # Shared by all requests, so concurrent questions cannot multiply
+        # the number of in-flight LLM calls past max_workers.
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="map-reduce")
+        self._lock = threading.Lock()
+        self.stats = {"runs": 0, "chunks": 0, "failed_chunks": 0}
+        self.map_latency = LatencyHistogram()
+
+    def should_split(self, data: List[Dict[str, Any]]) -> bool:
+
+        if not self.enabled or not data or len(data) < 2:
+            return False
+        return len(data) > self.row_threshold or self.serializer.measure(data) > self.token_threshold
+
+    def chunk(self, data: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+
+        # Fill each chunk up to the row limit, closing it early once the
+        # serialized table would no longer fit the data budget untruncated.
+        chunks, current = [], []
+        for record in data:
+            candidate = current + [record]
+            if current and (len(candidate) > self.chunk_rows
+                            or self.serializer.measure(candidate) > self.serializer.token_budget):
+                chunks.append(current)
+                candidate = [record]
+            current = candidate
+        if current:
+            chunks.append(current)
+        return chunks
+
+    def map(self, question: str, chunks: List[List[Dict[str, Any]]], complete: Callable[[str], str]) -> List[str]:
+
+        # Takes chunk()'s output so the caller can look at the split first.
+        prompts = [
+            self.MAP_TEMPLATE.format(
+                part=index, parts=len(chunks), question=question, data=self.serializer.serialize(rows)
+            )
+            for index, rows in enumerate(chunks, 1)
+        ]
+
+        start = time.perf_counter()
+        # Workers run in the caller's context so per-request accounting sees them.
+        futures = [self._executor.submit(copy_context().run, complete, prompt) for prompt in prompts]
+        wait(futures)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        failed = [future.exception() for future in futures if future.exception() is not None]
+        with self._lock:
+            self.stats["runs"] += 1
+            self.stats["chunks"] += len(chunks)
+            self.stats["failed_chunks"] += len(failed)
+            self.map_latency.observe(elapsed_ms)
+        # A missing chunk would silently drop cards from the answer.
+        if failed:
+            raise failed[0]
+        return [future.result() for future in futures]
+
+    def reduce_prompt(self, question: str, notes: List[str]) -> str:
+
+        joined = "\n\n".join(f"Part {index}:\n{note}" for index, note in enumerate(notes, 1))
+        return self.REDUCE_TEMPLATE.format(parts=len(notes), question=question, notes=joined)
+
+    def signature(self) -> str:
+
+        return f"{self.enabled}:{self.row_threshold}:{self.token_threshold}:{self.chunk_rows}"
+
+    def get_stats(self) -> Dict[str, Any]:
+
+        with self._lock:
+            return dict(
+                self.stats,
+                enabled=self.enabled,
+                max_workers=self.max_workers,
+                map_latency=self.map_latency.to_dict(),
+            )
+
+
+def create_map_reduce(serializer: TableSerializer = None) -> MapReduceAnswerer:
+
+    return MapReduceAnswerer(serializer or TableSerializer())
@@ -1,25 +1,75 @@
-from typing import Optional
+from contextvars import copy_context
+from functools import partial
+from typing import Any, Dict, Optional
 import time
 import sys
 
 from src.domain.models import RAGResponse, QueryResult
 from src.rag.translator import QueryTranslator
+from src.rag.cypher_linter import CypherLintError
+from src.rag.llm_resilience import LLMError
+from src.rag.llm_accounting import AccountedLLM, RequestUsage, track_request, use_request
 from src.rag.retriever import KGRetriever
 from src.rag.generator import AnswerGenerator
+from src.rag.cypher_normalizer import CypherNormalizer
+from src.rag.query_rewriter import ProjectionRewriter
 from src.rag.query_preprocessor import QueryPreprocessor, SmartResponseEnhancer
+from src.utils.config import LLM_STAGES
 
 
 class RAGPipeline:
-    def __init__(self, llm, verbose: bool = False):
+    def __init__(self, llm, verbose: bool = False, stage_llms: Optional[Dict[str, Any]] = None):
         self.llm = llm
         self.verbose = verbose
-        self.translator = QueryTranslator(llm)
+        # Each stage may run on its own client; unset stages use `llm`. The
+        # wrapper tags every call with its stage for usage accounting.
+        clients = {stage: llm for stage in LLM_STAGES}
+        clients.update(stage_llms or {})
+        self.stage_llms = {stage: AccountedLLM(client, stage) for stage, client in clients.items()}
         self.retriever = KGRetriever()
-        self.generator = AnswerGenerator(llm)
         self.preprocessor = QueryPreprocessor(self.retriever)
+        self.translator = QueryTranslator(
+            self.stage_llms["translator"],
+            card_names=self.preprocessor.get_all_card_names,
+            repair_llm=self.stage_llms["repair"],
+        )
+        self.generator = AnswerGenerator(
+            self.stage_llms["generator"],
+            # Read past GRAPH_EPOCH_TTL: a cached answer must never outlive a
+            # re-ingestion, and the lookup only runs before an LLM call.
+            epoch_source=partial(self.retriever.get_epoch, force=True),
+            summarizer_llm=self.stage_llms["summarizer"],
+        )
+        self.normalizer = CypherNormalizer()
+        self.rewriter = ProjectionRewriter()
         self.response_enhancer = SmartResponseEnhancer(self.retriever)
+        self._warm_prefixes()
+
+    def _warm_prefixes(self):
+
+        # Local models can prefill the static prompt prefixes once up front.
+        prefixes = (
+            (self.translator.llm, self.translator.static_prefix()),
+            (self.generator.llm, self.generator.static_prefix()),
+        )
+        for llm, prefix in prefixes:
+            precompute = getattr(llm, "precompute", None)
+            if precompute is None:
+                continue
+            try:
+                precompute(prefix)
+            except Exception as e:
+                # Warming is an optimization; the first request prefills instead.
+                if self.verbose:
+                    print(f"Could not precompute prompt prefix: {e}")
 
     def query(self, question: str) -> RAGResponse:
+        with track_request() as usage:
+            response = self._answer(question)
+        response.llm_usage = usage.to_dict()
+        return response
+
+    def _answer(self, question: str) -> RAGResponse:
         if self.verbose:
             print(f"\n{'='*60}")
             print(f"Question: {question}")
@@ -28,21 +78,54 @@ class RAGPipeline:
         if self.verbose:
             print("\n[1/3] Translating to Cypher...")
 
-        cypher_query = self.translator.translate(question)
+        try:
+            translated = self.translator.translate(question)
+        except CypherLintError as e:
+            # Rejected locally, so the database is never asked.
+            if self.verbose:
+                print(f"Invalid Cypher after repair: {e}")
+            query_result = QueryResult(data=[], cypher_query="", execution_time=0.0,
+                                       error=f"Invalid query: {e}")
+            return self.generator.generate(question, query_result)
+        except LLMError as e:
+            if self.verbose:
+                print(f"Translation failed: {e}")
+            query_result = QueryResult(data=[], cypher_query="", execution_time=0.0,
+                                       error=f"Language model unavailable: {e}")
+            return self.generator.generate(question, query_result)
+
+        prompt_stats = self.translator.last_prompt_stats()
+        rewrite = self.rewriter.rewrite(translated, question)
+        cypher_query = rewrite.cypher
 
         if self.verbose:
+            if prompt_stats:
+                print(f"Translation prompt: ~{prompt_stats.estimated_tokens} tokens "
+                      f"({prompt_stats.examples} examples, {prompt_stats.relationship_types})")
+            else:
+                print("Translation served from cache")
             print(f"Generated Cypher:\n{cypher_query}")
+            if rewrite.rewritten:
+                print(f"Projected whole-entity RETURN to: {rewrite.projected}")
 
         if self.verbose:
             print("\n[2/3] Retrieving from Knowledge Graph...")
 
-        query_result = self.retriever.retrieve(cypher_query)
+        normalized = self.normalizer.normalize(cypher_query)
+        query_result = self.retriever.retrieve(
+            normalized.cypher, normalized.parameters, display_query=cypher_query,
+            fingerprint=normalized.fingerprint,
+        )
+        self.translator.record_outcome(question, translated, query_result.error is None)
+        bytes_saved = self.rewriter.record_rows(rewrite, len(query_result.data))
 
         if self.verbose:
             if query_result.error:
                 print(f"Error: {query_result.error}")
             else:
                 print(f"Retrieved {len(query_result.data)} records in {query_result.execution_time:.3f}s")
+                if bytes_saved:
+                    print(f"Projection saved ~{bytes_saved} bytes")
                 if query_result.data:
                     print(f"Sample: {query_result.data[0]}")
 
@@ -61,6 +144,26 @@ class RAGPipeline:
         return response
 
     def query_with_streaming(self, question: str):
+        # Callers may step this generator from different threads (the web app
+        # does, via a thread pool), so every step runs in one Context that
+        # carries this request's usage.
+        usage = RequestUsage()
+        context = copy_context()
+        context.run(use_request, usage)
+        events = self._stream_events(question)
+        try:
+            while True:
+                try:
+                    kind, payload = context.run(next, events)
+                except StopIteration:
+                    return
+                if kind == "done":
+                    payload = dict(payload, llm_usage=usage.to_dict())
+                yield kind, payload
+        finally:
+            context.run(events.close)
+
+    def _stream_events(self, question: str):
         try:
             if self.preprocessor.is_deck_analysis_query(question):
                 deck = self.preprocessor.extract_deck_from_query(question)
@@ -100,7 +203,16 @@ class RAGPipeline:
             yield ("cypher", "Translating question to graph query...")
 
             try:
-                cypher_query = self.translator.translate(question)
+                translated = self.translator.translate(question)
+                prompt_stats = self.translator.last_prompt_stats()
+                rewrite = self.rewriter.rewrite(translated, question)
+                cypher_query = rewrite.cypher
+            except CypherLintError as e:
+                yield ("error", f"Invalid query: {str(e)}")
+                return
+            except LLMError as e:
+                yield ("error", f"Language model unavailable: {str(e)}")
+                return
             except Exception as e:
                 yield ("error", f"Translation error: {str(e)}")
                 return
@@ -110,11 +222,19 @@ class RAGPipeline:
             yield ("retrieval", "Searching knowledge graph...")
 
             try:
-                query_result = self.retriever.retrieve(cypher_query)
+                normalized = self.normalizer.normalize(cypher_query)
+                query_result = self.retriever.retrieve(
+                    normalized.cypher, normalized.parameters, display_query=cypher_query,
+                    fingerprint=normalized.fingerprint,
+                )
+                self.rewriter.record_rows(rewrite, len(query_result.data))
             except Exception as e:
+                self.translator.record_outcome(question, translated, False)
                 yield ("error", f"Retrieval error: {str(e)}")
                 return
 
+            self.translator.record_outcome(question, translated, query_result.error is None)
+
             if query_result.error:
                 yield ("error", query_result.error)
                 return
@@ -130,8 +250,13 @@ class RAGPipeline:
                     query_result.data = alternative['data']
                     query_result.cypher_query = alternative.get('query', cypher_query)
 
+            response = None
             try:
-                response = self.generator.generate(question, query_result)
+                for kind, payload in self.generator.generate_stream(question, query_result):
+                    if kind == "delta":
+                        yield ("generation", payload)
+                    else:
+                        response = payload
             except Exception as e:
                 yield ("error", f"Generation error: {str(e)}")
                 return
@@ -140,12 +265,12 @@ class RAGPipeline:
                 yield ("error", "Failed to generate answer")
                 return
 
-            yield ("generation", response.answer)
-
             yield ("done", {
                 "sources": response.sources or [],
                 "confidence": response.confidence or 0.0,
-                "cypher": response.cypher_query or cypher_query
+                "cypher": response.cypher_query or cypher_query,
+                "cached": response.cached,
+                "translation_prompt": prompt_stats.to_dict() if prompt_stats else None
             })
         except Exception as e:
             import traceback
@@ -162,8 +287,8 @@ class RAGPipeline:
         return self.retriever.get_stats()
 
 
-def create_pipeline(llm, verbose: bool = False) -> RAGPipeline:
-    return RAGPipeline(llm, verbose=verbose)
+def create_pipeline(llm, verbose: bool = False, stage_llms: Optional[Dict[str, Any]] = None) -> RAGPipeline:
+    return RAGPipeline(llm, verbose=verbose, stage_llms=stage_llms)
 
 
 def query(question: str, llm, verbose: bool = False) -> RAGResponse:
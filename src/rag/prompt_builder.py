@@ -0,0 +1,142 @@
+
+
+import math
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Any, Tuple
+
+from src.kg.schema import KGSchema
+from src.rag.semantic_cache import QuestionEmbedder
+
+
+def estimate_tokens(text: str) -> int:
+
+    # Roughly four characters per token for English prose and Cypher.
+    return math.ceil(len(text or "") / 4)
+
+
+@dataclass
+class PromptStats:
+
+    chars: int
+    estimated_tokens: int
+    full_estimated_tokens: int
+    examples: int = 0
+    node_types: List[str] = field(default_factory=list)
+    relationship_types: List[str] = field(default_factory=list)
+
+    def to_dict(self) -> Dict[str, Any]:
+
+        return {
+            "chars": self.chars,
+            "estimated_tokens": self.estimated_tokens,
+            "estimated_tokens_saved": self.full_estimated_tokens - self.estimated_tokens,
+            "examples": self.examples,
+            "node_types": self.node_types,
+            "relationship_types": self.relationship_types,
+        }
+
+
+class PromptAssembler:
+
+
+    # Phrases suggesting a question needs a relationship type.
+    RELATIONSHIP_HINTS = {
+        "COUNTERS": r"counter\w*|beat\w*|stop\w*|against|weak\w*|defend\w*|deal with|handle\w*|answer\w*",
+        "SYNERGIZES_WITH": r"synerg\w*|combo\w*|pair\w*|works? (?:well )?with|goes with|partner\w*|support\w*",
+        "FITS_ARCHETYPE": r"archetype\w*|beatdown|cycle|control|siege|bait|bridge ?spam|playstyle|role\w*",
+        "HAS_RARITY": r"rarit\w*|common|rare|epic|legendar\w*|champion\w*",
+        "UNLOCKS_IN": r"arena\w*|unlock\w*|troph\w*",
+        "CAN_HIT": r"air|ground|target\w*|flying|can hit",
+        "HAS_TYPE": r"spells?|troops?|buildings?|types?",
+    }
+
+    EXAMPLE_RELATIONSHIP_BONUS = 0.5
+
+    def __init__(self, schema: KGSchema = None, k: int = None, prune_schema: bool = None):
+        self.schema = schema or KGSchema()
+        self.k = k if k is not None else int(os.getenv("TRANSLATOR_FEW_SHOT_K", "3"))
+        self.prune_schema = prune_schema if prune_schema is not None else (
+            os.getenv("TRANSLATOR_PRUNE_SCHEMA", "true").lower() == "true"
+        )
+        self.embedder = QuestionEmbedder()
+        self.examples = self.schema.get_cypher_examples()
+        self._example_vectors = [self.embedder.features(ex["question"]) for ex in self.examples]
+        self._hints = {
+            rel: re.compile(rf"\b(?:{pattern})\b", re.IGNORECASE)
+            for rel, pattern in self.RELATIONSHIP_HINTS.items()
+        }
+
+    def full_context(self) -> Tuple[str, str]:
+
+        return self.schema.get_schema_description(), self._format_examples(self.examples)
+
+    def assemble(self, question: str) -> Tuple[str, str]:
+
+        if not self.prune_schema:
+            relationship_types = list(self.schema.RELATIONSHIPS)
+            schema_desc = self.schema.get_schema_description()
+        else:
+            relationship_types = self.select_relationship_types(question)
+            node_types = self._node_types_for(relationship_types)
+            schema_desc = self.schema.get_schema_description(node_types, relationship_types)
+            schema_desc += self._other_relationships(relationship_types)
+
+        examples = self.select_examples(question, relationship_types)
+        return schema_desc, self._format_examples(examples)
+
+    def select_relationship_types(self, question: str) -> List[str]:
+
+        return [rel for rel, pattern in self._hints.items() if pattern.search(question or "")]
+
+    def select_examples(self, question: str, relationship_types: List[str]) -> List[Dict[str, str]]:
+
+        if self.k <= 0:
+            return []
+        if self.k >= len(self.examples):
+            return list(self.examples)
+
+        query = self.embedder.features(question or "")
+        scored = []
+        for index, (example, vector) in enumerate(zip(self.examples, self._example_vectors)):
+            score = self._cosine(query, vector)
+            if any(f":{rel}" in example["cypher"] for rel in relationship_types):
+                score += self.EXAMPLE_RELATIONSHIP_BONUS
+            scored.append((score, index))
+
+        chosen = sorted(index for _, index in sorted(scored, reverse=True)[:self.k])
+        return [self.examples[index] for index in chosen]
+
+    def _node_types_for(self, relationship_types: List[str]) -> List[str]:
+
+        node_types = {"Card"}
+        for rel in relationship_types:
+            schema = self.schema.RELATIONSHIPS[rel]
+            node_types.update((schema.from_label, schema.to_label))
+        return [name for name in self.schema.NODES if name in node_types]
+
+    def _other_relationships(self, selected: List[str]) -> str:
+
+        # The remaining types cost a few tokens as one line, and keep the model
+        # from inventing a relationship when the keyword match missed one.
+        others = [
+            f"(:{rel.from_label})-[:{rel.type}]->(:{rel.to_label})"
+            for name, rel in self.schema.RELATIONSHIPS.items() if name not in selected
+        ]
+        if not others:
+            return ""
+        return "\nOther relationships: " + ", ".join(others) + "\n"
+
+    @staticmethod
+    def _format_examples(examples: List[Dict[str, str]]) -> str:
+
+        return "\n\n".join(f"Question: {ex['question']}\nCypher: {ex['cypher']}" for ex in examples)
+
+    @staticmethod
+    def _cosine(a: Dict[int, float], b: Dict[int, float]) -> float:
+
+        dot = sum(value * b.get(bucket, 0.0) for bucket, value in a.items())
+        if not dot:
+            return 0.0
+        return dot / (math.sqrt(sum(v * v for v in a.values())) * math.sqrt(sum(v * v for v in b.values())))
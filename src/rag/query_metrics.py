@@ -0,0 +1,169 @@
+
+
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict, deque
+from typing import Dict, Any, Optional, List
+
+
+class LatencyHistogram:
+
+
+    BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, value_ms: float):
+        self.counts[bisect_left(self.BUCKETS_MS, value_ms)] += 1
+        self.count += 1
+        self.total_ms += value_ms
+        self.max_ms = max(self.max_ms, value_ms)
+
+    def quantile(self, q: float) -> Optional[float]:
+
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= target:
+                if index < len(self.BUCKETS_MS):
+                    return float(min(self.BUCKETS_MS[index], self.max_ms))
+                return self.max_ms
+        return self.max_ms
+
+    def to_dict(self) -> Dict[str, Any]:
+
+        labels = [f"le_{b}ms" for b in self.BUCKETS_MS] + ["le_inf"]
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total_ms / self.count, 3) if self.count else None,
+            "p50_ms": self.quantile(0.50),
+            "p95_ms": self.quantile(0.95),
+            "p99_ms": self.quantile(0.99),
+            "max_ms": round(self.max_ms, 3),
+            "buckets": dict(zip(labels, self.counts)),
+        }
+
+
+class QueryMetrics:
+
+
+    def __init__(self, slow_threshold_ms: float = None, slow_log_size: int = None, max_fingerprints: int = None):
+        self.slow_threshold_ms = slow_threshold_ms if slow_threshold_ms is not None else float(
+            os.getenv("SLOW_QUERY_MS", "250")
+        )
+        self.slow_log = deque(maxlen=slow_log_size or int(os.getenv("SLOW_QUERY_LOG_SIZE", "100")))
+        self._lock = threading.Lock()
+        # LLM-written Cypher rarely repeats exactly, so per-shape stats are
+        # kept for the most recently seen fingerprints only.
+        self.max_fingerprints = max_fingerprints or int(os.getenv("QUERY_METRICS_MAX_FINGERPRINTS", "500"))
+        self._by_fingerprint: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._evicted = 0
+        self._overall = LatencyHistogram()
+        self._errors = 0
+
+    def record(self, fingerprint: str, cypher: str, client_ms: float, rows: int,
+               error: Optional[str] = None, available_after_ms: Optional[float] = None,
+               consumed_after_ms: Optional[float] = None):
+
+        server_ms = None
+        if available_after_ms is not None and consumed_after_ms is not None:
+            server_ms = available_after_ms + consumed_after_ms
+
+        with self._lock:
+            entry = self._by_fingerprint.get(fingerprint)
+            if entry is None:
+                entry = {
+                    "sample": cypher,
+                    "calls": 0,
+                    "errors": 0,
+                    "rows": 0,
+                    "client": LatencyHistogram(),
+                    "server": LatencyHistogram(),
+                }
+                self._by_fingerprint[fingerprint] = entry
+                while len(self._by_fingerprint) > self.max_fingerprints:
+                    self._by_fingerprint.popitem(last=False)
+                    self._evicted += 1
+            else:
+                self._by_fingerprint.move_to_end(fingerprint)
+
+            entry["calls"] += 1
+            entry["rows"] += rows
+            entry["client"].observe(client_ms)
+            if server_ms is not None:
+                entry["server"].observe(server_ms)
+            if error:
+                entry["errors"] += 1
+                self._errors += 1
+            self._overall.observe(client_ms)
+
+            if client_ms >= self.slow_threshold_ms:
+                self.slow_log.append({
+                    "timestamp": time.time(),
+                    "fingerprint": fingerprint,
+                    "cypher": cypher,
+                    "client_ms": round(client_ms, 3),
+                    "result_available_after_ms": available_after_ms,
+                    "result_consumed_after_ms": consumed_after_ms,
+                    # Whatever the server did not account for was spent on the
+                    # wire or in the driver.
+                    "network_ms": round(client_ms - server_ms, 3) if server_ms is not None else None,
+                    "rows": rows,
+                    "error": error,
+                })
+
+    def to_dict(self, top: int = 20) -> Dict[str, Any]:
+
+        with self._lock:
+            ranked: List = sorted(
+                self._by_fingerprint.items(),
+                key=lambda item: item[1]["client"].total_ms,
+                reverse=True,
+            )[:top]
+            total = self._overall.count
+            return {
+                "queries": total,
+                "errors": self._errors,
+                "error_rate": round(self._errors / total, 4) if total else 0.0,
+                "latency": self._overall.to_dict(),
+                "slow_threshold_ms": self.slow_threshold_ms,
+                "slow_queries": list(self.slow_log),
+                "tracked_fingerprints": len(self._by_fingerprint),
+                "max_fingerprints": self.max_fingerprints,
+                "evicted_fingerprints": self._evicted,
+                "fingerprints": {
+                    fingerprint: {
+                        "sample": entry["sample"],
+                        "calls": entry["calls"],
+                        "errors": entry["errors"],
+                        "error_rate": round(entry["errors"] / entry["calls"], 4),
+                        "avg_rows": round(entry["rows"] / entry["calls"], 2),
+                        "client_latency": entry["client"].to_dict(),
+                        "server_latency": entry["server"].to_dict(),
+                    }
+                    for fingerprint, entry in ranked
+                },
+            }
+
+    def reset(self):
+
+        with self._lock:
+            self._by_fingerprint.clear()
+            self._evicted = 0
+            self._overall = LatencyHistogram()
+            self._errors = 0
+            self.slow_log.clear()
+
+
+def create_query_metrics() -> QueryMetrics:
+
+    return QueryMetrics()
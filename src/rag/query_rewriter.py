@@ -0,0 +1,293 @@
+
+
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from src.kg.cypher_lexer import Token, tokenize, significant, IDENT, OP
+from src.kg.schema import KGSchema
+
+
+@dataclass
+class RewriteResult:
+
+    cypher: str
+    rewritten: bool = False
+    projected: Dict[str, List[str]] = field(default_factory=dict)
+    dropped: Dict[str, List[str]] = field(default_factory=dict)
+    estimated_bytes_saved_per_row: int = 0
+
+
+class ProjectionRewriter:
+
+
+    # Properties only worth shipping when the question asks for them.
+    HEAVY_PROPERTIES = {
+        "Card": {
+            "description": ("describe", "description", "what does", "what is", "tell me", "explain", "about"),
+            "level11_stats": ("ability", "abilities", "champion", "stats", "statistic", "level 11", "level11"),
+        },
+    }
+
+    # Rough per-value sizes used to estimate what a whole-entity return costs.
+    PROPERTY_BYTES = {
+        ("Card", "description"): 220,
+        ("Card", "level11_stats"): 420,
+    }
+    TYPE_BYTES = {"string": 16, "integer": 8}
+    ENTITY_OVERHEAD_BYTES = 64
+
+    _TAIL_KEYWORDS = {"ORDER", "SKIP", "LIMIT", "UNION"}
+
+    def __init__(self, schema: KGSchema = None):
+        self.schema = schema or KGSchema()
+        self._lock = threading.Lock()
+        self.stats = {"queries": 0, "rewrites": 0, "estimated_bytes_saved": 0}
+
+    def rewrite(self, cypher: str, question: str = "") -> RewriteResult:
+
+        with self._lock:
+            self.stats["queries"] += 1
+
+        tokens = significant(tokenize(cypher))
+        bindings = self._bind_variables(tokens)
+        if not bindings:
+            return RewriteResult(cypher=cypher)
+
+        span = self._find_return_items(tokens)
+        if span is None:
+            return RewriteResult(cypher=cypher)
+        start, end, distinct = span
+
+        items = self._split_items(tokens, start, end)
+        candidates = []
+        for item in items:
+            entity = self._whole_entity(item, bindings)
+            if entity:
+                candidates.append(entity)
+        if not candidates:
+            return RewriteResult(cypher=cypher)
+
+        tail = " ".join(t.upper for t in tokens[end:])
+        if distinct and "ORDER" in tail:
+            # ORDER BY after DISTINCT may only see projected columns.
+            return RewriteResult(cypher=cypher)
+        if "UNION" in tail:
+            # Every branch of a UNION must return the same columns.
+            return RewriteResult(cypher=cypher)
+
+        question_lower = (question or "").lower()
+        referenced = {t.text for t in tokens[end:] if t.kind == IDENT}
+        existing = {self._item_alias(item) for item in items if not self._whole_entity(item, bindings)}
+        selections = {
+            variable: self._select_properties(kind, name, question_lower)
+            for variable, _, kind, name in candidates
+        }
+
+        # Drop candidates whose rewrite would break the query, until the rest
+        # can all be rewritten together (prefixing depends on how many remain).
+        while candidates:
+            prefixed = len(candidates) > 1
+            columns = {
+                variable: self._projection_columns(variable, prefix, kind, name, selections[variable][0], prefixed)
+                for variable, prefix, kind, name in candidates
+            }
+            unsafe = set()
+            seen = set(existing)
+            for variable, prefix, _, _ in candidates:
+                aliases = [alias for _, alias in columns[variable]]
+                # ORDER BY card.elixir would dereference the new string column.
+                if prefix in referenced and (prefix != variable or prefix in aliases):
+                    unsafe.add(variable)
+                # Duplicate column names are rejected by Neo4j.
+                if seen.intersection(aliases):
+                    unsafe.add(variable)
+                seen.update(aliases)
+            if not unsafe:
+                break
+            candidates = [c for c in candidates if c[0] not in unsafe]
+        if not candidates:
+            return RewriteResult(cypher=cypher)
+
+        replacements = {}
+        projected, dropped = {}, {}
+        saved = 0
+
+        for variable, prefix, kind, name in candidates:
+            keep, drop = selections[variable]
+            replacements[variable] = ", ".join(f"{expression} AS {alias}" for expression, alias in columns[variable])
+            projected[prefix] = keep
+            dropped[prefix] = drop
+            saved += self.ENTITY_OVERHEAD_BYTES + sum(self._property_bytes(kind, name, p) for p in drop)
+
+        rewritten_items = []
+        for item in items:
+            entity = self._whole_entity(item, bindings)
+            if entity and entity[0] in replacements:
+                rewritten_items.append(replacements[entity[0]])
+            else:
+                rewritten_items.append(cypher[item[0].position:item[-1].position + len(item[-1].text)])
+
+        head = cypher[:tokens[start].position]
+        rest = cypher[tokens[end].position:] if end < len(tokens) else ""
+        new_cypher = head + ", ".join(rewritten_items) + (" " + rest if rest else "")
+
+        with self._lock:
+            self.stats["rewrites"] += 1
+
+        return RewriteResult(
+            cypher=new_cypher,
+            rewritten=True,
+            projected=projected,
+            dropped=dropped,
+            estimated_bytes_saved_per_row=saved,
+        )
+
+    def record_rows(self, result: RewriteResult, row_count: int) -> int:
+
+        if not result.rewritten:
+            return 0
+        saved = result.estimated_bytes_saved_per_row * row_count
+        with self._lock:
+            self.stats["estimated_bytes_saved"] += saved
+        return saved
+
+    def get_stats(self) -> Dict[str, int]:
+
+        with self._lock:
+            return dict(self.stats)
+
+    @staticmethod
+    def _bind_variables(tokens: List[Token]) -> Dict[str, Tuple[str, str]]:
+
+        bindings = {}
+        for i in range(len(tokens) - 3):
+            opener, var, colon, label = tokens[i:i + 4]
+            if (opener.kind == OP and opener.text in ("(", "[") and var.kind == IDENT
+                    and colon.kind == OP and colon.text == ":" and label.kind == IDENT):
+                following = tokens[i + 4] if i + 4 < len(tokens) else None
+                if following is not None and following.kind == OP and following.text in ("|", ":"):
+                    continue
+                kind = "node" if opener.text == "(" else "relationship"
+                bindings.setdefault(var.text, (kind, label.text))
+        return bindings
+
+    def _find_return_items(self, tokens: List[Token]) -> Optional[Tuple[int, int, bool]]:
+
+        depth = 0
+        last_return = None
+        for i, token in enumerate(tokens):
+            if token.kind == OP and token.text in ("(", "[", "{"):
+                depth += 1
+            elif token.kind == OP and token.text in (")", "]", "}"):
+                depth -= 1
+            elif depth == 0 and token.kind == IDENT and token.upper == "RETURN":
+                last_return = i
+        if last_return is None:
+            return None
+
+        start = last_return + 1
+        distinct = start < len(tokens) and tokens[start].upper == "DISTINCT"
+        if distinct:
+            start += 1
+
+        depth = 0
+        end = start
+        while end < len(tokens):
+            token = tokens[end]
+            if token.kind == OP and token.text in ("(", "[", "{"):
+                depth += 1
+            elif token.kind == OP and token.text in (")", "]", "}"):
+                depth -= 1
+            elif depth == 0 and token.kind == IDENT and token.upper in self._TAIL_KEYWORDS:
+                break
+            end += 1
+        if end == start:
+            return None
+        return start, end, distinct
+
+    @staticmethod
+    def _split_items(tokens: List[Token], start: int, end: int) -> List[List[Token]]:
+
+        items, current, depth = [], [], 0
+        for token in tokens[start:end]:
+            if token.kind == OP and token.text in ("(", "[", "{"):
+                depth += 1
+            elif token.kind == OP and token.text in (")", "]", "}"):
+                depth -= 1
+            if depth == 0 and token.kind == OP and token.text == ",":
+                items.append(current)
+                current = []
+                continue
+            current.append(token)
+        if current:
+            items.append(current)
+        return items
+
+    def _whole_entity(self, item: List[Token], bindings) -> Optional[Tuple[str, str, str, str]]:
+
+        if not item or item[0].kind != IDENT or item[0].text not in bindings:
+            return None
+        if len(item) == 1:
+            alias = item[0].text
+        elif len(item) == 3 and item[1].upper == "AS" and item[2].kind == IDENT:
+            alias = item[2].text
+        else:
+            return None
+
+        kind, name = bindings[item[0].text]
+        known = self.schema.NODES if kind == "node" else self.schema.RELATIONSHIPS
+        if name not in known:
+            return None
+        return item[0].text, alias, kind, name
+
+    def _select_properties(self, kind: str, name: str, question: str) -> Tuple[List[str], List[str]]:
+
+        if kind == "node":
+            properties = list(self.schema.NODES[name].properties)
+        else:
+            properties = list(self.schema.RELATIONSHIPS[name].properties)
+
+        heavy = self.HEAVY_PROPERTIES.get(name, {}) if kind == "node" else {}
+        keep, drop = [], []
+        for prop in properties:
+            keywords = heavy.get(prop)
+            if keywords is None or any(k in question for k in keywords):
+                keep.append(prop)
+            else:
+                drop.append(prop)
+        return keep, drop
+
+    @staticmethod
+    def _item_alias(item: List[Token]) -> str:
+
+        if len(item) >= 3 and item[-2].upper == "AS":
+            return item[-1].text
+        return "".join(t.text for t in item)
+
+    @staticmethod
+    def _projection_columns(variable: str, prefix: str, kind: str, name: str,
+                            keep: List[str], prefixed: bool) -> List[Tuple[str, str]]:
+
+        columns = []
+        if kind == "relationship":
+            columns.append((f"type({variable})", "relationship"))
+        for prop in keep:
+            column = prop
+            if prop == "name":
+                column = "card" if name == "Card" else name.lower()
+            columns.append((f"{variable}.{prop}", column))
+
+        return [(expression, f"{prefix}_{column}" if prefixed else column) for expression, column in columns]
+
+    def _property_bytes(self, kind: str, name: str, prop: str) -> int:
+
+        if (name, prop) in self.PROPERTY_BYTES:
+            return self.PROPERTY_BYTES[(name, prop)]
+        schema = self.schema.NODES[name] if kind == "node" else self.schema.RELATIONSHIPS[name]
+        return self.TYPE_BYTES.get(schema.properties.get(prop, "string"), 16)
+
+
+def create_rewriter() -> ProjectionRewriter:
+
+    return ProjectionRewriter()
@@ -0,0 +1,269 @@
+
+
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Optional, Tuple
+
+from src.rag.query_metrics import LatencyHistogram
+
+
+def _refill(level: float, updated: float, capacity: float, rate: float, now: float) -> float:
+
+    return min(capacity, level + max(0.0, now - updated) * rate)
+
+
+class _BucketStore:
+
+    # Each demand is (capacity, refill per second, amount); buckets start full.
+
+    def take(self, demands: Dict[str, Tuple[float, float, float]]) -> float:
+
+        with self._transaction() as now:
+            states = self._load(demands, now)
+            levels = {
+                name: _refill(*states[name], capacity, rate, now)
+                for name, (capacity, rate, _) in demands.items()
+            }
+            if all(levels[name] >= amount for name, (_, _, amount) in demands.items()):
+                self._save({name: (levels[name] - demands[name][2], now) for name in demands})
+                return 0.0
+            self._save({name: (levels[name], now) for name in demands})
+        # Time until the emptiest bucket has refilled enough.
+        return max(
+            (amount - levels[name]) / rate
+            for name, (_, rate, amount) in demands.items()
+            if levels[name] < amount
+        )
+
+    def adjust(self, name: str, capacity: float, rate: float, delta: float = 0.0, pause: float = 0.0):
+
+        with self._transaction() as now:
+            level = _refill(*self._load({name: (capacity, rate, 0)}, now)[name], capacity, rate, now)
+            if pause:
+                # Push the bucket into debt so it takes `pause` seconds before
+                # it can hand out a single request again.
+                level = min(level, 1.0) - pause * rate
+            self._save({name: (min(capacity, level + delta), now)})
+
+    def _transaction(self):
+        raise NotImplementedError
+
+    def _load(self, demands, now: float) -> Dict[str, Tuple[float, float]]:
+        raise NotImplementedError
+
+    def _save(self, states: Dict[str, Tuple[float, float]]):
+        raise NotImplementedError
+
+
+class _MemoryBucketStore(_BucketStore):
+
+    def __init__(self):
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            yield time.monotonic()
+
+    def _load(self, demands, now: float) -> Dict[str, Tuple[float, float]]:
+        return {name: self._buckets.get(name, (capacity, now)) for name, (capacity, _, _) in demands.items()}
+
+    def _save(self, states: Dict[str, Tuple[float, float]]):
+        self._buckets.update(states)
+
+
+class _SQLiteBucketStore(_BucketStore):
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS buckets (
+            name TEXT PRIMARY KEY,
+            level REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    """
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._local = threading.local()
+        self._connection().execute(self._SCHEMA)
+
+    @contextmanager
+    def _transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front, so read-modify-write
+        # of the buckets is serialized across every process sharing the file.
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield time.time()
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _load(self, demands, now: float) -> Dict[str, Tuple[float, float]]:
+        names = list(demands)
+        rows = self._connection().execute(
+            f"SELECT name, level, updated_at FROM buckets WHERE name IN ({', '.join('?' * len(names))})",
+            names,
+        ).fetchall()
+        found = {name: (level, updated) for name, level, updated in rows}
+        return {name: found.get(name, (capacity, now)) for name, (capacity, _, _) in demands.items()}
+
+    def _save(self, states: Dict[str, Tuple[float, float]]):
+        self._connection().executemany(
+            """
+            INSERT INTO buckets (name, level, updated_at) VALUES (?, ?, ?)
+            ON CONFLICT (name) DO UPDATE SET level = excluded.level, updated_at = excluded.updated_at
+            """,
+            [(name, level, updated) for name, (level, updated) in states.items()],
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Autocommit mode; transactions are opened explicitly above.
+            conn = sqlite3.connect(self.path, timeout=10.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+
+class RateLimiter:
+
+
+    def __init__(self, name: str, requests_per_minute: float = None, tokens_per_minute: float = None,
+                 shared: bool = None, path: str = None):
+        self.name = name
+        self.requests_per_minute = requests_per_minute if requests_per_minute is not None else float(
+            os.getenv("LLM_RATE_RPM", "0")
+        )
+        self.tokens_per_minute = tokens_per_minute if tokens_per_minute is not None else float(
+            os.getenv("LLM_RATE_TPM", "0")
+        )
+        self.shared = shared if shared is not None else (
+            os.getenv("LLM_RATE_LIMIT_SHARED", "false").lower() == "true"
+        )
+        if self.shared:
+            path = path or os.path.join(os.getenv("CACHE_DIR", ".cache"), "rate_limits.sqlite3")
+            self._store = _SQLiteBucketStore(path)
+        else:
+            self._store = _MemoryBucketStore()
+        # Waiters in this process queue in turn instead of all polling.
+        self._turn = threading.Lock()
+        self._lock = threading.Lock()
+        self.wait = LatencyHistogram()
+        self.stats = {"acquired": 0, "queued": 0, "throttled": 0, "refunded_tokens": 0, "queue_depth": 0}
+
+    @property
+    def enabled(self) -> bool:
+
+        return self.requests_per_minute > 0 or self.tokens_per_minute > 0
+
+    def acquire(self, tokens: int = 0) -> int:
+
+        # Blocks until both budgets allow the call, and returns the tokens
+        # reserved so settle() can correct them once usage is known.
+        if not self.enabled:
+            return 0
+        demands = self._demands(tokens)
+        reserved = int(demands[f"{self.name}:tokens"][2]) if f"{self.name}:tokens" in demands else 0
+
+        start = time.perf_counter()
+        with self._lock:
+            self.stats["queue_depth"] += 1
+        try:
+            with self._turn:
+                while True:
+                    delay = self._store.take(demands)
+                    if delay <= 0:
+                        break
+                    time.sleep(delay)
+        finally:
+            with self._lock:
+                self.stats["queue_depth"] -= 1
+        waited_ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self.stats["acquired"] += 1
+            if waited_ms >= 1:
+                self.stats["queued"] += 1
+            self.wait.observe(waited_ms)
+        return reserved
+
+    def settle(self, reserved: int, used: Optional[int]):
+
+        # Give back what the estimate over-reserved, or charge what it missed.
+        if not self.tokens_per_minute or not reserved or used is None:
+            return
+        delta = reserved - used
+        if delta:
+            self._store.adjust(f"{self.name}:tokens", *self._bucket(self.tokens_per_minute), delta=delta)
+        if delta > 0:
+            with self._lock:
+                self.stats["refunded_tokens"] += delta
+
+    def throttle(self, seconds: float):
+
+        # The provider said 429: hold every caller sharing the bucket, not
+        # only the one that got the error.
+        if not self.requests_per_minute or seconds <= 0:
+            return
+        self._store.adjust(f"{self.name}:requests", *self._bucket(self.requests_per_minute), pause=seconds)
+        with self._lock:
+            self.stats["throttled"] += 1
+
+    def _demands(self, tokens: int) -> Dict[str, Tuple[float, float, float]]:
+
+        demands = {}
+        if self.requests_per_minute > 0:
+            demands[f"{self.name}:requests"] = (*self._bucket(self.requests_per_minute), min(1, self.requests_per_minute))
+        if self.tokens_per_minute > 0:
+            # A call larger than a whole minute's budget could never fit.
+            demands[f"{self.name}:tokens"] = (
+                *self._bucket(self.tokens_per_minute), min(max(tokens, 1), self.tokens_per_minute),
+            )
+        return demands
+
+    @staticmethod
+    def _bucket(per_minute: float) -> Tuple[float, float]:
+
+        return per_minute, per_minute / 60.0
+
+    def get_stats(self) -> Dict[str, Any]:
+
+        with self._lock:
+            return dict(
+                self.stats,
+                requests_per_minute=self.requests_per_minute,
+                tokens_per_minute=self.tokens_per_minute,
+                shared=self.shared,
+                wait=self.wait.to_dict(),
+            )
+
+
+_limiters: Dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def rate_limiter_for(provider: str) -> RateLimiter:
+
+    # Quotas belong to the provider account, so every client of a provider
+    # draws from the same buckets.
+    with _limiters_lock:
+        limiter = _limiters.get(provider)
+        if limiter is None:
+            limiter = _limiters[provider] = RateLimiter(provider or "default")
+        return limiter
+
+
+def get_rate_limit_stats() -> Dict[str, Any]:
+
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    return {provider: limiter.get_stats() for provider, limiter in limiters.items() if limiter.enabled}
@@ -1,12 +1,16 @@
 
 
 import time
+import threading
 from typing import List, Dict, Any, Optional
-from neo4j import GraphDatabase
 import os
 from dotenv import load_dotenv
 
 from src.domain.models import QueryResult
+from src.kg.schema import KGSchema
+from src.kg.backend import GraphBackend, create_backend
+from src.rag.cypher_normalizer import CypherNormalizer
+from src.rag.query_metrics import QueryMetrics
 
 load_dotenv()
 
@@ -14,47 +18,85 @@ load_dotenv()
 class KGRetriever:
     
 
-    def __init__(self, uri: str = None, user: str = None, password: str = None):
+    # Every pattern is a single label or a single relationship type, so Neo4j
+    # answers each branch from its count store instead of scanning.
+    STATS_PATTERNS = {
+        "cards": "(x:Card)",
+        "rarities": "(x:Rarity)",
+        "arenas": "(x:Arena)",
+        "counter_relationships": "()-[x:COUNTERS]->()",
+        "synergy_relationships": "()-[x:SYNERGIZES_WITH]->()",
+        "archetype_fits": "()-[x:FITS_ARCHETYPE]->()",
+    }
+
+    def __init__(self, uri: str = None, user: str = None, password: str = None,
+                 backend: GraphBackend = None):
         self.uri = uri or os.getenv("NEO4J_URI", "bolt://localhost:7687")
         self.user = user or os.getenv("NEO4J_USER", "neo4j")
         self.password = password or os.getenv("NEO4J_PASSWORD", "12345678")
-        self.driver = GraphDatabase.driver(self.uri, auth=(self.user, self.password))
+        self.backend = backend or create_backend(self.uri, self.user, self.password)
+        self.epoch_ttl = float(os.getenv("GRAPH_EPOCH_TTL", "10"))
+        self._epoch = None
+        self._epoch_checked_at = None
+        self._stats_cache = None
+        self._stats_epoch = None
+        self._cache_lock = threading.Lock()
+        self.normalizer = CypherNormalizer()
+        self.metrics = QueryMetrics()
 
     def close(self):
         
-        self.driver.close()
+        self.backend.close()
 
-    def retrieve(self, cypher_query: str) -> QueryResult:
+    def retrieve(self, cypher_query: str, parameters: Optional[Dict[str, Any]] = None,
+                 display_query: Optional[str] = None, fingerprint: Optional[str] = None) -> QueryResult:
         
+        # display_query is the Cypher as written, for logs and the response,
+        # when cypher_query is its parameterized form. Callers that already
+        # normalized the query pass its fingerprint along.
         start_time = time.time()
+        parameters = parameters or {}
+        fingerprint = fingerprint or self.normalizer.fingerprint(cypher_query)
+        shown = display_query or cypher_query
 
         try:
-            with self.driver.session() as session:
-                result = session.run(cypher_query)
-                data = [record.data() for record in result]
-                execution_time = time.time() - start_time
-
-                return QueryResult(
-                    data=data,
-                    cypher_query=cypher_query,
-                    execution_time=execution_time,
-                    error=None
-                )
+            result = self.backend.run(cypher_query, parameters)
+            data = result.records
+            execution_time = time.time() - start_time
+
+            self.metrics.record(
+                fingerprint, shown, execution_time * 1000, len(data),
+                available_after_ms=result.result_available_after,
+                consumed_after_ms=result.result_consumed_after,
+            )
+
+            return QueryResult(
+                data=data,
+                cypher_query=shown,
+                execution_time=execution_time,
+                error=None,
+                parameters=parameters,
+                fingerprint=fingerprint
+            )
 
         except Exception as e:
             execution_time = time.time() - start_time
             error_msg = f"Query execution error: {str(e)}"
+            self.metrics.record(fingerprint, shown, execution_time * 1000, 0, error=error_msg)
 
             return QueryResult(
                 data=[],
-                cypher_query=cypher_query,
+                cypher_query=shown,
                 execution_time=execution_time,
-                error=error_msg
+                error=error_msg,
+                parameters=parameters,
+                fingerprint=fingerprint
             )
 
-    def retrieve_with_context(self, cypher_query: str, card_name: Optional[str] = None) -> QueryResult:
+    def retrieve_with_context(self, cypher_query: str, card_name: Optional[str] = None,
+                              parameters: Optional[Dict[str, Any]] = None) -> QueryResult:
         
-        main_result = self.retrieve(cypher_query)
+        main_result = self.retrieve(cypher_query, parameters)
 
         if main_result.error or not card_name:
             return main_result
@@ -97,55 +139,68 @@ class KGRetriever:
         } AS context
         """
 
-        with self.driver.session() as session:
-            result = session.run(context_query, card_name=card_name)
-            record = result.single()
-            if record:
-                return record["context"]
+        records = self.backend.run(context_query, {"card_name": card_name}).records
+        if records:
+            return records[0]["context"]
         return {}
 
     def test_connection(self) -> bool:
         
         try:
-            with self.driver.session() as session:
-                result = session.run("RETURN 1 AS test")
-                return result.single()["test"] == 1
+            records = self.backend.run("RETURN 1 AS test").records
+            return bool(records) and records[0]["test"] == 1
         except Exception as e:
             print(f"Connection test failed: {e}")
             return False
 
+    def get_epoch(self, force: bool = False) -> Optional[int]:
+        
+        now = time.monotonic()
+        with self._cache_lock:
+            if (not force and self._epoch_checked_at is not None
+                    and now - self._epoch_checked_at < self.epoch_ttl):
+                return self._epoch
+
+        records = self.backend.run(
+            f"MATCH (m:{KGSchema.EPOCH_LABEL}) RETURN max(m.epoch) AS epoch"
+        ).records
+        epoch = records[0]["epoch"] if records else None
+
+        with self._cache_lock:
+            self._epoch = epoch
+            self._epoch_checked_at = now
+        return epoch
+
     def get_stats(self) -> Dict[str, int]:
         
-        stats_query = """
-        MATCH (c:Card) WITH COUNT(c) AS cards
-        MATCH (r:Rarity) WITH cards, COUNT(r) AS rarities
-        MATCH (a:Arena) WITH cards, rarities, COUNT(a) AS arenas
-        MATCH ()-[rel:COUNTERS]->() WITH cards, rarities, arenas, COUNT(rel) AS counters
-        MATCH ()-[syn:SYNERGIZES_WITH]->() WITH cards, rarities, arenas, counters, COUNT(syn) AS synergies
-        MATCH ()-[fit:FITS_ARCHETYPE]->() WITH cards, rarities, arenas, counters, synergies, COUNT(fit) AS archetype_fits
+        try:
+            epoch = self.get_epoch()
+        except Exception:
+            return {}
 
-        RETURN {
-            cards: cards,
-            rarities: rarities,
-            arenas: arenas,
-            counter_relationships: counters,
-            synergy_relationships: synergies,
-            archetype_fits: archetype_fits
-        } AS stats
-        """
+        with self._cache_lock:
+            if self._stats_cache is not None and self._stats_epoch == epoch:
+                return dict(self._stats_cache)
+
+        branches = [
+            f"MATCH {pattern} RETURN '{key}' AS key, count(x) AS value"
+            for key, pattern in self.STATS_PATTERNS.items()
+        ]
+        stats_query = "CALL {\n" + "\nUNION ALL\n".join(branches) + "\n}\nRETURN key, value"
 
         try:
-            with self.driver.session() as session:
-                result = session.run(stats_query)
-                record = result.single()
-                if record:
-                    return record["stats"]
-        except:
-            pass
+            stats = {key: 0 for key in self.STATS_PATTERNS}
+            for record in self.backend.run(stats_query).records:
+                stats[record["key"]] = record["value"]
+        except Exception:
+            return {}
 
-        return {}
+        with self._cache_lock:
+            self._stats_cache = stats
+            self._stats_epoch = epoch
+        return dict(stats)
 
 
-def create_retriever() -> KGRetriever:
+def create_retriever(backend: GraphBackend = None) -> KGRetriever:
     
-    return KGRetriever()
+    return KGRetriever(backend=backend)
@@ -0,0 +1,325 @@
+
+
+import math
+import os
+import re
+import threading
+import zlib
+from collections import OrderedDict, Counter
+from dataclasses import dataclass, field
+from typing import Callable, Dict, FrozenSet, List, Optional, Tuple, Union
+
+from src.kg.cypher_lexer import tokenize, unquote, quote, STRING
+
+
+SLOT = "@card"
+
+# Words that change what a query filters or how it sorts. Two questions that
+# differ in any of them need different Cypher even when they read alike.
+QUALIFIER_WORDS = frozenset({
+    "common", "rare", "epic", "legendary", "champion", "champions",
+    "troop", "troops", "spell", "spells", "building", "buildings",
+    "air", "ground", "melee", "ranged",
+    "more", "less", "fewer", "greater", "higher", "lower", "above", "below", "over", "under",
+    "least", "most", "max", "min", "maximum", "minimum", "exactly", "equal", "not", "no", "without",
+    "cheapest", "expensive", "highest", "lowest", "top", "bottom", "best", "worst", "fastest", "slowest",
+    "one", "two", "three", "four", "five", "six", "seven", "eight", "nine", "ten",
+})
+
+# Ways of asking for the same relationship, folded to one word before
+# embedding: lexical features alone can't tell "beats" means "counters".
+# Passive forms keep their own word, since the card is on the other side.
+RELATION_PHRASES = (
+    (r"\b(?:countered|beaten|stopped|shut down) by\b|\bweak (?:against|to)\b", "countered"),
+    (r"\b(?:counter(?:s|ing)?|beats?|beating|stops?|stopping|shuts? down|deals? with|dealing with|handles?"
+     r"|(?:good|strong|effective) against)\b", "counter"),
+    (r"\b(?:synergi[sz]es?|synergy|synergies|pairs? (?:well )?with|goes (?:well )?with|go (?:well )?with"
+     r"|works? (?:well )?with|combos? with|combo)\b", "synergy"),
+)
+RELATION_WORDS = frozenset(word for _, word in RELATION_PHRASES)
+
+# Filler that changes how a question is phrased, not what it asks.
+STOP_WORDS = frozenset({
+    "a", "an", "the", "what", "which", "who", "how", "do", "does", "did", "i", "me", "my", "we", "you",
+    "can", "could", "should", "would", "will", "is", "are", "be", "to", "for", "of", "in", "on", "and",
+    "card", "cards", "please", "tell", "show", "list", "give", "well", "with", "good", "some", "there",
+})
+
+Literals = Tuple[Tuple[str, ...], FrozenSet[str]]
+
+Template = List[Union[str, int]]
+
+
+@dataclass
+class SemanticEntry:
+
+    masked: str
+    slots: int
+    template: Template
+    vector: Dict[int, float] = field(default_factory=dict)
+    hits: int = 0
+    literals: Literals = ((), frozenset())
+    # Card slots and relation words in question order: "@card0 counter"
+    # (what does X counter) must not reuse "counter @card0" (what counters X).
+    shape: Tuple[str, ...] = ()
+    # Non-card string literals baked into the template ('legendary', 'air').
+    constants: FrozenSet[str] = frozenset()
+
+
+class QuestionEmbedder:
+
+
+    def __init__(self, dimensions: int = 4096, ngram_range: Tuple[int, int] = (3, 5)):
+        self.dimensions = dimensions
+        self.ngram_range = ngram_range
+
+    def features(self, text: str) -> Dict[int, float]:
+
+        words = re.findall(r"[a-z0-9@]+", text.lower())
+        counts = Counter()
+
+        padded = f" {' '.join(words)} "
+        low, high = self.ngram_range
+        for n in range(low, high + 1):
+            for i in range(len(padded) - n + 1):
+                counts[self._bucket("c:" + padded[i:i + n])] += 1
+
+        # Word unigrams and bigrams keep some word order, which character
+        # n-grams alone lose ("what does X counter" vs "what counters X").
+        for i, word in enumerate(words):
+            counts[self._bucket("w:" + word)] += 1
+            if i + 1 < len(words):
+                counts[self._bucket(f"b:{word} {words[i + 1]}")] += 1
+
+        return {bucket: 1.0 + math.log(count) for bucket, count in counts.items()}
+
+    def _bucket(self, feature: str) -> int:
+
+        return zlib.crc32(feature.encode("utf-8")) % self.dimensions
+
+
+class SemanticTranslationCache:
+
+
+    def __init__(self, card_names: Callable[[], List[str]], threshold: float = None,
+                 max_entries: int = None, embedder: QuestionEmbedder = None,
+                 seed: Callable[[], List[Tuple[str, str]]] = None):
+        self.card_names = card_names
+        self.threshold = threshold if threshold is not None else float(
+            os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.85")
+        )
+        self.max_entries = max_entries or int(os.getenv("SEMANTIC_CACHE_SIZE", "1000"))
+        self.embedder = embedder or QuestionEmbedder()
+        self._seed = seed
+        self._entries: "OrderedDict[str, SemanticEntry]" = OrderedDict()
+        self._document_frequency: Counter = Counter()
+        self._card_pattern = None
+        self._card_lookup: Dict[str, str] = {}
+        self._lock = threading.RLock()
+        self.stats = {"hits": 0, "misses": 0, "stored": 0, "evicted": 0, "invalidated": 0}
+
+    def mask(self, question: str) -> Tuple[str, List[str]]:
+
+        pattern = self._pattern()
+        if pattern is None:
+            return question.lower(), []
+
+        cards: List[str] = []
+
+        def replace(match):
+            name = self._card_lookup.get(match.group(1).lower(), match.group(1))
+            if name not in cards:
+                cards.append(name)
+            return f" {SLOT}{cards.index(name)} "
+
+        masked = pattern.sub(replace, question)
+        return re.sub(r"\s+", " ", masked).strip().lower().rstrip("?!. "), cards
+
+    def get(self, question: str) -> Optional[str]:
+
+        self._ensure_seeded()
+        masked, cards = self.mask(question)
+        canonical = self.canonical(masked)
+        query = self.embedder.features(canonical)
+
+        with self._lock:
+            best, best_score = None, 0.0
+            exact = self._entries.get(masked)
+            if exact is not None and exact.slots == len(cards):
+                best, best_score = exact, 1.0
+            else:
+                weighted = self._weight(query)
+                literals = self.literals(masked)
+                shape = self.shape(canonical)
+                words = set(re.findall(r"[a-z0-9]+", masked))
+                for entry in self._entries.values():
+                    if entry.slots != len(cards) or entry.shape != shape:
+                        continue
+                    # Only card names are slots; every other literal must match
+                    # or the cached query filters on the wrong value.
+                    if entry.literals != literals or not entry.constants <= words:
+                        continue
+                    score = self._cosine(weighted, self._weight(entry.vector))
+                    if score > best_score:
+                        best, best_score = entry, score
+
+            if best is None or best_score < self.threshold:
+                self.stats["misses"] += 1
+                return None
+
+            best.hits += 1
+            self._entries.move_to_end(best.masked)
+            self.stats["hits"] += 1
+            return self._instantiate(best.template, cards)
+
+    def put(self, question: str, cypher: str, ok: bool):
+
+        self._ensure_seeded()
+        masked, cards = self.mask(question)
+        template, constants = self._templatize(cypher, cards)
+
+        with self._lock:
+            if not ok:
+                # Drop every entry that would reproduce the failing query shape.
+                stale = [key for key, entry in self._entries.items() if entry.template == template]
+                for key in stale:
+                    self._remove(key)
+                self.stats["invalidated"] += len(stale)
+                return
+
+            if template is None:
+                return
+
+            if masked in self._entries:
+                self._remove(masked)
+            canonical = self.canonical(masked)
+            entry = SemanticEntry(
+                masked, len(cards), template, self.embedder.features(canonical),
+                literals=self.literals(masked), constants=constants, shape=self.shape(canonical),
+            )
+            self._entries[masked] = entry
+            self._document_frequency.update(entry.vector.keys())
+            self.stats["stored"] += 1
+
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.stats["evicted"] += 1
+
+    def get_stats(self) -> Dict[str, float]:
+
+        with self._lock:
+            stats = dict(self.stats)
+            stats["entries"] = len(self._entries)
+            stats["threshold"] = self.threshold
+            return stats
+
+    @staticmethod
+    def canonical(masked: str) -> str:
+
+        text = masked
+        for pattern, word in RELATION_PHRASES:
+            text = re.sub(pattern, f" {word} ", text)
+        words = [word for word in re.findall(r"[a-z0-9@.]+", text) if word not in STOP_WORDS]
+        return " ".join(words)
+
+    @staticmethod
+    def shape(canonical: str) -> Tuple[str, ...]:
+
+        return tuple(
+            "@card" if word.startswith(SLOT) else word
+            for word in canonical.split() if word.startswith(SLOT) or word in RELATION_WORDS
+        )
+
+    @staticmethod
+    def literals(masked: str) -> Literals:
+
+        words = re.findall(r"[a-z0-9.]+", masked)
+        numbers = tuple(word.rstrip(".") for word in words if re.fullmatch(r"\d+(?:\.\d+)?\.?", word))
+        return numbers, frozenset(word for word in words if word in QUALIFIER_WORDS)
+
+    def _templatize(self, cypher: str, cards: List[str]) -> Tuple[Optional[Template], FrozenSet[str]]:
+
+        # Literals naming a masked card become slots; a template that cannot
+        # re-insert every card from the question would answer a different one.
+        slots = {name.lower(): index for index, name in enumerate(cards)}
+        template: Template = []
+        constants = set()
+        used = set()
+        for token in tokenize(cypher):
+            if token.kind == STRING:
+                value = unquote(token.text).lower()
+                index = slots.get(value)
+                if index is not None:
+                    template.append(index)
+                    used.add(index)
+                    continue
+                constants.update(re.findall(r"[a-z0-9]+", value))
+            if template and isinstance(template[-1], str):
+                template[-1] += token.text
+            else:
+                template.append(token.text)
+
+        if len(used) != len(cards):
+            return None, frozenset()
+        return template, frozenset(constants)
+
+    @staticmethod
+    def _instantiate(template: Template, cards: List[str]) -> str:
+
+        return "".join(quote(cards[part]) if isinstance(part, int) else part for part in template)
+
+    def _weight(self, vector: Dict[int, float]) -> Dict[int, float]:
+
+        total = len(self._entries)
+        return {
+            bucket: value * (math.log((1 + total) / (1 + self._document_frequency[bucket])) + 1.0)
+            for bucket, value in vector.items()
+        }
+
+    @staticmethod
+    def _cosine(a: Dict[int, float], b: Dict[int, float]) -> float:
+
+        if len(a) > len(b):
+            a, b = b, a
+        dot = sum(value * b.get(bucket, 0.0) for bucket, value in a.items())
+        if not dot:
+            return 0.0
+        norm = math.sqrt(sum(v * v for v in a.values())) * math.sqrt(sum(v * v for v in b.values()))
+        return dot / norm
+
+    def _remove(self, key: str):
+
+        entry = self._entries.pop(key)
+        self._document_frequency.subtract(entry.vector.keys())
+
+    def _pattern(self):
+
+        if self._card_pattern is None:
+            names = [name for name in self.card_names() if name]
+            if not names:
+                return None
+            self._card_lookup = {name.lower(): name for name in names}
+            alternation = "|".join(re.escape(name) for name in sorted(names, key=len, reverse=True))
+            # A leading article is folded into the slot ("counters for the Giant").
+            self._card_pattern = re.compile(
+                rf"(?<![\w.])(?:the\s+)?({alternation})(?!\w)", re.IGNORECASE
+            )
+        return self._card_pattern
+
+    def _ensure_seeded(self):
+
+        if self._seed is None:
+            return
+        with self._lock:
+            seed, self._seed = self._seed, None
+            if seed is not None:
+                for question, cypher in seed():
+                    self.put(question, cypher, True)
+
+
+def create_semantic_cache(card_names: Callable[[], List[str]],
+                          seed: Callable[[], List[Tuple[str, str]]] = None) -> Optional[SemanticTranslationCache]:
+
+    if os.getenv("SEMANTIC_CACHE", "true").lower() != "true":
+        return None
+    return SemanticTranslationCache(card_names, seed=seed)
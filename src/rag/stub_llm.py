@@ -0,0 +1,279 @@
+
+
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from src.domain.models import LLMResponse
+from src.kg.cypher_lexer import tokenize, unquote, quote, STRING
+from src.kg.ingestion import DEFAULT_DATA_PATH
+from src.kg.schema import KGSchema
+from src.rag.llm_base import BaseLLM
+from src.rag.prompt_builder import estimate_tokens
+from src.rag.semantic_cache import QuestionEmbedder
+from src.rag.translation_cache import TranslationCache
+from src.utils.config import LLMConfig
+
+
+class StubLLM(BaseLLM):
+
+
+    provider = "stub"
+    LATENCY_DISTRIBUTIONS = ("fixed", "uniform", "normal", "lognormal")
+    MAX_LISTED = 10
+    # What the Cypher answers when no fixture fits; it fails validation, so
+    # the pipeline reports an invalid query instead of a wrong answer.
+    UNKNOWN = "UNKNOWN"
+
+    # A borrowed fixture must ask about the same relationship as the question.
+    RELATIONSHIP_KEYWORDS = {
+        "COUNTERS": re.compile(r"\b(counter\w*|beats?|beating|against|deal with|weak to)\b"),
+        "SYNERGIZES_WITH": re.compile(r"\b(synerg\w*|pairs?|combos?|go(es)? with|works? with|well with|together)\b"),
+    }
+
+    def __init__(self, model: str = None, fixtures: List[Dict[str, str]] = None, latency_ms: float = None,
+                 jitter_ms: float = None, distribution: str = None, chunk_ms: float = None, seed: int = None,
+                 config: LLMConfig = None, card_names: Callable[[], List[str]] = None):
+        self.model = model or "stub"
+        # Settings are reported like a real client's; only stop sequences
+        # change the output.
+        if config is not None:
+            self.max_tokens = config.max_tokens
+            self.temperature = config.temperature
+            self.stop = tuple(config.stop)
+        self.latency_ms = latency_ms if latency_ms is not None else float(os.getenv("LLM_STUB_LATENCY_MS", "0"))
+        self.jitter_ms = jitter_ms if jitter_ms is not None else float(os.getenv("LLM_STUB_JITTER_MS", "0"))
+        self.distribution = (distribution or os.getenv("LLM_STUB_LATENCY_DIST", "fixed")).lower()
+        if self.distribution not in self.LATENCY_DISTRIBUTIONS:
+            raise ValueError(
+                f"Unknown LLM_STUB_LATENCY_DIST '{self.distribution}'. "
+                f"Valid options: {', '.join(self.LATENCY_DISTRIBUTIONS)}"
+            )
+        self.chunk_ms = chunk_ms if chunk_ms is not None else float(os.getenv("LLM_STUB_CHUNK_MS", "0"))
+        # A seeded generator makes latency sequences repeat run to run.
+        self._random = random.Random(seed if seed is not None else int(os.getenv("LLM_STUB_SEED", "0")))
+        self._random_lock = threading.Lock()
+
+        self.fixtures = fixtures if fixtures is not None else self._load_fixtures()
+        self._embedder = QuestionEmbedder()
+        self._by_question = {TranslationCache.normalize_question(f["question"]): f["cypher"] for f in self.fixtures}
+        self._vectors = [(self._normalized(f["question"]), f["cypher"]) for f in self.fixtures]
+        self._card_names = card_names or self._load_card_names
+        # (pattern, lookup), built together on first use so concurrent
+        # translations never see one without the other.
+        self._card_index = None
+        self._card_lock = threading.Lock()
+
+    @staticmethod
+    def _load_fixtures() -> List[Dict[str, str]]:
+
+        fixtures = list(KGSchema.get_cypher_examples())
+        path = os.getenv("LLM_STUB_FIXTURES")
+        if path:
+            with open(path, "r", encoding="utf-8") as f:
+                fixtures.extend(json.load(f))
+        return fixtures
+
+    def _invoke(self, prompt: str, max_tokens: int = None, temperature: float = None,
+                stop: Tuple[str, ...] = None) -> LLMResponse:
+
+        time.sleep(self._sample_latency() / 1000)
+        text = self._apply_stop(self._respond(prompt), stop)
+        return LLMResponse(content=text, usage=self._usage(prompt, text))
+
+    def _stream(self, prompt: str, max_tokens: int = None, temperature: float = None,
+                stop: Tuple[str, ...] = None):
+
+        time.sleep(self._sample_latency() / 1000)
+        for index, word in enumerate(self._apply_stop(self._respond(prompt), stop).split(" ")):
+            if index and self.chunk_ms:
+                time.sleep(self.chunk_ms / 1000)
+            yield word if index == 0 else " " + word
+
+    def _respond(self, prompt: str) -> str:
+
+        question = self._question(prompt)
+        if "Classify a Clash Royale question into a JSON object" in prompt:
+            # The translator then takes its regular Cypher path.
+            return json.dumps({"intent": "unknown"})
+        if prompt.rstrip().endswith("Cypher:"):
+            return self.translate(question)
+        if "## Graph Data (part" in prompt:
+            return self._summarize(question, self._section(prompt, "## Graph Data (part", "## Notes:"), "Notes")
+        if "## Notes:" in prompt:
+            notes = self._section(prompt, "## Notes:", "## Your Answer:")
+            names = [n for line in notes.splitlines() for n in re.findall(r"^- (.+)$", line)]
+            return f"Answer to \"{question}\": {', '.join(names) or 'no cards'}."
+        if "## Graph Data Retrieved:" in prompt:
+            return self._summarize(question, self._section(prompt, "## Graph Data Retrieved:", "## Your Answer:"), "Answer")
+        return "OK"
+
+    def _apply_stop(self, text: str, stop: Tuple[str, ...] = None) -> str:
+
+        for stop in (self.stop if stop is None else stop):
+            text = text.split(stop, 1)[0]
+        return text
+
+    def translate(self, question: str) -> str:
+
+        exact = self._by_question.get(TranslationCache.normalize_question(question))
+        if exact is not None:
+            return exact
+        # Otherwise the closest fixture that asks the same kind of thing,
+        # with the question's cards put in place of the fixture's.
+        vector = self._normalized(question)
+        cards = self._cards_in(question)
+        lowered = question.lower()
+        ranked = sorted(self._vectors, key=lambda item: self._similarity(vector, item[0]), reverse=True)
+        for _, cypher in ranked:
+            adapted = self._adapt(cypher, lowered, cards)
+            if adapted is not None:
+                return adapted
+        return self.UNKNOWN
+
+    def _adapt(self, cypher: str, question: str, cards: List[str]) -> Optional[str]:
+
+        asked = {rel for rel, pattern in self.RELATIONSHIP_KEYWORDS.items() if pattern.search(question)}
+        used = {rel for rel in self.RELATIONSHIP_KEYWORDS if rel in cypher}
+        if asked != used:
+            return None
+
+        tokens = tokenize(cypher)
+        slots = []
+        for index, token in enumerate(tokens):
+            if token.kind != STRING:
+                continue
+            value = unquote(token.text)
+            if value.lower() in self._cards()[1]:
+                slots.append(index)
+            elif not all(word in question for word in re.findall(r"[a-z0-9]+", value.lower())):
+                # 'legendary', 'air', 'Beatdown': a filter the question never asked for.
+                return None
+        if len(slots) != len(cards):
+            return None
+
+        parts = [token.text for token in tokens]
+        for index, card in zip(slots, cards):
+            parts[index] = quote(card)
+        return "".join(parts)
+
+    def _cards_in(self, question: str) -> List[str]:
+
+        pattern, lookup = self._cards()
+        cards = []
+        for match in pattern.finditer(question):
+            name = lookup[match.group(1).lower()]
+            if name not in cards:
+                cards.append(name)
+        return cards
+
+    def _cards(self) -> Tuple["re.Pattern", Dict[str, str]]:
+
+        if self._card_index is None:
+            with self._card_lock:
+                if self._card_index is None:
+                    lookup = {name.lower(): name for name in self._card_names() if name}
+                    if not lookup:
+                        print("Warning: stub LLM loaded no card names; questions not matching a fixture "
+                              "exactly will translate to UNKNOWN")
+                    alternation = "|".join(re.escape(name) for name in sorted(lookup, key=len, reverse=True))
+                    # Without a card list nothing is slotted; fixtures then only
+                    # fit questions naming the same cards.
+                    pattern = re.compile(rf"(?<![\w.])({alternation})(?!\w)" if alternation else r"(?!)",
+                                         re.IGNORECASE)
+                    self._card_index = (pattern, lookup)
+        return self._card_index
+
+    @staticmethod
+    def _load_card_names() -> List[str]:
+
+        try:
+            with open(DEFAULT_DATA_PATH, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Warning: stub LLM could not read card names from {DEFAULT_DATA_PATH}: {e}")
+            return []
+        return [card.get("name") for arena in data.values() for card in arena.get("cards", [])]
+
+    def _summarize(self, question: str, table: str, label: str) -> str:
+
+        lines = [line for line in table.strip().splitlines() if line.strip()]
+        rows = [line for line in lines[1:] if " | " in line or not line.startswith("...")]
+        names = [row.split(" | ")[0].strip() for row in rows if row.split(" | ")[0].strip()]
+        if label == "Notes":
+            return "\n".join(f"- {name}" for name in names)
+        listed = ", ".join(names[:self.MAX_LISTED])
+        more = f" and {len(names) - self.MAX_LISTED} more" if len(names) > self.MAX_LISTED else ""
+        return f"{label}: {len(rows)} records matched \"{question}\": {listed}{more}."
+
+    def _sample_latency(self) -> float:
+
+        if not self.latency_ms and not self.jitter_ms:
+            return 0.0
+        with self._random_lock:
+            if self.distribution == "uniform":
+                value = self._random.uniform(self.latency_ms - self.jitter_ms, self.latency_ms + self.jitter_ms)
+            elif self.distribution == "normal":
+                value = self._random.gauss(self.latency_ms, self.jitter_ms)
+            elif self.distribution == "lognormal":
+                # Median latency_ms with a long right tail, like real providers.
+                sigma = self.jitter_ms / self.latency_ms if self.latency_ms else 0.0
+                value = self.latency_ms * math.exp(self._random.gauss(0.0, sigma))
+            else:
+                value = self.latency_ms
+        return max(0.0, value)
+
+    @staticmethod
+    def _usage(prompt: str, text: str) -> Dict[str, int]:
+
+        prompt_tokens = estimate_tokens(prompt)
+        completion_tokens = estimate_tokens(text)
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+
+    def _normalized(self, text: str) -> Dict[int, float]:
+
+        features = self._embedder.features(text)
+        norm = math.sqrt(sum(w * w for w in features.values())) or 1.0
+        return {key: weight / norm for key, weight in features.items()}
+
+    @staticmethod
+    def _similarity(a: Dict[int, float], b: Dict[int, float]) -> float:
+
+        if len(a) > len(b):
+            a, b = b, a
+        return sum(weight * b.get(key, 0.0) for key, weight in a.items())
+
+    def _question(self, prompt: str) -> str:
+
+        # Answer prompts put the question under a heading; translator prompts
+        # end with it after their few-shot "Question:" examples.
+        if "## User Question:" in prompt:
+            return self._section(prompt, "## User Question:", "\n## ").strip()
+        index = prompt.rfind("Question:")
+        if index < 0:
+            return ""
+        return prompt[index + len("Question:"):].split("\n", 1)[0].strip()
+
+    @staticmethod
+    def _section(prompt: str, start: str, end: str) -> str:
+
+        index = prompt.find(start)
+        if index < 0:
+            return ""
+        body = prompt[index + len(start):].split("\n", 1)[-1]
+        stop = body.find(end)
+        return body if stop < 0 else body[:stop]
+
+
+def create_stub_llm(config: LLMConfig = None, card_names: Callable[[], List[str]] = None) -> StubLLM:
+
+    return StubLLM(config=config, card_names=card_names)
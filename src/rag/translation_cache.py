@@ -0,0 +1,130 @@
+
+
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Optional, Dict, Any, List, Tuple
+
+
+class TranslationCache:
+
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS translations (
+            question TEXT NOT NULL,
+            prompt_hash TEXT NOT NULL,
+            cypher TEXT NOT NULL,
+            ok INTEGER NOT NULL,
+            hits INTEGER NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (question, prompt_hash)
+        )
+    """
+
+    def __init__(self, path: str = None):
+        if path is None:
+            cache_dir = os.getenv("CACHE_DIR", ".cache")
+            path = os.path.join(cache_dir, "translations.sqlite3")
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "stored": 0, "invalidated": 0}
+
+        with self._connection() as conn:
+            conn.execute(self._SCHEMA)
+
+    @staticmethod
+    def normalize_question(question: str) -> str:
+
+        text = re.sub(r"\s+", " ", (question or "").strip().lower())
+        return text.rstrip("?!. ")
+
+    def get(self, question: str, prompt_hash: str) -> Optional[str]:
+
+        key = self.normalize_question(question)
+        conn = self._connection()
+        row = conn.execute(
+            "SELECT cypher FROM translations WHERE question = ? AND prompt_hash = ? AND ok = 1",
+            (key, prompt_hash),
+        ).fetchone()
+
+        if row is None:
+            self._count("misses")
+            return None
+
+        with conn:
+            conn.execute(
+                "UPDATE translations SET hits = hits + 1 WHERE question = ? AND prompt_hash = ?",
+                (key, prompt_hash),
+            )
+        self._count("hits")
+        return row[0]
+
+    def put(self, question: str, prompt_hash: str, cypher: str, ok: bool):
+
+        now = time.time()
+        with self._connection() as conn:
+            conn.execute(
+                """
+                INSERT INTO translations (question, prompt_hash, cypher, ok, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (question, prompt_hash) DO UPDATE SET
+                    cypher = excluded.cypher, ok = excluded.ok, updated_at = excluded.updated_at
+                """,
+                (self.normalize_question(question), prompt_hash, cypher, int(bool(ok)), now, now),
+            )
+        self._count("stored" if ok else "invalidated")
+
+    def successful(self, prompt_hash: str, limit: int = 1000) -> List[Tuple[str, str]]:
+
+        rows = self._connection().execute(
+            "SELECT question, cypher FROM translations WHERE prompt_hash = ? AND ok = 1 "
+            "ORDER BY updated_at DESC LIMIT ?",
+            (prompt_hash, limit),
+        ).fetchall()
+        return [(question, cypher) for question, cypher in rows]
+
+    def clear(self):
+
+        with self._connection() as conn:
+            conn.execute("DELETE FROM translations")
+
+    def get_stats(self) -> Dict[str, Any]:
+
+        row = self._connection().execute(
+            "SELECT COUNT(*), COALESCE(SUM(ok), 0) FROM translations"
+        ).fetchone()
+        with self._lock:
+            stats = dict(self.stats)
+        stats.update({"entries": row[0], "servable": row[1], "path": self.path})
+        return stats
+
+    def _count(self, key: str):
+
+        with self._lock:
+            self.stats[key] += 1
+
+    def _connection(self) -> sqlite3.Connection:
+
+        # One connection per thread; WAL lets the CLI, the web server and other
+        # RAGService processes read while one of them writes.
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+
+def create_translation_cache(path: str = None) -> Optional[TranslationCache]:
+
+    if os.getenv("TRANSLATION_CACHE", "true").lower() != "true":
+        return None
+    return TranslationCache(path)
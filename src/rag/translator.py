@@ -1,35 +1,92 @@
-from typing import Optional
+import hashlib
+import os
+import threading
+import time
+from typing import Callable, List, Optional, Tuple
 from langchain_core.prompts import PromptTemplate
 from langchain_core.runnables import RunnableLambda
 
 from src.kg.schema import KGSchema
+from src.rag.translation_cache import TranslationCache, create_translation_cache
+from src.rag.semantic_cache import create_semantic_cache
+from src.rag.prompt_builder import PromptAssembler, PromptStats, estimate_tokens
+from src.rag.intent_compiler import IntentCompiler, IntentCompilationError
+from src.rag.cypher_linter import CypherLinter, CypherLintError
+from src.rag.query_metrics import LatencyHistogram
 
 
 class QueryTranslator:
     
 
-    def __init__(self, llm):
+    REPAIR_TEMPLATE = """The Cypher query below was written for a Clash Royale Knowledge Graph but failed validation.
+
+{schema}
+
+Question: {question}
+Query: {cypher}
+Errors:
+{errors}
+
+Fix the errors using only the labels, relationship types and properties in the schema.
+Output ONLY the corrected read-only Cypher query, no explanations or markdown formatting.
+
+Cypher:"""
+
+    def __init__(self, llm, cache: Optional[TranslationCache] = None,
+                 card_names: Optional[Callable[[], List[str]]] = None, repair_llm=None):
         self.llm = llm
+        self.repair_llm = repair_llm or llm
         self.schema = KGSchema()
+        self.mode = os.getenv("TRANSLATOR_MODE", "cypher").lower()
+        if self.mode not in ("cypher", "intent"):
+            raise ValueError(f"Unknown TRANSLATOR_MODE '{self.mode}'. Valid options: 'cypher' or 'intent'")
+        self.assembler = PromptAssembler(self.schema)
+        self.intent_compiler = IntentCompiler(self.schema)
+        self.linter = CypherLinter(self.schema)
+        self.max_repairs = int(os.getenv("TRANSLATOR_MAX_REPAIRS", "1"))
+        self.stats = {
+            "intent_compiled": 0, "intent_fallbacks": 0,
+            "lint_failures": 0, "repairs": 0, "repairs_succeeded": 0,
+        }
+        self.repair_latency = LatencyHistogram()
+        self._stats_lock = threading.Lock()
         self.prompt_template = self._build_prompt_template()
+        self.prompt_hash = self._prompt_hash()
+        self._full_prompt_tokens = self._measure_full_prompt()
+        self._local = threading.local()
+        self.cache = cache if cache is not None else create_translation_cache()
+        self.semantic_cache = None
+        if card_names is not None:
+            self.semantic_cache = create_semantic_cache(card_names, seed=self._successful_translations)
 
-    def _build_prompt_template(self) -> PromptTemplate:
-        
+    def _successful_translations(self):
 
-        raw_schema_desc = self.schema.get_schema_description()
-        schema_desc = raw_schema_desc.replace("{", "{{").replace("}", "}}")
+        return self.cache.successful(self.prompt_hash) if self.cache is not None else []
 
-        examples = self.schema.get_cypher_examples()
+    def _prompt_hash(self) -> str:
 
-        raw_examples_text = "\n\n".join([
-            f"Question: {ex['question']}\nCypher: {ex['cypher']}"
-            for ex in examples
+        # A new template or a different model must not reuse old translations.
+        model = getattr(self.llm, "model", type(self.llm).__name__)
+        schema_desc, examples_text = self.assembler.full_context()
+        signature = "\n".join([
+            model, self.prompt_template.template, schema_desc, examples_text,
+            f"k={self.assembler.k} prune={self.assembler.prune_schema} mode={self.mode}",
+            self.intent_compiler.build_prompt("") if self.mode == "intent" else "",
         ])
-        examples_text = raw_examples_text.replace("{", "{{").replace("}", "}}")
+        return hashlib.sha1(signature.encode("utf-8")).hexdigest()[:16]
+
+    def _measure_full_prompt(self) -> int:
 
+        schema_desc, examples_text = self.assembler.full_context()
+        return estimate_tokens(self.prompt_template.format(schema=schema_desc, examples=examples_text, question=""))
+
+    def _build_prompt_template(self) -> PromptTemplate:
+        
+
+        # Schema and examples are filled in per question by the assembler.
         template = """You are an expert Cypher query translator for a Clash Royale Knowledge Graph.
 
-""" + schema_desc + """
+{schema}
 
 1. Use MATCH for querying nodes and relationships
 2. Use WHERE for filtering (prefer WHERE over inline {{}} for clarity)
@@ -45,7 +102,7 @@ class QueryTranslator:
 12. **For Champion queries**: Include c.rarity to identify if card is a champion
 
 
-""" + examples_text + """
+{examples}
 
 ## Your Task:
 Translate the following question into a valid Cypher query.
@@ -57,13 +114,134 @@ Cypher:"""
 
         return PromptTemplate.from_template(template)
 
+    def static_prefix(self) -> str:
+
+        # The text every translation prompt starts with: the instructions and,
+        # unless the schema is pruned per question, the whole schema.
+        marker = "\0"
+        if self.assembler.prune_schema:
+            return self.prompt_template.format(schema=marker, examples="", question="").split(marker, 1)[0]
+        schema_desc = self.schema.get_schema_description()
+        return self.prompt_template.format(schema=schema_desc, examples=marker, question="").split(marker, 1)[0]
+
+    def build_prompt(self, question: str) -> Tuple[str, PromptStats]:
+        
+        schema_desc, examples_text = self.assembler.assemble(question)
+        prompt = self.prompt_template.format(schema=schema_desc, examples=examples_text, question=question)
+        stats = PromptStats(
+            chars=len(prompt),
+            estimated_tokens=estimate_tokens(prompt),
+            full_estimated_tokens=self._full_prompt_tokens + estimate_tokens(question),
+            examples=examples_text.count("Question: "),
+            node_types=[name for name in self.schema.NODES if f"### {name}\n" in schema_desc],
+            relationship_types=[name for name in self.schema.RELATIONSHIPS if f"### :{name}\n" in schema_desc],
+        )
+        return prompt, stats
+
+    def last_prompt_stats(self) -> Optional[PromptStats]:
+        
+        # None when the last translation on this thread was served from cache.
+        return getattr(self._local, "prompt_stats", None)
+
     def translate(self, question: str) -> str:
         
-        prompt = self.prompt_template.format(question=question)
+        cypher = self._translate_unchecked(question)
+        errors = self.linter.lint(cypher)
+        if errors:
+            self._count("lint_failures")
+
+        for _ in range(self.max_repairs):
+            if not errors:
+                break
+            cypher = self.repair(question, cypher, errors)
+            errors = self.linter.lint(cypher)
+            if not errors:
+                self._count("repairs_succeeded")
+
+        if errors:
+            raise CypherLintError(errors)
+        return cypher
+
+    def repair(self, question: str, cypher: str, errors: List[str]) -> str:
+        
+        # The full schema goes back in: a pruned one may be why it went wrong.
+        prompt = self.REPAIR_TEMPLATE.format(
+            schema=self.schema.get_schema_description(),
+            question=question,
+            cypher=cypher,
+            errors="\n".join(f"- {error}" for error in errors),
+        )
+        start = time.perf_counter()
+        result = self.repair_llm.invoke(prompt)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self._stats_lock:
+            self.stats["repairs"] += 1
+            self.repair_latency.observe(elapsed_ms)
+        return self._clean_cypher_output(result)
+
+    def _translate_unchecked(self, question: str) -> str:
+        
+        self._local.prompt_stats = None
+        if self.cache is not None:
+            cached = self.cache.get(question, self.prompt_hash)
+            if cached is not None:
+                return cached
+
+        if self.semantic_cache is not None:
+            cached = self.semantic_cache.get(question)
+            if cached is not None:
+                return cached
+
+        if self.mode == "intent":
+            compiled = self._translate_intent(question)
+            if compiled is not None:
+                return compiled
+
+        prompt, stats = self.build_prompt(question)
+        self._local.prompt_stats = stats
         result = self.llm.invoke(prompt)
         clean_result = self._clean_cypher_output(result)
         return clean_result
 
+    def _translate_intent(self, question: str) -> Optional[str]:
+        
+        prompt = self.intent_compiler.build_prompt(question)
+        self._local.prompt_stats = PromptStats(
+            chars=len(prompt),
+            estimated_tokens=estimate_tokens(prompt),
+            full_estimated_tokens=self._full_prompt_tokens + estimate_tokens(question),
+        )
+        try:
+            intent = self.intent_compiler.parse(self.llm.invoke(prompt))
+            cypher = self.intent_compiler.compile(intent)
+        except IntentCompilationError:
+            # Unknown intents and malformed JSON go through the Cypher prompt.
+            self._count("intent_fallbacks")
+            return None
+        self._count("intent_compiled")
+        return cypher
+
+    def _count(self, key: str):
+
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    def get_stats(self) -> dict:
+        
+        with self._stats_lock:
+            return dict(self.stats, mode=self.mode, repair_latency=self.repair_latency.to_dict())
+
+    def record_outcome(self, question: str, cypher: str, ok: bool):
+        
+        # Only translations that executed cleanly are served again; a failure
+        # overwrites any earlier entry so it stops being reused.
+        if not cypher:
+            return
+        if self.cache is not None:
+            self.cache.put(question, self.prompt_hash, cypher, ok)
+        if self.semantic_cache is not None:
+            self.semantic_cache.put(question, cypher, ok)
+
     def _clean_cypher_output(self, raw_output: str) -> str:
         
         if hasattr(raw_output, 'content'):
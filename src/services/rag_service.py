@@ -4,10 +4,14 @@ import time
 
 from src.domain.models import RAGResponse
 from src.rag.pipeline import RAGPipeline
+from src.rag.llm_concurrency import get_llm_gate
+from src.rag.llm_resilience import get_resilience_stats
+from src.rag.rate_limiter import get_rate_limit_stats
+from src.rag.llm_accounting import get_accounting_stats
 class RAGService:
 
-    def __init__(self, llm, verbose: bool = False):
-        self.pipeline = RAGPipeline(llm, verbose=verbose)
+    def __init__(self, llm, verbose: bool = False, stage_llms: Optional[Dict[str, Any]] = None):
+        self.pipeline = RAGPipeline(llm, verbose=verbose, stage_llms=stage_llms)
 
     def query(self, request: Dict[str, Any]) -> Dict[str, Any]:
         
@@ -31,11 +35,13 @@ class RAGService:
                 "answer": rag_response.answer,
                 "sources": rag_response.sources,
                 "confidence": rag_response.confidence,
+                "cached": rag_response.cached,
             }
 
             if include_metadata:
                 response_data["cypher_query"] = rag_response.cypher_query
                 response_data["retrieved_data"] = rag_response.retrieved_data
+                response_data["llm_usage"] = rag_response.llm_usage
 
             return {
                 "success": True,
@@ -71,9 +77,24 @@ class RAGService:
         
         try:
             stats = self.pipeline.get_stats()
+            translation_cache = self.pipeline.translator.cache
+            semantic_cache = self.pipeline.translator.semantic_cache
+            answer_cache = self.pipeline.generator.answer_cache
             return {
                 "success": True,
-                "data": stats
+                "data": stats,
+                "query_rewrites": self.pipeline.rewriter.get_stats(),
+                "query_metrics": self.pipeline.retriever.metrics.to_dict(),
+                "translator": self.pipeline.translator.get_stats(),
+                "translation_cache": translation_cache.get_stats() if translation_cache else None,
+                "semantic_cache": semantic_cache.get_stats() if semantic_cache else None,
+                "answer_cache": answer_cache.get_stats() if answer_cache else None,
+                "map_reduce": self.pipeline.generator.map_reduce.get_stats(),
+                "llm": get_llm_gate().get_stats(),
+                "llm_providers": get_resilience_stats(),
+                "llm_rate_limits": get_rate_limit_stats(),
+                "llm_usage": get_accounting_stats(),
+                "llm_stages": {stage: self._stage_info(llm) for stage, llm in self.pipeline.stage_llms.items()}
             }
         except Exception as e:
             return {
@@ -81,6 +102,22 @@ class RAGService:
                 "error": str(e)
             }
 
+    @staticmethod
+    def _stage_info(llm) -> Dict[str, Any]:
+
+        info = {
+            "provider": getattr(llm, "provider", None),
+            "model": getattr(llm, "model", None),
+            "max_tokens": getattr(llm, "max_tokens", None),
+            "temperature": getattr(llm, "temperature", None),
+            "stop": list(getattr(llm, "stop", ()) or ()),
+        }
+        # Local models also report their prefix cache and batching.
+        local_stats = getattr(llm, "get_stats", None)
+        if local_stats is not None:
+            info["local"] = local_stats()
+        return info
+
     def health_check(self) -> Dict[str, Any]:
         
         neo4j_healthy = False
@@ -110,6 +147,6 @@ class RAGService:
         self.pipeline.close()
 
 
-def create_rag_service(llm, verbose: bool = False) -> RAGService:
+def create_rag_service(llm, verbose: bool = False, stage_llms: Optional[Dict[str, Any]] = None) -> RAGService:
     
-    return RAGService(llm, verbose=verbose)
+    return RAGService(llm, verbose=verbose, stage_llms=stage_llms)
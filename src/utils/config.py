@@ -1,8 +1,23 @@
+import codecs
 import os
+import threading
 from dotenv import load_dotenv
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
+from typing import Optional, Tuple
 
-load_dotenv()
+
+# Pipeline stages that can each run on their own model and token budget.
+LLM_STAGES = ("translator", "generator", "repair", "summarizer")
+
+# Defaults applied on top of the base LLM settings; LLM_<STAGE>_* overrides.
+# Cypher is short and should be deterministic, so translation stops at the
+# end of the statement instead of running to LLM_MAX_TOKENS.
+STAGE_DEFAULTS = {
+    "translator": {"max_tokens": 256, "temperature": 0.0, "stop": (";", "\nQuestion:")},
+    "repair": {"max_tokens": 256, "temperature": 0.0, "stop": (";", "\nQuestion:")},
+    "summarizer": {"max_tokens": 512},
+    "generator": {},
+}
 
 
 @dataclass
@@ -22,18 +37,55 @@ class Neo4jConfig:
 
 @dataclass
 class LLMConfig:
+    provider: str
     model_name: str
     device: str
     max_tokens: int
     temperature: float
+    openrouter_api_key: Optional[str] = None
+    gemini_api_key: Optional[str] = None
+    openrouter_base_url: str = "https://openrouter.ai/api/v1"
+    pool_size: int = 10
+    connect_timeout: float = 5.0
+    read_timeout: float = 30.0
+    http_retries: int = 2
+    stop: Tuple[str, ...] = ()
+
+    def for_stage(self, stage: str) -> "LLMConfig":
+        if stage not in LLM_STAGES:
+            raise ValueError(f"Unknown LLM stage '{stage}'. Valid options: {', '.join(LLM_STAGES)}")
+
+        prefix = f"LLM_{stage.upper()}_"
+        defaults = STAGE_DEFAULTS[stage]
+        # Stage budgets only ever tighten the base LLM_MAX_TOKENS.
+        max_tokens = min(defaults.get("max_tokens", self.max_tokens), self.max_tokens)
+        stop = os.getenv(prefix + "STOP")
+        return replace(
+            self,
+            provider=os.getenv(prefix + "PROVIDER", self.provider).lower(),
+            model_name=os.getenv(prefix + "MODEL", self.model_name),
+            max_tokens=int(os.getenv(prefix + "MAX_TOKENS", max_tokens)),
+            temperature=float(os.getenv(prefix + "TEMPERATURE", defaults.get("temperature", self.temperature))),
+            # "|"-separated, with backslash escapes so "\n" can be written in .env.
+            stop=tuple(codecs.decode(s, "unicode_escape") for s in stop.split("|") if s)
+            if stop is not None else defaults.get("stop", self.stop),
+        )
 
     @classmethod
     def from_env(cls):
         return cls(
-            model_name=os.getenv("LLM_MODEL", "claude/haiku-4.5"),
+            provider=os.getenv("LLM_PROVIDER", "gemini").lower(),
+            model_name=os.getenv("LLM_MODEL", "gemini-1.5-flash"),
             device=os.getenv("LLM_DEVICE", "auto"),
             max_tokens=int(os.getenv("LLM_MAX_TOKENS", "512")),
-            temperature=float(os.getenv("LLM_TEMPERATURE", "0.1"))
+            temperature=float(os.getenv("LLM_TEMPERATURE", "0.1")),
+            openrouter_api_key=os.getenv("OPENROUTER_API_KEY"),
+            gemini_api_key=os.getenv("GEMINI_API_KEY"),
+            openrouter_base_url=os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1"),
+            pool_size=int(os.getenv("LLM_POOL_SIZE", "10")),
+            connect_timeout=float(os.getenv("LLM_CONNECT_TIMEOUT", "5")),
+            read_timeout=float(os.getenv("LLM_READ_TIMEOUT", "30")),
+            http_retries=int(os.getenv("LLM_HTTP_RETRIES", "2"))
         )
 
 
@@ -52,4 +104,23 @@ class AppConfig:
         )
 
 
-config = AppConfig.from_env()
+_config = None
+_config_lock = threading.Lock()
+
+
+def get_config() -> AppConfig:
+    # Built on first use, so importing this module reads nothing.
+    global _config
+    if _config is None:
+        with _config_lock:
+            if _config is None:
+                load_dotenv()
+                _config = AppConfig.from_env()
+    return _config
+
+
+def __getattr__(name):
+    # `config` used to be built at import time; keep it importable.
+    if name == "config":
+        return get_config()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,97 @@
+
+
+import os
+
+import pytest
+
+from src.kg.cypher_engine import CypherEngine, CypherEngineError, CypherUnsupportedError
+from src.kg.ingestion import DEFAULT_DATA_PATH, load_memory_graph
+from src.kg.schema import KGSchema
+
+
+@pytest.fixture(scope="module")
+def engine():
+
+    return CypherEngine(load_memory_graph())
+
+
+@pytest.mark.parametrize("example", KGSchema.get_cypher_examples(), ids=lambda e: e["question"])
+def test_schema_examples_run(engine, example):
+
+    rows = engine.execute(example["cypher"])
+    assert rows, example["cypher"]
+
+
+def test_default_data_path_is_absolute():
+
+    assert os.path.isabs(DEFAULT_DATA_PATH) and os.path.exists(DEFAULT_DATA_PATH)
+
+
+def test_load_memory_graph_outside_repo_root(tmp_path, monkeypatch):
+
+    monkeypatch.chdir(tmp_path)
+    rows = CypherEngine(load_memory_graph()).execute("MATCH (c:Card) RETURN count(c) AS n")
+    assert rows[0]["n"] > 0
+
+
+def test_aggregation_groups_by_non_aggregated_columns(engine):
+
+    rows = engine.execute(
+        "MATCH (c:Card)-[:HAS_RARITY]->(r:Rarity) "
+        "RETURN r.name AS rarity, count(c) AS cards, min(c.elixir) AS cheapest ORDER BY rarity"
+    )
+    total = engine.execute("MATCH (c:Card)-[:HAS_RARITY]->(:Rarity) RETURN count(c) AS n")[0]["n"]
+    assert [row["rarity"] for row in rows] == sorted(row["rarity"] for row in rows)
+    assert sum(row["cards"] for row in rows) == total
+    cheapest = engine.execute("MATCH (c:Card) RETURN min(c.elixir) AS m")[0]["m"]
+    assert min(row["cheapest"] for row in rows) == cheapest
+
+
+def test_collect_and_slice(engine):
+
+    rows = engine.execute("MATCH (c:Card) WITH c ORDER BY c.name RETURN collect(c.name)[..2] AS first")
+    names = sorted(row["n"] for row in engine.execute("MATCH (c:Card) RETURN c.name AS n"))
+    assert rows[0]["first"] == names[:2]
+    assert engine.execute("RETURN [1, 2, 3, 4][1..3] AS s, [1, 2, 3][-1..] AS t") == [{"s": [2, 3], "t": [3]}]
+
+
+def test_optional_match_keeps_rows_without_matches(engine):
+
+    rows = engine.execute(
+        "MATCH (c:Card {name: 'Giant'}) OPTIONAL MATCH (c)-[:NO_SUCH_REL]->(x) RETURN c.name AS card, x AS other"
+    )
+    assert rows == [{"card": "Giant", "other": None}]
+
+
+def test_union_deduplicates_and_union_all_keeps(engine):
+
+    branch = "MATCH (c:Card {name: 'Giant'}) RETURN c.name AS n"
+    assert engine.execute(f"{branch} UNION {branch}") == [{"n": "Giant"}]
+    assert len(engine.execute(f"{branch} UNION ALL {branch}")) == 2
+
+
+def test_union_requires_matching_columns(engine):
+
+    with pytest.raises(CypherEngineError):
+        engine.execute("RETURN 1 AS a UNION RETURN 2 AS b")
+
+
+def test_order_by_puts_nulls_last_ascending_and_first_descending(engine):
+
+    query = "UNWIND [3, null, 1] AS x RETURN x ORDER BY x {}"
+    assert [row["x"] for row in engine.execute(query.format("ASC"))] == [1, 3, None]
+    assert [row["x"] for row in engine.execute(query.format("DESC"))] == [None, 3, 1]
+
+
+@pytest.mark.parametrize("query", [
+    "MATCH p = (c:Card)-[:COUNTERS]->(t:Card) RETURN p",
+    "MATCH (c:Card) RETURN [x IN [1, 2] WHERE x > 1] AS l",
+    "MATCH (c:Card) WHERE any(x IN [1, 2] WHERE x = c.elixir) RETURN c.name",
+    "MATCH (c:Card) RETURN c {.name} AS m",
+    "MATCH (c:Card)-[:COUNTERS*1..2]->(t:Card) RETURN t.name",
+    "CREATE (c:Card {name: 'X'})",
+])
+def test_unsupported_constructs_raise_a_clear_error(engine, query):
+
+    with pytest.raises(CypherUnsupportedError, match="not supported by the in-memory backend"):
+        engine.execute(query)
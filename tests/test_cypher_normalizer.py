@@ -0,0 +1,38 @@
+
+
+import pytest
+
+from src.rag.cypher_normalizer import CypherNormalizer
+
+
+@pytest.mark.parametrize("cypher, expected", [
+    (
+        "match (end:Card)-[:COUNTERS]->(all:Card) where end.elixir > 3 return end.name, all.name",
+        "MATCH (end:Card)-[:COUNTERS]->(all:Card) WHERE end.elixir > $p0 RETURN end.name, all.name",
+    ),
+    (
+        "match (c:Card) return c.name as all order by all desc",
+        "MATCH (c:Card) RETURN c.name AS all ORDER BY all DESC",
+    ),
+    (
+        "match (c:Card) return case when c.elixir > 4 then 'heavy' else 'light' end as weight",
+        "MATCH (c:Card) RETURN CASE WHEN c.elixir > $p0 THEN $p1 ELSE $p2 END AS weight",
+    ),
+    (
+        "match (a:Card) return a.name union all match (b:Card) return b.name",
+        "MATCH (a:Card) RETURN a.name UNION ALL MATCH (b:Card) RETURN b.name",
+    ),
+])
+def test_keywords_are_upper_cased_but_identifiers_keep_their_case(cypher, expected):
+
+    assert CypherNormalizer().normalize(cypher).cypher == expected
+
+
+def test_case_and_spacing_variants_share_a_fingerprint():
+
+    normalizer = CypherNormalizer()
+    a = normalizer.normalize("MATCH (c:Card {name: 'Giant'}) RETURN count(c)")
+    b = normalizer.normalize("match  (c:Card{name:\"Golem\"})\nreturn COUNT( c )")
+    assert a.cypher == b.cypher
+    assert a.fingerprint == b.fingerprint
+    assert (a.parameters, b.parameters) == ({"p0": "Giant"}, {"p0": "Golem"})
@@ -0,0 +1,82 @@
+
+
+import threading
+
+import pytest
+
+from src.domain.models import QueryResult
+from src.rag.generator import AnswerGenerator
+from src.rag.map_reduce import MapReduceAnswerer
+
+
+class RecordingLLM:
+
+    model = "recording"
+
+    def __init__(self):
+        self.prompts = []
+        self._lock = threading.Lock()
+
+    def invoke(self, prompt: str) -> str:
+        with self._lock:
+            self.prompts.append(prompt)
+            return f"reply {len(self.prompts)}"
+
+
+ROWS = [{"title": f"Deck {i}", "note": f"note {i}"} for i in range(5)]
+
+
+@pytest.fixture
+def llm():
+
+    return RecordingLLM()
+
+
+def _generator(llm, chunk_rows):
+
+    generator = AnswerGenerator(llm)
+    generator.answer_cache = None
+    generator.templates.enabled = False
+    generator.map_reduce = MapReduceAnswerer(generator.serializer, enabled=True, row_threshold=2,
+                                             chunk_rows=chunk_rows, max_workers=2)
+    return generator
+
+
+def _result():
+
+    return QueryResult(data=list(ROWS), cypher_query="MATCH (d:Deck) RETURN d.title AS title, d.note AS note",
+                       execution_time=0.0)
+
+
+def test_single_chunk_is_answered_with_the_regular_prompt(llm):
+
+    generator = _generator(llm, chunk_rows=10)
+    assert generator.map_reduce.should_split(ROWS)
+
+    response = generator.generate("Which decks are there?", _result())
+    assert llm.prompts == [generator._build_prompt("Which decks are there?", _result())]
+    assert response.answer == "reply 1"
+    assert generator.map_reduce.get_stats()["runs"] == 0
+
+
+def test_single_chunk_streams_the_regular_prompt(llm):
+
+    generator = _generator(llm, chunk_rows=10)
+    events = list(generator.generate_stream("Which decks are there?", _result()))
+    assert len(llm.prompts) == 1
+    assert "Deck 4" in llm.prompts[0]
+    assert events[-1][1].answer == "reply 1"
+
+
+def test_many_chunks_are_mapped_then_reduced(llm):
+
+    generator = _generator(llm, chunk_rows=2)
+    response = generator.generate("Which decks are there?", _result())
+
+    maps, reduce = llm.prompts[:3], llm.prompts[3]
+    assert len(llm.prompts) == 4
+    assert sorted(prompt.split("(part ")[1].split(")")[0] for prompt in maps) == ["1 of 3", "2 of 3", "3 of 3"]
+    assert all(f"Deck {i}" in "".join(maps) for i in range(5))
+    assert "read in 3 parts" in reduce
+    assert response.answer == "reply 4"
+    assert generator.map_reduce.get_stats()["chunks"] == 3
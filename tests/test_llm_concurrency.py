@@ -0,0 +1,182 @@
+
+
+import asyncio
+import threading
+
+import pytest
+
+from src.rag import llm_concurrency
+from src.rag.llm_concurrency import LLMGate, was_coalesced
+from src.rag.stub_llm import StubLLM
+
+
+class Blocking:
+
+    # A fake client that holds its call open until released, so followers
+    # are guaranteed to arrive while the leader is still in flight.
+
+    def __init__(self, result="answer", error: Exception = None):
+        self.result = result
+        self.error = error
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        self.started.set()
+        assert self.release.wait(5)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def _run_followers(gate, key, client, count):
+
+    results = []
+
+    def follower():
+        try:
+            results.append((gate.call(key, client), was_coalesced()))
+        except Exception as e:
+            results.append((e, was_coalesced()))
+
+    threads = [threading.Thread(target=follower) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    # Followers register under the gate's lock before parking on the flight.
+    while gate.get_stats()["coalesced"] < count:
+        threading.Event().wait(0.001)
+    return threads, results
+
+
+@pytest.fixture
+def gate(monkeypatch):
+
+    gate = LLMGate(max_concurrency=4, coalesce=True)
+    monkeypatch.setattr(llm_concurrency, "_gate", gate)
+    return gate
+
+
+def test_concurrent_identical_calls_share_one_request(gate):
+
+    client = Blocking()
+    leader_result = []
+    leader = threading.Thread(target=lambda: leader_result.append((gate.call("k", client), was_coalesced())))
+    leader.start()
+    assert client.started.wait(5)
+
+    followers, results = _run_followers(gate, "k", client, 3)
+    client.release.set()
+    for thread in [leader, *followers]:
+        thread.join()
+
+    assert client.calls == 1
+    assert leader_result == [("answer", False)]
+    assert results == [("answer", True)] * 3
+    assert gate.get_stats()["calls"] == 1
+
+
+def test_followers_see_the_leaders_error(gate):
+
+    error = ValueError("provider down")
+    client = Blocking(error=error)
+    leader_result = []
+    leader = threading.Thread(target=lambda: leader_result.append(pytest.raises(ValueError, gate.call, "k", client)))
+    leader.start()
+    assert client.started.wait(5)
+
+    followers, results = _run_followers(gate, "k", client, 2)
+    client.release.set()
+    for thread in [leader, *followers]:
+        thread.join()
+    assert leader_result[0].value is error
+    assert results == [(error, True)] * 2
+
+
+def test_different_keys_and_later_calls_do_not_coalesce(gate):
+
+    calls = []
+    assert gate.call("a", lambda: calls.append("a") or 1) == 1
+    assert gate.call("b", lambda: calls.append("b") or 2) == 2
+    assert gate.call("a", lambda: calls.append("a") or 3) == 3
+    assert not was_coalesced()
+    assert calls == ["a", "b", "a"]
+    assert gate.get_stats()["coalesced"] == 0
+
+
+def test_cap_queues_calls_beyond_max_concurrency():
+
+    gate = LLMGate(max_concurrency=1, coalesce=False)
+    client = Blocking()
+    first = threading.Thread(target=gate.call, args=("k", client))
+    first.start()
+    assert client.started.wait(5)
+    assert not gate.acquire(blocking=False)
+
+    second = threading.Thread(target=gate.call, args=("k", lambda: "second"))
+    second.start()
+    while gate.get_stats()["queued"] < 1:
+        threading.Event().wait(0.001)
+    assert gate.get_stats()["in_flight"] == 1
+    client.release.set()
+    first.join()
+    second.join()
+    stats = gate.get_stats()
+    assert stats["calls"] == 2
+    assert stats["peak_in_flight"] == 1
+    assert stats["in_flight"] == 0
+
+
+def test_async_callers_coalesce_on_one_task(gate):
+
+    llm = StubLLM(latency_ms=20, fixtures=[])
+
+    async def ask():
+        response = await llm.ainvoke("Summarize the arena.")
+        return response.content, was_coalesced()
+
+    async def main():
+        return await asyncio.gather(*(ask() for _ in range(5)))
+
+    results = asyncio.run(main())
+    assert [coalesced for _, coalesced in results] == [False, True, True, True, True]
+    assert len({text for text, _ in results}) == 1
+    assert gate.get_stats()["calls"] == 1
+    assert gate.get_stats()["coalesced"] == 4
+
+
+@pytest.mark.parametrize("error", [None, ValueError("provider down")])
+def test_async_caller_joining_a_sync_flight_is_marked_coalesced(gate, error):
+
+    client = Blocking(error=error)
+
+    def lead():
+        try:
+            gate.call("k", client)
+        except ValueError:
+            pass
+
+    leader = threading.Thread(target=lead)
+    leader.start()
+    assert client.started.wait(5)
+
+    async def ask():
+        try:
+            outcome = await gate.acall("k", lambda: "own request")
+        except ValueError as e:
+            outcome = e
+        return outcome, was_coalesced()
+
+    async def main():
+        task = asyncio.ensure_future(ask())
+        while gate.get_stats()["coalesced"] < 1:
+            await asyncio.sleep(0.001)
+        client.release.set()
+        return await task
+
+    outcome, coalesced = asyncio.run(main())
+    leader.join()
+    assert outcome == (error or "answer")
+    assert coalesced
+    assert client.calls == 1
@@ -0,0 +1,271 @@
+
+
+import threading
+
+import pytest
+
+from src.rag import llm_concurrency, llm_resilience
+from src.rag.llm_concurrency import LLMGate
+from src.rag.llm_resilience import (
+    CircuitBreaker, LLMConfigurationError, LLMRateLimitError, LLMResponseError,
+    LLMServerError, LLMTimeoutError, LLMUnavailableError, ResilientCaller,
+)
+
+
+class FakeClock:
+
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+        self.sleeps = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def perf_counter(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class FakeRandom:
+
+    # Full jitter draws from [0, cap]; returning the cap makes delays exact.
+
+    def __init__(self):
+        self.ranges = []
+
+    def uniform(self, low: float, high: float) -> float:
+        self.ranges.append((low, high))
+        return high
+
+
+class Script:
+
+    # A fake client: raises or returns the scripted outcomes in order.
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+
+@pytest.fixture
+def clock(monkeypatch):
+
+    clock = FakeClock()
+    monkeypatch.setattr(llm_resilience, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def jitter(monkeypatch):
+
+    jitter = FakeRandom()
+    monkeypatch.setattr(llm_resilience, "random", jitter)
+    return jitter
+
+
+def test_breaker_opens_after_threshold_and_fails_fast(clock):
+
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+    for _ in range(2):
+        breaker.before_call()
+        breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+    clock.now += 10
+    with pytest.raises(LLMUnavailableError, match="retrying in 20s"):
+        breaker.before_call()
+    assert breaker.get_stats() == {"opened": 1, "rejected": 1, "state": "open", "consecutive_failures": 3}
+
+
+def test_breaker_half_open_lets_one_probe_through(clock):
+
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    clock.now += 30
+    breaker.before_call()
+    assert breaker.state == "half_open"
+    with pytest.raises(LLMUnavailableError):
+        breaker.before_call()
+
+    breaker.record_success()
+    assert breaker.state == "closed"
+    breaker.before_call()
+
+
+def test_breaker_failed_probe_reopens_for_a_full_timeout(clock):
+
+    breaker = CircuitBreaker(failure_threshold=5, reset_timeout=30)
+    for _ in range(5):
+        breaker.record_failure()
+    clock.now += 31
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert breaker.stats["opened"] == 2
+
+    clock.now += 29
+    with pytest.raises(LLMUnavailableError):
+        breaker.before_call()
+    clock.now += 1
+    breaker.before_call()
+
+
+def test_breaker_released_probe_lets_the_next_caller_probe(clock):
+
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    clock.now += 30
+    breaker.before_call()
+    breaker.release_probe()
+    breaker.before_call()
+    assert breaker.state == "half_open"
+
+
+def test_retryable_errors_back_off_with_capped_full_jitter(clock, jitter):
+
+    caller = ResilientCaller(retries=4, backoff_base=0.5, backoff_max=3, hedge=False,
+                             breaker=CircuitBreaker(failure_threshold=10, reset_timeout=30))
+    client = Script(LLMTimeoutError("t"), LLMServerError("s", status=503), LLMTimeoutError("t"),
+                    LLMServerError("s", status=502), "ok")
+    assert caller.call(client) == "ok"
+    assert client.calls == 5
+    assert jitter.ranges == [(0, 0.5), (0, 1.0), (0, 2.0), (0, 3)]
+    assert clock.sleeps == [0.5, 1.0, 2.0, 3]
+    assert caller.stats["retries"] == 4
+    assert caller.breaker.state == "closed"
+
+
+def test_retry_after_raises_the_backoff_up_to_the_cap(clock, jitter):
+
+    caller = ResilientCaller(retries=2, backoff_base=0.5, backoff_max=8, hedge=False,
+                             breaker=CircuitBreaker(failure_threshold=10, reset_timeout=30))
+    client = Script(LLMRateLimitError("slow down", retry_after=5), LLMRateLimitError("slow down", retry_after=60), "ok")
+    assert caller.call(client) == "ok"
+    assert clock.sleeps == [5, 8]
+
+
+@pytest.mark.parametrize("error", [LLMConfigurationError("no key"), LLMResponseError("bad json")])
+def test_non_retryable_errors_raise_without_tripping_the_breaker(clock, jitter, error):
+
+    caller = ResilientCaller(retries=3, hedge=False, breaker=CircuitBreaker(failure_threshold=1, reset_timeout=30))
+    client = Script(error)
+    with pytest.raises(type(error)):
+        caller.call(client)
+    assert client.calls == 1
+    assert clock.sleeps == []
+    assert caller.breaker.state == "closed"
+    assert caller.breaker.failures == 0
+    assert caller.stats["failures"] == 1
+
+
+def test_exhausted_retries_raise_the_last_error_and_open_the_breaker(clock, jitter):
+
+    caller = ResilientCaller(retries=2, backoff_base=1, backoff_max=8, hedge=False,
+                             breaker=CircuitBreaker(failure_threshold=3, reset_timeout=30))
+    client = Script(LLMTimeoutError("1"), LLMTimeoutError("2"), LLMTimeoutError("3"))
+    with pytest.raises(LLMTimeoutError, match="3"):
+        caller.call(client)
+    assert caller.breaker.state == "open"
+    with pytest.raises(LLMUnavailableError):
+        caller.call(Script("never reached"))
+
+
+def test_unclassified_exceptions_count_as_failures(clock, jitter):
+
+    caller = ResilientCaller(retries=2, hedge=False, breaker=CircuitBreaker(failure_threshold=1, reset_timeout=30))
+    with pytest.raises(ConnectionResetError):
+        caller.call(Script(ConnectionResetError()))
+    assert caller.breaker.state == "open"
+    assert clock.sleeps == []
+
+
+def test_stream_retries_only_before_the_first_chunk(clock, jitter):
+
+    caller = ResilientCaller(retries=2, backoff_base=1, backoff_max=8, hedge=False,
+                             breaker=CircuitBreaker(failure_threshold=10, reset_timeout=30))
+    attempts = []
+
+    def flaky():
+        attempts.append(len(attempts))
+        if len(attempts) == 1:
+            raise LLMTimeoutError("before")
+        yield "a"
+        raise LLMServerError("after", status=500)
+
+    chunks = []
+    with pytest.raises(LLMServerError, match="after"):
+        for chunk in caller.call_stream(flaky):
+            chunks.append(chunk)
+    assert chunks == ["a"]
+    assert len(attempts) == 2
+    assert clock.sleeps == [1]
+
+
+class SlowFirst:
+
+    # The first copy hangs until released; any later copy answers at once.
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.finished = threading.Event()
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            self.calls += 1
+            first = self.calls == 1
+        if not first:
+            return "hedge"
+        assert self.release.wait(5)
+        self.finished.set()
+        return "primary"
+
+
+@pytest.fixture
+def gate(monkeypatch):
+
+    gate = LLMGate(max_concurrency=2, coalesce=False)
+    monkeypatch.setattr(llm_concurrency, "_gate", gate)
+    return gate
+
+
+def test_losing_primary_keeps_a_slot_until_it_finishes(gate):
+
+    caller = ResilientCaller(retries=0, hedge=True, hedge_delay_ms=1)
+    client = SlowFirst()
+    assert gate.call("k", lambda: caller.call(client)) == "hedge"
+    assert caller.stats["hedge_wins"] == 1
+
+    # The caller has returned, yet the primary is still running on its slot.
+    assert gate.get_stats()["in_flight"] == 1
+    client.release.set()
+    assert client.finished.wait(5)
+    caller._executor.shutdown(wait=True)
+    assert gate.get_stats()["in_flight"] == 0
+    assert gate.get_stats()["peak_in_flight"] == 2
+
+
+def test_hedge_is_skipped_when_the_cap_is_full(monkeypatch):
+
+    gate = LLMGate(max_concurrency=1, coalesce=False)
+    monkeypatch.setattr(llm_concurrency, "_gate", gate)
+    caller = ResilientCaller(retries=0, hedge=True, hedge_delay_ms=1)
+    client = SlowFirst()
+    threading.Timer(0.05, client.release.set).start()
+    assert gate.call("k", lambda: caller.call(client)) == "primary"
+    assert client.calls == 1
+    assert caller.stats["hedges_skipped"] == 1
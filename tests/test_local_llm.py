@@ -0,0 +1,45 @@
+
+
+import pytest
+
+from src.rag.local_llm import LocalTransformersLLM, _Request, _until_stop
+from src.utils.config import LLMConfig
+
+
+STOP = ("\n\nQuestion:",)
+
+
+@pytest.mark.parametrize("chunks, expected", [
+    (["Hello wor", "ld\n\nQue", "stion: next"], ["Hello wor", "ld"]),
+    (["a\n", "\nb", "c"], ["a", "\n\nb", "c"]),
+    (["done\n"], ["done", "\n"]),
+    (["\n\nQuestion: at once"], []),
+])
+def test_stream_is_cut_at_the_stop_string(chunks, expected):
+
+    assert list(_until_stop(iter(chunks), STOP)) == expected
+
+
+def test_stream_without_stop_strings_passes_through():
+
+    assert list(_until_stop(iter(["a", "b"]), ())) == ["a", "b"]
+
+
+def test_batches_only_group_requests_with_the_same_budget(monkeypatch):
+
+    llm = LocalTransformersLLM(config=LLMConfig(provider="local", model_name="m", device="cpu",
+                                                max_tokens=64, temperature=0.0))
+    singles, batches = [], []
+    monkeypatch.setattr(llm, "_encode", lambda prompt: [ord(c) for c in prompt])
+    monkeypatch.setattr(llm, "_generate_single", lambda request, *_: singles.append(request.prompt))
+    monkeypatch.setattr(llm, "_generate_batch", lambda items: batches.append([r.prompt for r, _ in items]))
+
+    llm._process([
+        _Request("a", 16, 0.0, ()),
+        _Request("b", 16, 0.0, ()),
+        _Request("c", 256, 0.0, ()),
+        _Request("d", 16, 0.7, ()),
+        _Request("e", 256, 0.0, ()),
+    ])
+    assert sorted(batches) == [["a", "b"], ["c", "e"]]
+    assert singles == ["d"]
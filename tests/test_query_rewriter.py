@@ -0,0 +1,63 @@
+
+
+from src.kg.cypher_lexer import tokenize, significant, IDENT
+from src.rag.query_rewriter import ProjectionRewriter
+
+
+def _return_columns(cypher):
+
+    rewriter = ProjectionRewriter()
+    tokens = significant(tokenize(cypher))
+    start, end, _ = rewriter._find_return_items(tokens)
+    return [rewriter._item_alias(item) for item in rewriter._split_items(tokens, start, end)]
+
+
+def test_rewrites_whole_node_return():
+
+    result = ProjectionRewriter().rewrite("MATCH (c:Card) RETURN c ORDER BY c.elixir LIMIT 5")
+    assert result.rewritten
+    assert "c.name AS card" in result.cypher
+    assert result.cypher.endswith("ORDER BY c.elixir LIMIT 5")
+
+
+def test_keeps_alias_dereferenced_after_return():
+
+    cypher = "MATCH (c:Card) RETURN c AS card ORDER BY card.elixir"
+    result = ProjectionRewriter().rewrite(cypher)
+    assert not result.rewritten
+    assert result.cypher == cypher
+
+
+def test_keeps_variable_shadowed_by_generated_column():
+
+    cypher = "MATCH (card:Card) RETURN card ORDER BY card.elixir"
+    result = ProjectionRewriter().rewrite(cypher)
+    assert result.cypher == cypher
+
+
+def test_skips_projection_colliding_with_existing_alias():
+
+    cypher = "MATCH (c:Card) RETURN c, c.name AS card"
+    result = ProjectionRewriter().rewrite(cypher)
+    assert result.cypher == cypher
+    columns = _return_columns(result.cypher)
+    assert len(columns) == len(set(columns))
+
+
+def test_rewrites_only_non_colliding_entities():
+
+    cypher = "MATCH (c:Card)-[:COUNTERS]->(t:Card) RETURN c, t, c.name AS c_card"
+    result = ProjectionRewriter().rewrite(cypher)
+    assert result.rewritten
+    assert "t.name AS card" in result.cypher
+    assert result.cypher.startswith("MATCH (c:Card)-[:COUNTERS]->(t:Card) RETURN c, ")
+    columns = _return_columns(result.cypher)
+    assert len(columns) == len(set(columns))
+
+
+def test_prefixes_columns_of_several_entities():
+
+    result = ProjectionRewriter().rewrite("MATCH (c:Card)-[r:COUNTERS]->(t:Card) RETURN c, t")
+    columns = _return_columns(result.cypher)
+    assert "c_card" in columns and "t_card" in columns
+    assert len(columns) == len(set(columns))
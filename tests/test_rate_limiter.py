@@ -0,0 +1,187 @@
+
+
+import sqlite3
+import threading
+
+import pytest
+
+from src.rag import rate_limiter
+from src.rag.rate_limiter import RateLimiter, _MemoryBucketStore, _SQLiteBucketStore
+
+
+class FakeClock:
+
+    # Stands in for the time module: sleeping advances the clock instead of
+    # blocking, so waits are exact and instant.
+
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+        self.sleeps = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def time(self) -> float:
+        return self.now
+
+    def perf_counter(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limiter, "time", clock)
+    return clock
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path, clock):
+
+    if request.param == "memory":
+        return _MemoryBucketStore()
+    return _SQLiteBucketStore(str(tmp_path / "buckets.sqlite3"))
+
+
+def test_bucket_starts_full_then_reports_refill_delay(store, clock):
+
+    demand = {"p:requests": (3, 1.0, 1)}
+    assert [store.take(demand) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert store.take(demand) == pytest.approx(1.0)
+
+    clock.now += 0.5
+    assert store.take(demand) == pytest.approx(0.5)
+    clock.now += 0.5
+    assert store.take(demand) == 0.0
+
+
+def test_refill_is_capped_at_capacity(store, clock):
+
+    demand = {"p:requests": (2, 1.0, 1)}
+    store.take(demand)
+    store.take(demand)
+    clock.now += 60
+    assert [store.take(demand) for _ in range(2)] == [0.0, 0.0]
+    assert store.take(demand) == pytest.approx(1.0)
+
+
+def test_take_is_all_or_nothing_across_buckets(store, clock):
+
+    demands = {"p:requests": (10, 1.0, 1), "p:tokens": (100, 10.0, 80)}
+    assert store.take(demands) == 0.0
+    # Tokens are short by 60, i.e. 6s of refill; the request is not spent.
+    assert store.take(demands) == pytest.approx(6.0)
+    clock.now += 6
+    assert store.take(demands) == 0.0
+    assert store.take({"p:requests": (10, 1.0, 8)}) == 0.0
+
+
+def test_adjust_refunds_and_pauses(store, clock):
+
+    store.take({"p:tokens": (100, 10.0, 100)})
+    store.adjust("p:tokens", 100, 10.0, delta=40)
+    assert store.take({"p:tokens": (100, 10.0, 40)}) == 0.0
+
+    store.adjust("p:requests", 10, 1.0, pause=5)
+    assert store.take({"p:requests": (10, 1.0, 1)}) == pytest.approx(5.0)
+
+
+def test_sqlite_buckets_are_shared_between_stores(tmp_path, clock):
+
+    # Two stores on one file behave like two worker processes.
+    path = str(tmp_path / "shared.sqlite3")
+    first, second = _SQLiteBucketStore(path), _SQLiteBucketStore(path)
+    demand = {"p:requests": (2, 1.0, 1)}
+    assert first.take(demand) == 0.0
+    assert second.take(demand) == 0.0
+    assert first.take(demand) == pytest.approx(1.0)
+    assert second.take(demand) == pytest.approx(1.0)
+
+
+def test_sqlite_take_waits_for_another_writer(tmp_path, clock):
+
+    path = str(tmp_path / "locked.sqlite3")
+    store = _SQLiteBucketStore(path)
+    other = sqlite3.connect(path, isolation_level=None)
+    other.execute("BEGIN IMMEDIATE")
+
+    done = threading.Event()
+    worker = threading.Thread(target=lambda: (store.take({"p:requests": (1, 1.0, 1)}), done.set()))
+    worker.start()
+    # BEGIN IMMEDIATE blocks until the other writer commits.
+    assert not done.wait(0.2)
+    other.execute("COMMIT")
+    assert done.wait(5)
+    worker.join()
+    other.close()
+
+
+def test_sqlite_rolls_back_on_error(tmp_path, clock):
+
+    store = _SQLiteBucketStore(str(tmp_path / "rollback.sqlite3"))
+    with pytest.raises(RuntimeError):
+        with store._transaction():
+            store._save({"p:requests": (0.0, clock.now)})
+            raise RuntimeError("boom")
+    assert store.take({"p:requests": (1, 1.0, 1)}) == 0.0
+
+
+@pytest.fixture(params=[False, True], ids=["memory", "sqlite"])
+def limiter_factory(request, tmp_path, clock):
+
+    def build(**kwargs):
+        return RateLimiter("p", shared=request.param, path=str(tmp_path / "limits.sqlite3"), **kwargs)
+    return build
+
+
+def test_acquire_sleeps_until_the_request_budget_refills(limiter_factory, clock):
+
+    limiter = limiter_factory(requests_per_minute=2, tokens_per_minute=0)
+    limiter.acquire()
+    limiter.acquire()
+    assert clock.sleeps == []
+    limiter.acquire()
+    assert sum(clock.sleeps) == pytest.approx(30.0)
+    stats = limiter.get_stats()
+    assert stats["acquired"] == 3
+    assert stats["queued"] == 1
+    assert stats["queue_depth"] == 0
+
+
+def test_settle_refunds_over_reserved_tokens(limiter_factory, clock):
+
+    limiter = limiter_factory(requests_per_minute=0, tokens_per_minute=600)
+    assert limiter.acquire(500) == 500
+    limiter.settle(500, 100)
+    assert limiter.get_stats()["refunded_tokens"] == 400
+    limiter.acquire(500)
+    assert clock.sleeps == []
+
+
+def test_oversized_call_is_capped_at_the_minute_budget(limiter_factory, clock):
+
+    limiter = limiter_factory(requests_per_minute=0, tokens_per_minute=100)
+    assert limiter.acquire(1000) == 100
+
+
+def test_throttle_holds_every_caller(limiter_factory, clock):
+
+    limiter = limiter_factory(requests_per_minute=60, tokens_per_minute=0)
+    limiter.throttle(5)
+    limiter.acquire()
+    assert sum(clock.sleeps) == pytest.approx(5.0)
+    assert limiter.get_stats()["throttled"] == 1
+
+
+def test_disabled_limiter_never_waits(limiter_factory, clock):
+
+    limiter = limiter_factory(requests_per_minute=0, tokens_per_minute=0)
+    for _ in range(100):
+        limiter.acquire(10_000)
+    assert clock.sleeps == []
+    assert limiter.get_stats()["acquired"] == 0
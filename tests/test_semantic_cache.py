@@ -0,0 +1,67 @@
+
+
+import pytest
+
+from src.kg.schema import KGSchema
+from src.rag.semantic_cache import SemanticTranslationCache
+
+
+CARDS = ["Giant", "Golem", "P.E.K.K.A.", "Hog Rider", "Musketeer", "Wizard", "Archer Queen"]
+
+
+def _counter_query(card):
+
+    return next(
+        e["cypher"] for e in KGSchema.get_cypher_examples() if "COUNTERS" in e["cypher"]
+    ).replace("'P.E.K.K.A.'", f"'{card}'")
+
+
+@pytest.fixture
+def cache():
+
+    examples = KGSchema.get_cypher_examples()
+    return SemanticTranslationCache(
+        lambda: CARDS, threshold=0.85,
+        seed=lambda: [(e["question"], e["cypher"]) for e in examples],
+    )
+
+
+@pytest.mark.parametrize("question, card", [
+    ("what beats Giant", "Giant"),
+    ("counters for giant?", "Giant"),
+    ("how do I stop the Giant", "Giant"),
+    ("What cards counter Giant?", "Giant"),
+    ("Which cards can counter Golem?", "Golem"),
+    ("what counters Giant", "Giant"),
+])
+def test_paraphrases_reuse_the_counter_template(cache, question, card):
+
+    assert cache.get(question) == _counter_query(card)
+
+
+@pytest.mark.parametrize("question", [
+    "What does Giant counter?",
+    "What is Giant countered by?",
+])
+def test_reversed_direction_misses(cache, question):
+
+    assert cache.get(question) is None
+
+
+def test_synergy_paraphrase_keeps_its_own_template(cache):
+
+    cypher = cache.get("Which cards go well with Hog Rider?")
+    assert "SYNERGIZES_WITH" in cypher and "'Hog Rider'" in cypher
+
+
+def test_different_filter_value_misses(cache):
+
+    assert cache.get("What are all Epic cards?") is None
+    assert cache.get("What are all Legendary cards?") is not None
+
+
+def test_different_number_misses(cache):
+
+    cache.put("Which cards cost more than 4 elixir?",
+              "MATCH (c:Card) WHERE c.elixir > 4 RETURN c.name AS card", True)
+    assert cache.get("Which cards cost more than 6 elixir?") is None
@@ -4,10 +4,10 @@ from fastapi import FastAPI, Request
 from fastapi.responses import HTMLResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
+from starlette.concurrency import iterate_in_threadpool
 from pathlib import Path
 
-from src.rag.llm import llm
-from src.rag.pipeline import RAGPipeline
+from src.rag.llm import get_llm, get_stage_llms
 
 app = FastAPI(title="Clash Royale KG RAG")
 
@@ -19,7 +19,9 @@ templates = Jinja2Templates(directory=str(BASE_DIR / "templates"))
 app.mount("/static", StaticFiles(directory=str(BASE_DIR / "static")), name="static")
 
 
-pipeline = RAGPipeline(llm, verbose=False)
+# Built by the startup hook, not at import, so importing the app (and every
+# worker process doing so) stays cheap.
+pipeline = None
 
 
 @app.get("/", response_class=HTMLResponse)
@@ -33,7 +35,9 @@ async def chat_stream(question: str):
     
     async def event_generator():
         try:
-            for event_type, data in pipeline.query_with_streaming(question):
+            # The pipeline blocks on Neo4j and the LLM; step it in a worker
+            # thread so other requests keep being served.
+            async for event_type, data in iterate_in_threadpool(pipeline.query_with_streaming(question)):
 
                 if event_type == "done":
 
@@ -66,6 +70,10 @@ async def chat_stream(question: str):
 @app.on_event("startup")
 async def startup_event():
     
+    global pipeline
+    from src.rag.pipeline import RAGPipeline
+
+    pipeline = RAGPipeline(get_llm(), verbose=False, stage_llms=get_stage_llms())
     if pipeline.test_connection():
         print("[OK] Connected to Neo4j knowledge graph")
     else:
@@ -75,7 +83,8 @@ async def startup_event():
 @app.on_event("shutdown")
 async def shutdown_event():
     
-    pipeline.close()
+    if pipeline is not None:
+        pipeline.close()
     print("[OK] Pipeline closed")
 
 